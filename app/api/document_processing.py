@@ -1,13 +1,16 @@
 from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, BackgroundTasks
 from app.models.database import *
 from app.services.database_service import database_service
-from app.tasks.document_tasks import process_document_quick_detection, get_document_processing_status
+from app.services.document_scheduler import document_scheduler, INTERACTIVE_LANE, BULK_LANE
+from app.services.ocr_cache_service import compute_content_hash
+from app.tasks.document_tasks import submit_quick_detection, get_document_processing_status
 from app.utils.auth import get_current_user_with_org, UserContext, log_user_action
 from app.utils.exceptions import DocumentProcessingError, ValidationError
 from app.utils.logging_config import get_structured_logger
 from typing import Dict, Any, List
 import uuid
 from datetime import datetime
+import asyncio
 import io
 
 router = APIRouter(prefix="/api/v1/documents", tags=["Document Processing"])
@@ -19,6 +22,7 @@ async def upload_document(
     background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     document_type_id: str = None,
+    bulk: bool = False,
     user: UserContext = Depends(get_current_user_with_org)
 ):
     """
@@ -28,7 +32,7 @@ async def upload_document(
     1. Validates the uploaded file
     2. Stores it in Supabase storage
     3. Creates a document record in the database
-    4. Queues it for quick detection processing
+    4. Queues it for quick detection processing (in the bulk lane for backfills)
     """
     try:
         # Require organization context
@@ -62,7 +66,8 @@ async def upload_document(
                 document_type_id=uuid.UUID(document_type_id) if document_type_id else None,
                 filename=file.filename,
                 storage_path=storage_path,
-                mime_type=file.content_type or "application/pdf"
+                mime_type=file.content_type or "application/pdf",
+                hash=compute_content_hash(file_content)
             )
             
             document = await database_service.create_document(
@@ -83,21 +88,25 @@ async def upload_document(
             )
             
             # Queue for processing
-            task = process_document_quick_detection.delay(
+            submission = await asyncio.to_thread(
+                submit_quick_detection,
                 str(document.id),
-                str(user.user_id)
+                str(user.user_id),
+                content_hash=doc_create.hash,
+                org_id=str(org.id),
+                lane=BULK_LANE if bulk else INTERACTIVE_LANE
             )
             
             structured_logger.info("Document uploaded and queued for processing",
                                  document_id=str(document.id),
-                                 task_id=task.id,
+                                 task_id=submission["task_id"],
                                  filename=file.filename)
             
             return {
                 "document_id": str(document.id),
                 "filename": file.filename,
                 "status": document.ocr_status.value,
-                "task_id": task.id,
+                "task_id": submission["task_id"],
                 "storage_path": storage_path,
                 "uploaded_at": document.uploaded_at.isoformat(),
                 "message": "Document uploaded successfully and queued for processing"
@@ -147,6 +156,49 @@ async def get_document_status(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/{document_id}/queue-position", response_model=Dict[str, Any])
+async def get_document_queue_position(
+    document_id: str,
+    user: UserContext = Depends(get_current_user_with_org)
+):
+    """
+    Get a queued document's place in line and estimated start time
+    
+    Documents wait in the fair scheduler until pipeline capacity frees up; the estimate
+    assumes the current queue and the average pipeline duration.
+    """
+    try:
+        document_uuid = uuid.UUID(document_id)
+        
+        # Get document and verify access
+        document = await database_service.get_document(document_uuid)
+        if not document:
+            raise HTTPException(status_code=404, detail="Document not found")
+        
+        if not user.can_access_document(document):
+            raise HTTPException(status_code=403, detail="Access denied to document")
+        
+        position = await asyncio.to_thread(document_scheduler.queue_position, document_id)
+        if position is None:
+            return {
+                "document_id": document_id,
+                "state": "not_queued",
+                "status": document.ocr_status.value
+            }
+        
+        return position
+        
+    except HTTPException:
+        raise
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid document ID format")
+    except Exception as e:
+        structured_logger.error("Failed to get document queue position",
+                              document_id=document_id,
+                              error=str(e))
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @router.get("/{document_id}", response_model=Dict[str, Any])
 async def get_document_details(
     document_id: str,
@@ -360,9 +412,16 @@ async def search_document_content(
 async def reprocess_document(
     document_id: str,
     background_tasks: BackgroundTasks,
+    force: bool = False,
+    bulk: bool = False,
     user: UserContext = Depends(get_current_user_with_org)
 ):
-    """Reprocess a document (useful for failed or error status documents)"""
+    """
+    Reprocess a document (useful for failed or error status documents)
+    
+    A document already being processed is not queued twice, and one already processed
+    for its current content is left as is unless force is set.
+    """
     try:
         document_uuid = uuid.UUID(document_id)
         
@@ -374,15 +433,33 @@ async def reprocess_document(
         if not user.can_modify_document(document):
             raise HTTPException(status_code=403, detail="Insufficient permissions to reprocess document")
         
-        # Reset status to queued
-        await database_service.update_document_ocr_status(document_uuid, OcrStatus.QUEUED)
+        # Reset status to queued, unless the request will attach to a run in progress or
+        # find the document already processed
+        if document.ocr_status != OcrStatus.PROCESSING and (force or document.ocr_status != OcrStatus.COMPLETED):
+            await database_service.update_document_ocr_status(document_uuid, OcrStatus.QUEUED)
         
         # Queue for processing
-        task = process_document_quick_detection.delay(
+        submission = await asyncio.to_thread(
+            submit_quick_detection,
             str(document.id),
-            str(user.user_id)
+            str(user.user_id),
+            content_hash=document.hash,
+            force=force,
+            org_id=str(document.org_id),
+            lane=BULK_LANE if bulk else INTERACTIVE_LANE
         )
         
+        if submission["deduplicated"]:
+            return {
+                "document_id": document_id,
+                "status": submission["status"],
+                "task_id": submission["task_id"],
+                "message": (
+                    "Document is already being processed" if submission["status"] == "in_progress"
+                    else "Document already processed; pass force=true to reprocess it"
+                )
+            }
+        
         # Log the action
         await log_user_action(
             user=user,
@@ -393,13 +470,13 @@ async def reprocess_document(
         
         structured_logger.info("Document queued for reprocessing",
                              document_id=document_id,
-                             task_id=task.id,
+                             task_id=submission["task_id"],
                              user_id=str(user.user_id))
         
         return {
             "document_id": document_id,
             "status": "queued",
-            "task_id": task.id,
+            "task_id": submission["task_id"],
             "message": "Document queued for reprocessing"
         }
         
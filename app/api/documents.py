@@ -2,7 +2,11 @@ from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends
 from fastapi.responses import JSONResponse
 from app.models.document import *
 from app.services.supabase_service import supabase_service
+from app.services.ocr_cache_service import compute_content_hash
+from app.services.detection_rules import detection_rule_service
+from app.utils.auth import require_superadmin, UserContext
 from app.config import settings
+import asyncio
 import uuid
 import os
 import aiofiles
@@ -24,8 +28,9 @@ async def upload_document(
     client_info: Optional[str] = Form(None),
     org_id: str = Form(...),
     user_id: Optional[str] = Form(None),
+    bulk: bool = Form(False),
 ):
-    """Upload document and start processing pipeline"""
+    """Upload document and start processing pipeline (bulk: queue it in the backfill lane)"""
     
     document_id = None
     file_path = None
@@ -81,7 +86,8 @@ async def upload_document(
             # Simple metadata with only essential fields
             metadata = {
                 'filename': file.filename,
-                'file_size': file_size
+                'file_size': file_size,
+                'content_hash': compute_content_hash(file_content).hex()
             }
             
             # Add optional fields only if provided
@@ -113,8 +119,16 @@ async def upload_document(
             raise HTTPException(status_code=500, detail=f"Database operation failed: {str(db_error)}")
         
         # Queue for quick document detection (Stage 0A)
-        from app.tasks.document_tasks import process_document_quick_detection
-        process_document_quick_detection.delay(document_id, user_id)
+        from app.tasks.document_tasks import submit_quick_detection
+        from app.services.document_scheduler import INTERACTIVE_LANE, BULK_LANE
+        await asyncio.to_thread(
+            submit_quick_detection,
+            document_id,
+            user_id,
+            content_hash=metadata['content_hash'],
+            org_id=org_id,
+            lane=BULK_LANE if bulk else INTERACTIVE_LANE
+        )
         
         # Success response
         logger.info(f"Upload completed successfully for document: {document_id}")
@@ -183,6 +197,17 @@ async def get_document_status(document_id: str):
             else:
                 response['detection']['confidence_level'] = 'low'
                 response['detection']['requires_confirmation'] = True
+        elif 'provisional_detection' in parsed_index:
+            # Classified from the pages read so far; the final result replaces it
+            provisional = parsed_index['provisional_detection']
+            response['detection'] = {
+                "detected_type": provisional.get('document_type_detected'),
+                "confidence": provisional.get('confidence', 0.0),
+                "provisional": True,
+                "chars_seen": provisional.get('chars_seen'),
+                "processed_at": provisional.get('detected_at'),
+                "requires_confirmation": True
+            }
         
         # Add processing history if available
         if 'processing_history' in parsed_index:
@@ -227,6 +252,16 @@ async def validate_document(document_id: str, validation: DocumentValidationRequ
         logger.error(f"Error validating document: {e}")
         raise HTTPException(status_code=500, detail=f"Validation failed: {str(e)}")
 
+@router.post("/detection-rules/invalidate")
+async def invalidate_detection_rules(user: UserContext = Depends(require_superadmin())):
+    """Make workers reload detection rules after document_types or sections change (superadmins only)"""
+    generation = await asyncio.to_thread(detection_rule_service.invalidate)
+    return {
+        "status": "invalidated" if generation is not None else "pending_refresh",
+        "generation": generation,
+        "refresh_seconds": detection_rule_service.refresh_seconds
+    }
+
 @router.get("/test-table")
 async def test_table():
     """Test what columns exist in documents table"""
@@ -304,9 +339,24 @@ async def start_document_detection(
                 detail=f"Document is in {document.get('ocr_status')} state, cannot start detection"
             )
         
-        # Queue the detection task
-        from app.tasks.document_tasks import process_document_quick_detection
-        task = process_document_quick_detection.delay(document_id, request.user_id or user_id)
+        # Queue the detection task (a repeated request attaches to the one in flight)
+        from app.tasks.document_tasks import submit_quick_detection
+        submission = await asyncio.to_thread(
+            submit_quick_detection,
+            document_id,
+            request.user_id or user_id,
+            content_hash=document.get('hash'),
+            force=request.force,
+            org_id=document.get('org_id')
+        )
+        
+        if submission["status"] == "completed":
+            return DocumentDetectionResponse(
+                document_id=document_id,
+                status=DocumentStatus.DETECTION_COMPLETE,
+                message=f"Document detection already completed (task {submission['task_id']}); set force to re-run it",
+                processing_time_ms=None
+            )
         
         # Update status to detecting
         await supabase_service.update_document_status(document_id, 'detecting')
@@ -314,7 +364,10 @@ async def start_document_detection(
         return DocumentDetectionResponse(
             document_id=document_id,
             status=DocumentStatus.DETECTING,
-            message="Document detection started successfully",
+            message=(
+                f"Document detection already in progress (task {submission['task_id']})"
+                if submission["deduplicated"] else "Document detection started successfully"
+            ),
             processing_time_ms=None
         )
         
@@ -476,7 +529,7 @@ async def manual_detection_trigger(document_id: str):
         
         # Import the detection task function directly
         from app.tasks.document_tasks import process_document_quick_detection
-        from app.services.azure_service import AzureDocumentIntelligenceService
+        from app.services.azure_service import azure_service
         from app.services.detection_service import DetectionService
         from app.services.supabase_service import SupabaseService
         
@@ -494,8 +547,7 @@ async def manual_detection_trigger(document_id: str):
             {"processing_stage": "detecting"}
         )
         
-        # Initialize services
-        azure_service = AzureDocumentIntelligenceService()
+        # Initialize services (Azure client is shared so its connection pool is reused)
         nmtc_detector = DetectionService()
         
         # Download PDF from Supabase Storage
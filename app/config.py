@@ -1,6 +1,6 @@
 import os
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import Dict, Optional
 
 class Settings(BaseSettings):
     # Environment
@@ -15,6 +15,38 @@ class Settings(BaseSettings):
     # Azure Document Intelligence
     AZURE_DOC_INTELLIGENCE_ENDPOINT: str
     AZURE_DOC_INTELLIGENCE_KEY: str
+    AZURE_DOC_INTELLIGENCE_API_VERSION: str = "2023-10-31-preview"
+    AZURE_MAX_CONNECTIONS: int = 100  # Pooled connections per worker event loop
+    AZURE_SHARD_PAGES: int = 50  # PDFs with more pages are read as parallel page-range shards; 0 disables
+    AZURE_SHARD_MAX_CONCURRENCY: int = 4  # Shards of one document in flight at once
+    AZURE_SHARD_MAX_RETRIES: int = 2  # Retries per failed shard
+    AZURE_POLL_MIN_INTERVAL_SECONDS: float = 0.5  # First poll delay for a one-page document
+    AZURE_POLL_SECONDS_PER_PAGE: float = 0.05  # Added to the first poll delay per page
+    AZURE_POLL_MAX_INTERVAL_SECONDS: float = 10.0
+    AZURE_POLL_BACKOFF: float = 1.5  # Poll delay multiplier when the service sends no Retry-After
+    AZURE_DEADLINE_BASE_SECONDS: int = 60  # Per-document deadline, capped by PROCESSING_TIMEOUT_SECONDS
+    AZURE_DEADLINE_SECONDS_PER_PAGE: float = 2.0
+    AZURE_RESUME_OPERATIONS: bool = True  # Persist in-flight operations in Redis so retried tasks resume them
+    AZURE_OPERATION_TTL_SECONDS: int = 24 * 3600  # Azure keeps analyze results for 24 hours
+    
+    # Client-side Azure rate limiting, shared across workers through Redis
+    AZURE_RATE_LIMIT_ENABLED: bool = True
+    AZURE_RATE_LIMIT_PER_SECOND: float = 15.0  # Analyze submissions per second per model
+    AZURE_RATE_LIMIT_BURST: int = 15
+    AZURE_MAX_IN_FLIGHT: int = 20  # Concurrent operations per model
+    AZURE_RATE_LIMIT_MAX_WAIT_SECONDS: float = 30.0  # Queue this long before failing with 429
+    AZURE_RATE_LIMIT_OVERRIDES: Dict[str, Dict[str, float]] = {}  # e.g. {"prebuilt-layout": {"rate_per_second": 5, "max_in_flight": 8}}
+    
+    # Circuit breakers around Azure and Supabase (per worker process)
+    CIRCUIT_BREAKER_FAILURE_RATE: float = 0.5  # Open when this share of recent calls failed
+    CIRCUIT_BREAKER_SLOW_CALL_RATE: float = 0.8  # ...or this share ran slower than the slow-call threshold
+    CIRCUIT_BREAKER_WINDOW_SIZE: int = 20
+    CIRCUIT_BREAKER_MINIMUM_CALLS: int = 10
+    CIRCUIT_BREAKER_OPEN_SECONDS: float = 30.0  # Fail fast this long before letting probe calls through
+    CIRCUIT_BREAKER_MAX_DEFERRALS: int = 10  # Times a task is deferred for an open circuit on top of its retries
+    AZURE_BREAKER_SLOW_CALL_SECONDS: float = 30.0  # Whole-document analysis: this much...
+    AZURE_BREAKER_SLOW_CALL_SECONDS_PER_PAGE: float = 1.5  # ...plus this per page counts as slow
+    SUPABASE_BREAKER_SLOW_CALL_SECONDS: float = 10.0  # Single query
     
     # Redis & Celery
     REDIS_URL: str
@@ -24,11 +56,52 @@ class Settings(BaseSettings):
     CELERY_BROKER_URL: str
     CELERY_RESULT_BACKEND: str
     
+    # Staged document pipeline: one worker per queue (python -m app.tasks.queues <queue>)
+    WORKER_IO_POOL: str = "threads"  # threads | gevent | eventlet
+    WORKER_IO_CONCURRENCY: int = 32
+    WORKER_IO_PREFETCH: int = 4
+    WORKER_OCR_POOL: str = "threads"
+    WORKER_OCR_CONCURRENCY: int = 32
+    WORKER_OCR_PREFETCH: int = 1
+    WORKER_CPU_CONCURRENCY: int = 0  # Prefork processes; 0 = one per core
+    WORKER_DB_POOL: str = "threads"
+    WORKER_DB_CONCURRENCY: int = 16
+    WORKER_DB_PREFETCH: int = 4
+    WORKER_BATCH_PROCESSES: int = 0  # Detection processes per batch task; 0 = one per core
+    PIPELINE_PAYLOAD_TTL_SECONDS: int = 6 * 3600  # Document bytes and OCR results passed between stages
+    PIPELINE_COMPLETED_TTL_SECONDS: int = 30 * 24 * 3600  # Resubmitting a completed document is a no-op this long (unless forced)
+    PIPELINE_STAGE_RETRY_OVERRIDES: Dict[str, Dict[str, int]] = {}  # e.g. {"ocr": {"max_retries": 5, "max_delay": 3600}}
+    
+    # Fair scheduling of quick detection: priority lanes, weighted across organizations
+    SCHEDULER_ENABLED: bool = True  # False submits straight to Celery
+    SCHEDULER_MAX_IN_FLIGHT: int = 32  # Documents in the pipeline at once, all organizations together
+    SCHEDULER_ORG_MAX_IN_FLIGHT: int = 8  # ...and per organization
+    SCHEDULER_INTERACTIVE_ORG_MAX_QUEUED: int = 20  # Interactive submissions beyond this many queued per org go to the bulk lane
+    SCHEDULER_PLAN_WEIGHTS: Dict[str, float] = {"starter": 1.0, "professional": 2.0, "enterprise": 4.0}  # By plan_types.key
+    SCHEDULER_DEFAULT_WEIGHT: float = 1.0  # Organizations without an active plan
+    SCHEDULER_OVER_LIMIT_WEIGHT_FACTOR: float = 0.25  # Weight multiplier once the month's documents pass the plan limit
+    SCHEDULER_WEIGHT_TTL_SECONDS: int = 600
+    SCHEDULER_IN_FLIGHT_TIMEOUT_SECONDS: int = 2 * 3600  # A slot never reported finished is reclaimed after this
+    SCHEDULER_DEFAULT_DURATION_SECONDS: float = 60.0  # Pipeline duration assumed by start estimates until measured
+    
     # Application Settings
     MAX_FILE_SIZE_MB: int = 50
     PROCESSING_TIMEOUT_SECONDS: int = 300
     ALLOWED_FILE_TYPES: str = "pdf"
     
+    # OCR Result Cache (keyed on document SHA-256 + model id + API version)
+    OCR_CACHE_BACKEND: str = "disk"  # disk | redis | none
+    OCR_CACHE_DIR: str = "/tmp/nmtc-ocr-cache"
+    OCR_CACHE_TTL_SECONDS: int = 7 * 24 * 3600
+    OCR_CACHE_MAX_BYTES: int = 1024 * 1024 * 1024
+    
+    # Detection patterns from the document_types / sections tables
+    DETECTION_RULES_ENABLED: bool = True
+    DETECTION_RULES_REFRESH_SECONDS: int = 300  # Longest a worker goes without checking for rule edits
+    
+    # Persist per-word OCR confidences as a compressed float32 blob alongside the summary
+    OCR_STORE_CONFIDENCE_BLOB: bool = False
+    
     # Security Settings (optional)
     SECRET_KEY: Optional[str] = "dev-secret-key-change-in-production"
     ALGORITHM: str = "HS256"
@@ -1,6 +1,9 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.api import documents  # Import the documents router
+from app.services.azure_service import azure_service
+from app.services.rate_limiter import azure_rate_limiter
+from app.utils.circuit_breaker import get_breaker_states
 import os
 from dotenv import load_dotenv
 
@@ -28,6 +31,11 @@ app.add_middleware(
 # Include API routers
 app.include_router(documents.router)
 
+@app.on_event("shutdown")
+async def shutdown_azure_client():
+    """Release the pooled Azure Document Intelligence connections"""
+    await azure_service.close()
+
 @app.get("/")
 def root():
     return {
@@ -38,12 +46,21 @@ def root():
 
 @app.get("/health")
 def health_check():
+    # Breakers of this web process only; each Celery worker process trips its own
+    circuit_breakers = get_breaker_states()
+    degraded = any(breaker["state"] != "closed" for breaker in circuit_breakers.values())
     return {
-        "status": "healthy",
+        "status": "degraded" if degraded else "healthy",
         "environment": os.getenv("ENV", "development"),
         "services": {
             "redis": "connected" if os.getenv("REDIS_URL") else "not configured",
             "azure": "configured" if os.getenv("AZURE_DOC_INTELLIGENCE_KEY") else "not configured",
             "supabase": "configured" if os.getenv("SUPABASE_URL") else "not configured"
-        }
-    }
\ No newline at end of file
+        },
+        "circuit_breakers": circuit_breakers
+    }
+
+@app.get("/metrics/azure")
+def azure_metrics():
+    """Azure Document Intelligence rate limiter state: tokens, in-flight operations, queue depth, waits"""
+    return {"rate_limiter": azure_rate_limiter.get_metrics()}
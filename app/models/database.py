@@ -78,6 +78,10 @@ class PromptVariableSource(str, Enum):
     COMPUTED = "computed"
 
 
+# org_id_eff of template rows (org_id is null), shared by every organization
+TEMPLATE_ORG_ID = uuid.UUID(int=0)
+
+
 # Base Model
 class BaseDBModel(BaseModel):
     id: uuid.UUID = Field(default_factory=uuid.uuid4)
@@ -196,6 +200,13 @@ class Document(BaseDBModel):
     ocr_status: OcrStatus = OcrStatus.QUEUED
     parsed_index: Optional[Dict[str, Any]] = None
 
+    @validator('hash', pre=True)
+    def decode_hash(cls, v):
+        # PostgREST returns bytea columns as "\\x"-prefixed hex strings
+        if isinstance(v, str) and v.startswith('\\x'):
+            return bytes.fromhex(v[2:])
+        return v
+
 
 class Section(BaseDBModel):
     """sections table"""
@@ -568,6 +579,7 @@ class DocumentUpdate(BaseModel):
     document_type_id: Optional[uuid.UUID] = None
     ocr_status: Optional[OcrStatus] = None
     parsed_index: Optional[Dict[str, Any]] = None
+    hash: Optional[bytes] = None
 
 
 class ObligationCreate(BaseModel):
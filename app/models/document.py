@@ -82,4 +82,5 @@ class DocumentValidationRequest(BaseModel):
     user_notes: Optional[str] = None
 
 class StartDetectionRequest(BaseModel):
-    user_id: Optional[str] = None
\ No newline at end of file
+    user_id: Optional[str] = None
+    force: bool = False  # Re-run stages that already completed for this document's content
@@ -0,0 +1,121 @@
+"""
+Polling control for Azure Document Intelligence long-running operations.
+Poll intervals adapt to document size and honor Retry-After, and every operation
+records how long was spent waiting between polls versus being processed by Azure.
+"""
+from azure.core.polling.async_base_polling import AsyncLROBasePolling
+from azure.core.polling.base_polling import get_retry_after
+from app.config import settings
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Any, Optional
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Rough page estimate for documents whose page count is unknown (images, unparseable PDFs)
+ESTIMATED_BYTES_PER_PAGE = 100 * 1024
+
+
+def estimate_page_count(document_size: int, page_count: Optional[int] = None) -> int:
+    """Known page count, or an estimate from the document size"""
+    if page_count:
+        return page_count
+    return max(1, document_size // ESTIMATED_BYTES_PER_PAGE)
+
+
+def initial_poll_interval(page_count: int) -> float:
+    """First poll delay: short documents are checked almost immediately, long ones later"""
+    interval = settings.AZURE_POLL_MIN_INTERVAL_SECONDS + settings.AZURE_POLL_SECONDS_PER_PAGE * page_count
+    return min(interval, settings.AZURE_POLL_MAX_INTERVAL_SECONDS)
+
+
+def slow_call_threshold(page_count: int) -> float:
+    """Duration past which an analysis of page_count pages counts as slow for the circuit breaker"""
+    return settings.AZURE_BREAKER_SLOW_CALL_SECONDS + settings.AZURE_BREAKER_SLOW_CALL_SECONDS_PER_PAGE * page_count
+
+
+def analysis_deadline(page_count: int) -> float:
+    """Per-document deadline in seconds, never beyond PROCESSING_TIMEOUT_SECONDS"""
+    deadline = settings.AZURE_DEADLINE_BASE_SECONDS + settings.AZURE_DEADLINE_SECONDS_PER_PAGE * page_count
+    return float(min(deadline, settings.PROCESSING_TIMEOUT_SECONDS))
+
+
+@dataclass
+class PollingStats:
+    """Timing of the Azure operations behind one analysis (summed across shards)"""
+    operations: int = 0
+    poll_count: int = 0
+    wait_seconds: float = 0.0
+    service_seconds: float = 0.0
+    operation_seconds: float = 0.0
+    limiter_wait_seconds: float = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "operations": self.operations,
+            "poll_count": self.poll_count,
+            "poll_wait_ms": self.wait_seconds * 1000,
+            "service_processing_ms": self.service_seconds * 1000,
+            "operation_ms": self.operation_seconds * 1000,
+            "limiter_wait_ms": self.limiter_wait_seconds * 1000
+        }
+
+
+class AdaptivePolling(AsyncLROBasePolling):
+    """
+    LRO polling with a page-count based first delay and geometric backoff
+
+    A Retry-After header from the service always takes precedence over the computed delay.
+    """
+
+    def __init__(self, initial_interval: float, stats: PollingStats, **kwargs):
+        super().__init__(timeout=initial_interval, **kwargs)
+        self._next_interval = initial_interval
+        self._stats = stats
+        self._started_at = time.monotonic()
+
+    def initialize(self, client, initial_response, deserialization_callback) -> None:
+        self._started_at = time.monotonic()
+        self._stats.operations += 1
+        super().initialize(client, initial_response, deserialization_callback)
+
+    @property
+    def operation_location(self) -> Optional[str]:
+        """Operation-Location of the submitted analysis, used to check on it later"""
+        return self._initial_response.http_response.headers.get("Operation-Location")
+
+    def _extract_delay(self) -> float:
+        retry_after = get_retry_after(self._pipeline_response)
+        if retry_after:
+            return retry_after
+
+        delay = self._next_interval
+        self._next_interval = min(delay * settings.AZURE_POLL_BACKOFF, settings.AZURE_POLL_MAX_INTERVAL_SECONDS)
+        return delay
+
+    async def _sleep(self, delay: float) -> None:
+        self._stats.wait_seconds += delay
+        await super()._sleep(delay)
+
+    async def update_status(self) -> None:
+        self._stats.poll_count += 1
+        await super().update_status()
+
+    async def run(self) -> None:
+        try:
+            await super().run()
+        finally:
+            self._stats.operation_seconds += time.monotonic() - self._started_at
+            self._stats.service_seconds += self._service_seconds()
+
+    def _service_seconds(self) -> float:
+        """Server-side processing time from the operation's created/last-updated timestamps"""
+        try:
+            body = self._pipeline_response.http_response.json()
+            created = datetime.fromisoformat(body["createdDateTime"].replace("Z", "+00:00"))
+            updated = datetime.fromisoformat(body["lastUpdatedDateTime"].replace("Z", "+00:00"))
+            return max(0.0, (updated - created).total_seconds())
+        except Exception:
+            return 0.0
@@ -1,16 +1,34 @@
-from azure.ai.documentintelligence import DocumentIntelligenceClient
-from azure.ai.documentintelligence.models import AnalyzeDocumentRequest, ContentFormat
+from azure.ai.documentintelligence.aio import DocumentIntelligenceClient
+from azure.ai.documentintelligence.models import ContentFormat
 from azure.core.credentials import AzureKeyCredential
 from azure.core.exceptions import AzureError, HttpResponseError
+from azure.core.pipeline.transport import AioHttpTransport
+from azure.core.rest import HttpRequest
 from app.config import settings
-from app.utils.exceptions import ExternalServiceError, ConfigurationError
-from typing import Dict, Any, List, Optional, Union
+from app.services.ocr_cache_service import ocr_cache, compute_content_hash
+from app.services.operation_store import operation_store
+from app.services.rate_limiter import azure_rate_limiter
+from app.services.azure_polling import (
+    AdaptivePolling, PollingStats, analysis_deadline, estimate_page_count, initial_poll_interval,
+    slow_call_threshold
+)
+from app.utils.exceptions import ExternalServiceError, ConfigurationError, RateLimitExceededError
+from app.utils.circuit_breaker import azure_breaker, CircuitOpenError
+from app.utils.confidence_stats import (
+    to_confidence_array, confidence_histogram, summarize_confidences, encode_confidence_blob
+)
+from typing import Dict, Any, List, Optional, Tuple, Union, Callable, Awaitable
+from types import SimpleNamespace
+from PyPDF2 import PdfReader, PdfWriter
 import logging
 import uuid
 from datetime import datetime
 import io
 import time
-import base64
+import asyncio
+import weakref
+import aiohttp
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
@@ -37,12 +55,13 @@ class AzureDocumentIntelligenceService:
             
             self.endpoint = settings.AZURE_DOC_INTELLIGENCE_ENDPOINT
             self.key = settings.AZURE_DOC_INTELLIGENCE_KEY
+            self.credential = AzureKeyCredential(self.key)
+            self.api_version = settings.AZURE_DOC_INTELLIGENCE_API_VERSION
             
-            # Initialize the client
-            self.client = DocumentIntelligenceClient(
-                endpoint=self.endpoint,
-                credential=AzureKeyCredential(self.key)
-            )
+            # Async clients are bound to the event loop that created their
+            # aiohttp session, so one shared client is kept per running loop
+            self._clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, DocumentIntelligenceClient]" = weakref.WeakKeyDictionary()
+            self._sessions: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, aiohttp.ClientSession]" = weakref.WeakKeyDictionary()
             
             logger.info(f"Azure Document Intelligence service initialized at {self.endpoint}")
             
@@ -50,9 +69,47 @@ class AzureDocumentIntelligenceService:
             logger.error(f"Failed to initialize Azure Document Intelligence service: {e}")
             raise ConfigurationError(f"Failed to initialize Azure Document Intelligence: {e}")
     
+    async def get_client(self) -> DocumentIntelligenceClient:
+        """Get the shared async client for the running event loop, creating it on first use"""
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is not None:
+            return client
+        
+        # One pooled aiohttp session per loop; every analysis on this loop reuses its connections
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=settings.AZURE_MAX_CONNECTIONS),
+            cookie_jar=aiohttp.DummyCookieJar(),
+            auto_decompress=False
+        )
+        client = DocumentIntelligenceClient(
+            endpoint=self.endpoint,
+            credential=self.credential,
+            api_version=self.api_version,
+            transport=AioHttpTransport(session=session, session_owner=False)
+        )
+        
+        self._sessions[loop] = session
+        self._clients[loop] = client
+        logger.info(f"Created async Azure Document Intelligence client, max connections: {settings.AZURE_MAX_CONNECTIONS}")
+        return client
+    
+    async def close(self) -> None:
+        """Close the client and connection pool owned by the running event loop"""
+        loop = asyncio.get_running_loop()
+        client = self._clients.pop(loop, None)
+        session = self._sessions.pop(loop, None)
+        
+        if client is not None:
+            await client.close()
+        if session is not None:
+            await session.close()
+    
     def _handle_azure_error(self, error: Exception, operation: str) -> None:
         """Handle Azure-specific errors with proper logging"""
-        if isinstance(error, HttpResponseError):
+        if isinstance(error, (AzureDocumentIntelligenceError, RateLimitExceededError, CircuitOpenError)):
+            raise error
+        elif isinstance(error, HttpResponseError):
             status_code = error.status_code
             error_msg = f"Azure API error (HTTP {status_code}): {error.message}"
             logger.error(f"Azure Document Intelligence API error - operation: {operation}, status: {status_code}, message: {error.message}")
@@ -66,11 +123,33 @@ class AzureDocumentIntelligenceService:
             logger.error(f"Unexpected Azure Document Intelligence error - operation: {operation}, error: {str(error)}")
             raise AzureDocumentIntelligenceError(error_msg, operation)
     
+    async def _get_cached_result(
+        self,
+        content_hash: bytes,
+        model_id: str,
+        document_id: uuid.UUID,
+        start_time: float
+    ) -> Optional[Dict[str, Any]]:
+        """Look up a processed result for identical document bytes analysed by the same model"""
+        cached = await asyncio.to_thread(ocr_cache.get, content_hash, model_id, self.api_version)
+        if cached is None:
+            return None
+        
+        cached["document_id"] = str(document_id)
+        cached["cache_hit"] = True
+        cached["original_processing_duration_ms"] = cached.get("processing_duration_ms", 0)
+        cached["processing_duration_ms"] = (time.time() - start_time) * 1000
+        
+        logger.info(f"OCR cache hit for document {document_id}, model: {model_id}, content hash: {content_hash.hex()}")
+        return cached
+    
     async def analyze_document_quick(
         self,
         document_content: bytes,
         document_id: uuid.UUID,
-        content_type: str = "application/pdf"
+        content_type: str = "application/pdf",
+        content_hash: Optional[bytes] = None,
+        on_text: Optional[Callable[[str], Awaitable[None]]] = None
     ) -> Dict[str, Any]:
         """
         Perform quick document analysis for text extraction and basic classification
@@ -79,6 +158,12 @@ class AzureDocumentIntelligenceService:
             document_content: Raw document bytes
             document_id: Document UUID for tracking
             content_type: MIME type of the document
+            content_hash: SHA-256 digest of document_content, computed if not given
+            on_text: Awaited with each shard's text, in page order, as soon as it and the
+                shards before it are read; its failures are logged. A document read in one
+                call (non-PDFs, PDFs below the shard threshold) is handed over page by page
+                only once the whole analysis completes, so text arrives no earlier than the
+                result. Results served from the OCR cache are not handed over.
             
         Returns:
             Dictionary containing extracted text and metadata
@@ -89,24 +174,46 @@ class AzureDocumentIntelligenceService:
         try:
             logger.info(f"Starting quick document analysis for document {document_id}, content_type: {content_type}, size: {len(document_content)} bytes")
             
-            # Create analyze request with base64 encoded content
-            base64_content = base64.b64encode(document_content).decode('utf-8')
-            analyze_request = AnalyzeDocumentRequest(base64_source=base64_content)
-            
-            # Use prebuilt-read model for quick text extraction
-            poller = self.client.begin_analyze_document(
-                model_id="prebuilt-read",
-                analyze_request=analyze_request,
-                output_content_format=ContentFormat.TEXT
-            )
-            
-            # Wait for completion
-            result = poller.result()
+            # Identical bytes analysed before are served from the content-addressed cache
+            if content_hash is None:
+                content_hash = await asyncio.to_thread(compute_content_hash, document_content)
+            cached_result = await self._get_cached_result(content_hash, "prebuilt-read", document_id, start_time)
+            if cached_result is not None:
+                return cached_result
+            
+            # Large PDFs are split into page ranges and read in parallel
+            page_count, shards = None, None
+            if content_type == "application/pdf":
+                page_count, shards = await asyncio.to_thread(self._prepare_pdf, document_content, settings.AZURE_SHARD_PAGES)
+            
+            # Poll cadence and deadline scale with document size
+            page_count = estimate_page_count(len(document_content), page_count)
+            deadline = analysis_deadline(page_count)
+            stats = PollingStats()
+            
+            if shards:
+                logger.info(f"Analysing document {document_id} as {len(shards)} shards of up to {settings.AZURE_SHARD_PAGES} pages")
+                analysis = self._analyze_read_shards(shards, document_id, stats, content_hash, on_text)
+            else:
+                analysis = self._run_analysis(
+                    "prebuilt-read", document_content, content_type, page_count, stats,
+                    operation_key=operation_store.make_key(content_hash, "prebuilt-read", self.api_version),
+                    document_id=document_id
+                )
+            result = await self._with_deadline(analysis, deadline, document_id, operation, page_count)
+            if on_text is not None and not shards:
+                for page_text in self._page_texts(result):
+                    try:
+                        await on_text(page_text)
+                    except Exception as e:
+                        logger.warning(f"Page text callback failed for document {document_id}: {e}")
             
             duration_ms = (time.time() - start_time) * 1000
             
             # Extract and structure the results
             analysis_result = self._process_read_result(result, document_id, duration_ms)
+            analysis_result["polling_stats"] = {**stats.as_dict(), "deadline_seconds": deadline}
+            await asyncio.to_thread(ocr_cache.set, content_hash, "prebuilt-read", self.api_version, analysis_result)
             
             logger.info(f"Quick document analysis completed for document {document_id}, duration: {duration_ms}ms, pages: {analysis_result.get('page_count', 0)}, chars: {len(analysis_result.get('full_text', ''))}")
             
@@ -117,11 +224,238 @@ class AzureDocumentIntelligenceService:
             logger.error(f"Quick document analysis failed for document {document_id}, duration: {duration_ms}ms, error: {str(e)}")
             self._handle_azure_error(e, operation)
     
+    async def _run_analysis(
+        self,
+        model_id: str,
+        document_content: bytes,
+        content_type: str,
+        page_count: int,
+        stats: PollingStats,
+        operation_key: Optional[str] = None,
+        document_id: Optional[uuid.UUID] = None
+    ):
+        """
+        Submit one document or shard and poll it to completion, returning the raw AnalyzeResult
+        
+        With an operation_key the submitted operation is persisted until it completes, and an
+        operation left behind by an earlier attempt is resumed instead of re-submitted.
+        """
+        client = await self.get_client()
+        
+        if operation_key:
+            record = await asyncio.to_thread(operation_store.get, operation_key)
+            if record:
+                try:
+                    # Resumed operations only poll, so they hold an in-flight slot but take no token
+                    async with azure_rate_limiter.slot(model_id, needs_token=False) as wait_seconds:
+                        stats.limiter_wait_seconds += wait_seconds
+                        logger.info(f"Resuming Azure operation {record.get('operation_id')} ({model_id}) for document {document_id}")
+                        poller = await client.begin_analyze_document(
+                            model_id=model_id,
+                            continuation_token=record["continuation_token"],
+                            polling=self._create_polling(page_count, stats)
+                        )
+                        result = await poller.result()
+                    
+                    await asyncio.to_thread(operation_store.delete, operation_key)
+                    return result
+                    
+                except Exception as e:
+                    # Transient errors keep the record so the next attempt can resume again;
+                    # expired, unknown or failed operations are submitted afresh
+                    if not isinstance(e, HttpResponseError) or self._is_retryable_error(e):
+                        raise
+                    logger.warning(f"Azure operation {record.get('operation_id')} cannot be resumed, re-submitting: {e}")
+                    await asyncio.to_thread(operation_store.delete, operation_key)
+        
+        # Submissions queue on the shared limiter instead of bursting into 429s
+        async with azure_rate_limiter.slot(model_id) as wait_seconds:
+            stats.limiter_wait_seconds += wait_seconds
+            
+            # The raw bytes are the request body, so no base64 copy of the document is ever built
+            poller = await client.begin_analyze_document(
+                model_id=model_id,
+                analyze_request=document_content,
+                content_type=content_type,
+                output_content_format=ContentFormat.TEXT,
+                polling=self._create_polling(page_count, stats)
+            )
+            
+            if operation_key:
+                await asyncio.to_thread(
+                    operation_store.save,
+                    operation_key,
+                    poller.continuation_token(),
+                    poller.polling_method().operation_location,
+                    model_id,
+                    str(document_id) if document_id else None
+                )
+            
+            # Wait for completion without blocking the event loop
+            result = await poller.result()
+        
+        if operation_key:
+            await asyncio.to_thread(operation_store.delete, operation_key)
+        return result
+    
+    def _create_polling(self, page_count: int, stats: PollingStats) -> AdaptivePolling:
+        """Polling method for one operation; page count sets the first poll delay"""
+        return AdaptivePolling(
+            initial_poll_interval(page_count),
+            stats,
+            path_format_arguments={"endpoint": self.endpoint}
+        )
+    
+    async def _with_deadline(self, analysis, deadline: float, document_id: uuid.UUID, operation: str, page_count: int):
+        """
+        Await an analysis through the Azure circuit breaker, abandoning it once the
+        per-document deadline has passed (which counts against the breaker). Whether it
+        was slow is judged against a threshold scaled to its page count.
+        """
+        try:
+            async with azure_breaker.guard_async(slow_call_threshold(page_count)):
+                try:
+                    return await asyncio.wait_for(analysis, timeout=deadline)
+                except asyncio.TimeoutError:
+                    logger.error(f"Azure analysis for document {document_id} exceeded its {deadline:.0f}s deadline")
+                    raise AzureDocumentIntelligenceError(
+                        f"Analysis did not complete within the {deadline:.0f}s deadline", operation, 504
+                    )
+        except CircuitOpenError:
+            # Never started; close the coroutine so it is not reported as never awaited
+            analysis.close()
+            raise
+    
+    def _prepare_pdf(self, document_content: bytes, shard_pages: int) -> Tuple[Optional[int], Optional[List[Tuple[int, bytes]]]]:
+        """
+        Count the pages of a PDF and split it into standalone PDFs of at most shard_pages pages
+        
+        Returns (page_count, shards) where shards is a list of (shard page count, PDF bytes).
+        Shards are None when sharding is disabled or the PDF fits in one shard, and both are
+        None when the PDF cannot be parsed; such documents are analysed in a single request.
+        """
+        try:
+            reader = PdfReader(io.BytesIO(document_content))
+            page_count = len(reader.pages)
+            if shard_pages <= 0 or page_count <= shard_pages:
+                return page_count, None
+            
+            shards = []
+            for first_page in range(0, page_count, shard_pages):
+                writer = PdfWriter()
+                last_page = min(first_page + shard_pages, page_count)
+                for page_idx in range(first_page, last_page):
+                    writer.add_page(reader.pages[page_idx])
+                
+                buffer = io.BytesIO()
+                writer.write(buffer)
+                shards.append((last_page - first_page, buffer.getvalue()))
+            
+            return page_count, shards
+            
+        except Exception as e:
+            logger.warning(f"Could not read PDF pages, analysing as a single request: {e}")
+            return None, None
+    
+    @staticmethod
+    def _is_retryable_error(error: Exception) -> bool:
+        """Client errors other than throttling and timeouts will fail the same way again"""
+        if isinstance(error, CircuitOpenError):
+            return False
+        if isinstance(error, HttpResponseError) and error.status_code is not None:
+            return error.status_code >= 500 or error.status_code in (408, 429)
+        return True
+    
+    async def _analyze_read_shards(
+        self,
+        shards: List[Tuple[int, bytes]],
+        document_id: uuid.UUID,
+        stats: PollingStats,
+        content_hash: bytes,
+        on_text: Optional[Callable[[str], Awaitable[None]]] = None
+    ):
+        """Read shards concurrently, retrying each failed shard on its own, and merge them in page order"""
+        semaphore = asyncio.Semaphore(max(1, settings.AZURE_SHARD_MAX_CONCURRENCY))
+        finished: Dict[int, Any] = {}
+        delivered = 0
+        delivery_lock = asyncio.Lock()
+        
+        async def deliver_text(shard_idx: int, result) -> None:
+            # Hand on the text of every shard now read without a gap before it, one at a time
+            nonlocal delivered
+            finished[shard_idx] = result
+            async with delivery_lock:
+                while delivered in finished:
+                    content = getattr(finished[delivered], 'content', None)
+                    delivered += 1
+                    if content:
+                        try:
+                            await on_text(content)
+                        except Exception as e:
+                            logger.warning(f"Shard text callback failed for document {document_id}: {e}")
+        
+        async def analyze_shard(shard_idx: int, shard_page_count: int, shard_content: bytes):
+            attempt = 0
+            while True:
+                try:
+                    async with semaphore:
+                        result = await self._run_analysis(
+                            "prebuilt-read", shard_content, "application/pdf", shard_page_count, stats,
+                            operation_key=operation_store.make_key(
+                                content_hash, "prebuilt-read", self.api_version,
+                                f"shard:{settings.AZURE_SHARD_PAGES}:{shard_idx}"
+                            ),
+                            document_id=document_id
+                        )
+                    if on_text is not None:
+                        await deliver_text(shard_idx, result)
+                    return result
+                except Exception as e:
+                    if attempt >= settings.AZURE_SHARD_MAX_RETRIES or not self._is_retryable_error(e):
+                        logger.error(f"Shard {shard_idx + 1}/{len(shards)} of document {document_id} failed after {attempt + 1} attempts: {e}")
+                        raise
+                    
+                    attempt += 1
+                    delay = 2 ** attempt
+                    logger.warning(f"Shard {shard_idx + 1}/{len(shards)} of document {document_id} failed, retrying in {delay}s (attempt {attempt}/{settings.AZURE_SHARD_MAX_RETRIES}): {e}")
+                    await asyncio.sleep(delay)
+        
+        tasks = [
+            asyncio.create_task(analyze_shard(idx, shard_page_count, shard_content))
+            for idx, (shard_page_count, shard_content) in enumerate(shards)
+        ]
+        try:
+            shard_results = await asyncio.gather(*tasks)
+        except Exception:
+            # One shard failed for good; stop the rest instead of leaving them running
+            for task in tasks:
+                task.cancel()
+            raise
+        
+        return self._merge_shard_results(shard_results)
+    
+    @staticmethod
+    def _merge_shard_results(shard_results: List[Any]) -> SimpleNamespace:
+        """
+        Combine per-shard read results into one object shaped like an unsharded AnalyzeResult
+        
+        The read model joins lines across page breaks with a newline, so joining shard content
+        the same way gives the full_text a single request would have produced.
+        """
+        first = shard_results[0]
+        return SimpleNamespace(
+            api_version=getattr(first, 'api_version', 'unknown'),
+            model_id=getattr(first, 'model_id', 'prebuilt-read'),
+            content="\n".join(result.content for result in shard_results if getattr(result, 'content', None)),
+            pages=[page for result in shard_results for page in (getattr(result, 'pages', None) or [])]
+        )
+    
     async def analyze_document_layout(
         self,
         document_content: bytes,
         document_id: uuid.UUID,
-        content_type: str = "application/pdf"
+        content_type: str = "application/pdf",
+        content_hash: Optional[bytes] = None
     ) -> Dict[str, Any]:
         """
         Perform detailed document layout analysis
@@ -130,6 +464,7 @@ class AzureDocumentIntelligenceService:
             document_content: Raw document bytes
             document_id: Document UUID for tracking
             content_type: MIME type of the document
+            content_hash: SHA-256 digest of document_content, computed if not given
             
         Returns:
             Dictionary containing layout analysis results
@@ -138,44 +473,63 @@ class AzureDocumentIntelligenceService:
         operation = "analyze_document_layout"
         
         try:
-            logger.info("Starting document layout analysis",
-                                 document_id=str(document_id),
-                                 content_type=content_type)
-            
-            # Create analyze request
-            analyze_request = AnalyzeDocumentRequest(bytes_source=document_content)
+            logger.info(f"Starting document layout analysis for document {document_id}, content_type: {content_type}")
+            
+            # Identical bytes analysed before are served from the content-addressed cache
+            if content_hash is None:
+                content_hash = await asyncio.to_thread(compute_content_hash, document_content)
+            cached_result = await self._get_cached_result(content_hash, "prebuilt-layout", document_id, start_time)
+            if cached_result is not None:
+                return cached_result
+            
+            # Poll cadence and deadline scale with document size
+            page_count = None
+            if content_type == "application/pdf":
+                page_count, _ = await asyncio.to_thread(self._prepare_pdf, document_content, 0)
+            page_count = estimate_page_count(len(document_content), page_count)
+            deadline = analysis_deadline(page_count)
+            stats = PollingStats()
             
             # Use prebuilt-layout model for detailed analysis
-            poller = self.client.begin_analyze_document(
-                model_id="prebuilt-layout",
-                analyze_request=analyze_request,
-                output_content_format=ContentFormat.TEXT
+            result = await self._with_deadline(
+                self._run_analysis(
+                    "prebuilt-layout", document_content, content_type, page_count, stats,
+                    operation_key=operation_store.make_key(content_hash, "prebuilt-layout", self.api_version),
+                    document_id=document_id
+                ),
+                deadline, document_id, operation, page_count
             )
             
-            # Wait for completion
-            result = poller.result()
-            
             duration_ms = (time.time() - start_time) * 1000
             
             # Process layout results
             analysis_result = self._process_layout_result(result, document_id, duration_ms)
+            analysis_result["polling_stats"] = {**stats.as_dict(), "deadline_seconds": deadline}
+            await asyncio.to_thread(ocr_cache.set, content_hash, "prebuilt-layout", self.api_version, analysis_result)
             
-            logger.info("Document layout analysis completed",
-                                 document_id=str(document_id),
-                                 duration_ms=duration_ms,
-                                 tables_found=len(analysis_result.get('tables', [])),
-                                 paragraphs_found=len(analysis_result.get('paragraphs', [])))
+            logger.info(f"Document layout analysis completed for document {document_id}, duration: {duration_ms}ms, tables: {len(analysis_result.get('tables', []))}, paragraphs: {len(analysis_result.get('paragraphs', []))}")
             
             return analysis_result
             
         except Exception as e:
             duration_ms = (time.time() - start_time) * 1000
-            logger.error("Document layout analysis failed",
-                                  document_id=str(document_id),
-                                  duration_ms=duration_ms,
-                                  error=str(e))
+            logger.error(f"Document layout analysis failed for document {document_id}, duration: {duration_ms}ms, error: {str(e)}")
             self._handle_azure_error(e, operation)
     
+    @staticmethod
+    def _page_texts(result) -> List[str]:
+        """Text of each page of an AnalyzeResult, in page order, sliced out of its content by span"""
+        content = getattr(result, 'content', None) or ""
+        page_texts = []
+        for page in getattr(result, 'pages', None) or []:
+            text = "".join(
+                content[span.offset:span.offset + span.length]
+                for span in getattr(page, 'spans', None) or []
+            )
+            if text:
+                page_texts.append(text)
+        return page_texts or ([content] if content else [])
+    
     def _process_read_result(self, result, document_id: uuid.UUID, duration_ms: float) -> Dict[str, Any]:
         """Process Azure Document Intelligence read results"""
         try:
@@ -190,12 +544,13 @@ class AzureDocumentIntelligenceService:
                 "full_text": "",
                 "pages": [],
                 "page_count": 0,
-                "confidence_scores": []
+                "confidence_summary": {"count": 0}
             }
             
             if hasattr(result, 'content') and result.content:
                 analysis_result["full_text"] = result.content
             
+            page_confidences = []
             if hasattr(result, 'pages') and result.pages:
                 analysis_result["page_count"] = len(result.pages)
                 
@@ -209,25 +564,29 @@ class AzureDocumentIntelligenceService:
                         "words_count": len(getattr(page, 'words', []))
                     }
                     
-                    # Extract confidence scores if available
-                    if hasattr(page, 'words'):
-                        confidences = []
-                        for word in page.words:
-                            if hasattr(word, 'confidence') and word.confidence is not None:
-                                confidences.append(word.confidence)
+                    # Extract confidence scores if available, kept as float32 arrays
+                    if hasattr(page, 'words') and page.words:
+                        confidences = to_confidence_array(page.words)
                         
-                        if confidences:
-                            page_info["average_confidence"] = sum(confidences) / len(confidences)
-                            page_info["min_confidence"] = min(confidences)
-                            analysis_result["confidence_scores"].extend(confidences)
+                        if confidences.size:
+                            page_info["average_confidence"] = float(confidences.mean(dtype=np.float64))
+                            page_info["min_confidence"] = float(confidences.min())
+                            page_info["confidence_histogram"] = confidence_histogram(confidences)
+                            page_confidences.append(confidences)
                     
                     analysis_result["pages"].append(page_info)
             
             # Calculate overall confidence
-            if analysis_result["confidence_scores"]:
-                analysis_result["overall_confidence"] = sum(analysis_result["confidence_scores"]) / len(analysis_result["confidence_scores"])
-                analysis_result["min_confidence"] = min(analysis_result["confidence_scores"])
-                analysis_result["max_confidence"] = max(analysis_result["confidence_scores"])
+            if page_confidences:
+                all_confidences = np.concatenate(page_confidences)
+                summary = summarize_confidences(all_confidences)
+                analysis_result["confidence_summary"] = summary
+                analysis_result["overall_confidence"] = summary["mean"]
+                analysis_result["min_confidence"] = summary["min"]
+                analysis_result["max_confidence"] = summary["max"]
+                
+                if settings.OCR_STORE_CONFIDENCE_BLOB:
+                    analysis_result["confidence_blob"] = encode_confidence_blob(all_confidences)
             
             return analysis_result
             
@@ -341,14 +700,30 @@ class AzureDocumentIntelligenceService:
             }
     
     async def get_operation_status(self, operation_id: str) -> Dict[str, Any]:
-        """Get status of a long-running operation"""
+        """Get status of an in-flight analysis from its persisted Operation-Location"""
         try:
-            # This would be used for checking operation status
-            # Azure Document Intelligence handles this internally with pollers
+            record = await asyncio.to_thread(operation_store.get_by_operation_id, operation_id)
+            if not record or not record.get("operation_location"):
+                return {
+                    "operation_id": operation_id,
+                    "status": "unknown",
+                    "message": "No in-flight operation recorded with this id; it may have completed or expired"
+                }
+            
+            client = await self.get_client()
+            response = await client.send_request(HttpRequest("GET", record["operation_location"]))
+            response.raise_for_status()
+            body = response.json()
+            
             return {
                 "operation_id": operation_id,
-                "status": "completed",  # Placeholder
-                "message": "Operation status check not implemented for current SDK version"
+                "status": body.get("status", "unknown"),
+                "model_id": record.get("model_id"),
+                "document_id": record.get("document_id"),
+                "submitted_at": datetime.utcfromtimestamp(record["submitted_at"]).isoformat(),
+                "created_at": body.get("createdDateTime"),
+                "last_updated_at": body.get("lastUpdatedDateTime"),
+                "error": body.get("error")
             }
         except Exception as e:
             self._handle_azure_error(e, "get_operation_status")
@@ -387,7 +762,8 @@ class AzureDocumentIntelligenceService:
                 "table_count": len(result.get("tables", [])),
                 "paragraph_count": len(result.get("paragraphs", [])),
                 "api_version": result.get("api_version"),
-                "model_id": result.get("model_id")
+                "model_id": result.get("model_id"),
+                "polling_stats": result.get("polling_stats")
             }
             
             # Add error information if present
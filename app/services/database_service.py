@@ -1,7 +1,9 @@
 from supabase import create_client, Client
 from app.config import settings
+from app.utils.circuit_breaker import supabase_breaker, CircuitOpenError
 from app.models.database import *
-from typing import Optional, List, Dict, Any, Union
+from typing import Optional, List, Dict, Any, Tuple, Union
+import asyncio
 import logging
 from datetime import datetime, date
 import uuid
@@ -28,6 +30,10 @@ class DatabaseService:
 
     def _handle_db_error(self, error: Exception, operation: str, table: str = "") -> None:
         """Handle database errors with consistent logging"""
+        if isinstance(error, CircuitOpenError):
+            # Supabase is known to be down; fail fast without wrapping
+            raise error
+        
         error_msg = f"Database {operation} error"
         if table:
             error_msg += f" on {table}"
@@ -47,12 +53,29 @@ class DatabaseService:
         except ValueError as e:
             raise DatabaseError(f"Invalid UUID format for {field_name}: {e}")
 
+    def _execute_blocking(self, query):
+        with supabase_breaker.guard():
+            return query.execute()
+
+    async def _execute(self, query):
+        """
+        Execute a PostgREST query through the Supabase circuit breaker
+        
+        The Supabase client is synchronous, so the request runs in a worker thread and
+        independent queries awaited together overlap instead of blocking the event loop.
+        """
+        return await asyncio.to_thread(self._execute_blocking, query)
+
+    def _encode_bytea(self, value: bytes) -> str:
+        """Encode bytes for a bytea column in PostgREST hex format"""
+        return "\\x" + value.hex()
+
     # Generic CRUD Operations
     async def create_record(self, table: str, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """Generic create operation for any table"""
         try:
             logger.info(f"Creating record in {table}")
-            result = self.client.table(table).insert(data).execute()
+            result = await self._execute(self.client.table(table).insert(data))
             
             if hasattr(result, 'error') and result.error:
                 raise DatabaseError(f"Supabase error: {result.error}")
@@ -65,7 +88,7 @@ class DatabaseService:
         """Generic get by ID operation for any table"""
         try:
             validated_id = self._validate_uuid(record_id)
-            result = self.client.table(table).select('*').eq('id', str(validated_id)).execute()
+            result = await self._execute(self.client.table(table).select('*').eq('id', str(validated_id)))
             
             if hasattr(result, 'error') and result.error:
                 raise DatabaseError(f"Supabase error: {result.error}")
@@ -80,7 +103,7 @@ class DatabaseService:
             validated_id = self._validate_uuid(record_id)
             logger.info(f"Updating record in {table}: {validated_id}")
             
-            result = self.client.table(table).update(data).eq('id', str(validated_id)).execute()
+            result = await self._execute(self.client.table(table).update(data).eq('id', str(validated_id)))
             
             if hasattr(result, 'error') and result.error:
                 raise DatabaseError(f"Supabase error: {result.error}")
@@ -95,7 +118,7 @@ class DatabaseService:
             validated_id = self._validate_uuid(record_id)
             logger.info(f"Deleting record from {table}: {validated_id}")
             
-            result = self.client.table(table).delete().eq('id', str(validated_id)).execute()
+            result = await self._execute(self.client.table(table).delete().eq('id', str(validated_id)))
             
             if hasattr(result, 'error') and result.error:
                 raise DatabaseError(f"Supabase error: {result.error}")
@@ -133,7 +156,7 @@ class DatabaseService:
             if offset:
                 query = query.offset(offset)
             
-            result = query.execute()
+            result = await self._execute(query)
             
             if hasattr(result, 'error') and result.error:
                 raise DatabaseError(f"Supabase error: {result.error}")
@@ -199,7 +222,7 @@ class DatabaseService:
             
             # Get organizations
             query = self.client.table("organizations").select('*').in_('id', org_ids)
-            result = query.execute()
+            result = await self._execute(query)
             
             if hasattr(result, 'error') and result.error:
                 raise DatabaseError(f"Supabase error: {result.error}")
@@ -208,6 +231,45 @@ class DatabaseService:
         except Exception as e:
             self._handle_db_error(e, "get_organizations_by_user")
 
+    async def get_active_organization_plan(
+        self,
+        org_id: uuid.UUID,
+        on_date: Optional[date] = None
+    ) -> Optional[Tuple[OrganizationPlan, PlanType]]:
+        """Get the organization's plan in effect on a date (today by default) and its plan type"""
+        try:
+            on_date = (on_date or date.today()).isoformat()
+            query = self.client.table("organization_plans").select('*, plan_types(*)') \
+                .eq('org_id', str(org_id)) \
+                .lte('effective_date', on_date) \
+                .or_(f"end_date.is.null,end_date.gte.{on_date}") \
+                .order('effective_date', desc=True) \
+                .limit(1)
+            result = await self._execute(query)
+            
+            if hasattr(result, 'error') and result.error:
+                raise DatabaseError(f"Supabase error: {result.error}")
+            
+            if not result.data:
+                return None
+            plan = dict(result.data[0])
+            plan_type = plan.pop("plan_types")
+            return OrganizationPlan(**plan), PlanType(**plan_type)
+        except Exception as e:
+            self._handle_db_error(e, "get_active_organization_plan")
+
+    async def get_organization_usage(self, org_id: uuid.UUID, usage_month: date) -> Optional[OrganizationUsage]:
+        """Get an organization's usage for the month starting on usage_month"""
+        try:
+            results = await self.get_records_with_filters(
+                "organization_usage",
+                {"org_id": str(org_id), "usage_month": usage_month.isoformat()},
+                limit=1
+            )
+            return OrganizationUsage(**results[0]) if results else None
+        except Exception as e:
+            self._handle_db_error(e, "get_organization_usage")
+
     # Organization Member Operations
     async def create_org_member(self, org_id: uuid.UUID, member_data: OrgMemberCreate) -> Optional[OrgMember]:
         """Add user to organization"""
@@ -232,7 +294,7 @@ class DatabaseService:
                 "*"
             ).eq("org_id", str(org_id))
             
-            result = query.execute()
+            result = await self._execute(query)
             
             if hasattr(result, 'error') and result.error:
                 raise DatabaseError(f"Supabase error: {result.error}")
@@ -244,7 +306,7 @@ class DatabaseService:
     async def remove_org_member(self, org_id: uuid.UUID, user_id: uuid.UUID) -> bool:
         """Remove user from organization"""
         try:
-            result = self.client.table("org_members").delete().eq("org_id", str(org_id)).eq("user_id", str(user_id)).execute()
+            result = await self._execute(self.client.table("org_members").delete().eq("org_id", str(org_id)).eq("user_id", str(user_id)))
             
             if hasattr(result, 'error') and result.error:
                 raise DatabaseError(f"Supabase error: {result.error}")
@@ -257,7 +319,7 @@ class DatabaseService:
         """Update organization member role"""
         try:
             data = {"role_id": str(new_role_id), "role": new_role.value}
-            result = self.client.table("org_members").update(data).eq("org_id", str(org_id)).eq("user_id", str(user_id)).execute()
+            result = await self._execute(self.client.table("org_members").update(data).eq("org_id", str(org_id)).eq("user_id", str(user_id)))
             
             if hasattr(result, 'error') and result.error:
                 raise DatabaseError(f"Supabase error: {result.error}")
@@ -283,7 +345,7 @@ class DatabaseService:
             if doc_data.document_type_id:
                 data["document_type_id"] = str(doc_data.document_type_id)
             if doc_data.hash:
-                data["hash"] = doc_data.hash
+                data["hash"] = self._encode_bytea(doc_data.hash)
             
             result = await self.create_record("documents", data)
             return Document(**result) if result else None
@@ -308,6 +370,8 @@ class DatabaseService:
                 data["ocr_status"] = updates.ocr_status.value
             if updates.parsed_index is not None:
                 data["parsed_index"] = updates.parsed_index
+            if updates.hash is not None:
+                data["hash"] = self._encode_bytea(updates.hash)
             
             if data:
                 result = await self.update_record("documents", document_id, data)
@@ -339,6 +403,89 @@ class DatabaseService:
         except Exception as e:
             self._handle_db_error(e, "get_organization_documents")
 
+    async def get_documents_by_ids(self, document_ids: List[uuid.UUID]) -> List[Document]:
+        """Get several documents in one query; ids with no document are left out"""
+        try:
+            if not document_ids:
+                return []
+            
+            ids = [str(self._validate_uuid(document_id)) for document_id in document_ids]
+            result = await self._execute(self.client.table("documents").select('*').in_('id', ids))
+            
+            if hasattr(result, 'error') and result.error:
+                raise DatabaseError(f"Supabase error: {result.error}")
+            
+            return [Document(**doc) for doc in result.data or []]
+        except Exception as e:
+            self._handle_db_error(e, "get_documents_by_ids")
+
+    async def get_organization_document_ids(
+        self,
+        org_id: uuid.UUID,
+        status: Optional[OcrStatus] = None
+    ) -> List[uuid.UUID]:
+        """Get the ids of an organization's documents, oldest first, without loading them"""
+        try:
+            query = self.client.table("documents").select('id').eq('org_id', str(org_id))
+            if status:
+                query = query.eq('ocr_status', status.value)
+            
+            result = await self._execute(query.order('uploaded_at'))
+            
+            if hasattr(result, 'error') and result.error:
+                raise DatabaseError(f"Supabase error: {result.error}")
+            
+            return [uuid.UUID(row["id"]) for row in result.data or []]
+        except Exception as e:
+            self._handle_db_error(e, "get_organization_document_ids")
+
+    async def update_documents_detection_results(
+        self,
+        results: List[Tuple[uuid.UUID, Dict[str, Any], Dict[str, Any]]]
+    ) -> int:
+        """
+        Record new detection results for several documents
+        
+        results holds (document id, detection_results, processing_history entry) per document.
+        Each document's parsed_index is re-read just before the write and only those two keys
+        change, so results written meanwhile by other stages are kept; documents deleted
+        meanwhile are skipped, never re-created. Returns the number of documents written.
+        """
+        try:
+            if not results:
+                return 0
+            
+            ids = [str(self._validate_uuid(document_id)) for document_id, _, _ in results]
+            current = await self._execute(self.client.table("documents").select('id, parsed_index').in_('id', ids))
+            
+            if hasattr(current, 'error') and current.error:
+                raise DatabaseError(f"Supabase error: {current.error}")
+            
+            parsed_indexes = {row["id"]: row.get("parsed_index") or {} for row in current.data or []}
+            
+            updates = []
+            for document_id, (_, detection_results, history_entry) in zip(ids, results):
+                if document_id not in parsed_indexes:
+                    continue
+                parsed_index = parsed_indexes[document_id]
+                parsed_index = {
+                    **parsed_index,
+                    "detection_results": detection_results,
+                    "processing_history": [*parsed_index.get("processing_history", []), history_entry]
+                }
+                updates.append(self.client.table("documents").update({"parsed_index": parsed_index}).eq('id', document_id))
+            
+            logger.info(f"Updating detection results for {len(updates)} of {len(results)} documents")
+            
+            written = await asyncio.gather(*[self._execute(update) for update in updates])
+            for result in written:
+                if hasattr(result, 'error') and result.error:
+                    raise DatabaseError(f"Supabase error: {result.error}")
+            
+            return sum(1 for result in written if result.data)
+        except Exception as e:
+            self._handle_db_error(e, "update_documents_detection_results")
+
     # Document Type Operations
     async def get_document_types(self, org_id: Optional[uuid.UUID] = None) -> List[DocumentType]:
         """Get document types (templates or organization-specific)"""
@@ -348,7 +495,7 @@ class DatabaseService:
                 query = self.client.table("document_types").select('*').or_(
                     f"org_id.is.null,org_id.eq.{str(org_id)}"
                 )
-                result = query.execute()
+                result = await self._execute(query)
                 
                 if hasattr(result, 'error') and result.error:
                     raise DatabaseError(f"Supabase error: {result.error}")
@@ -369,6 +516,42 @@ class DatabaseService:
         except Exception as e:
             self._handle_db_error(e, "get_document_type")
 
+    async def get_effective_document_types(self, org_id: Optional[uuid.UUID] = None) -> List[DocumentType]:
+        """Get the active template document types plus the organization's own"""
+        try:
+            scopes = [str(TEMPLATE_ORG_ID)] + ([str(org_id)] if org_id else [])
+            result = await self._execute(
+                self.client.table("document_types").select('*')
+                .in_('org_id_eff', scopes)
+                .eq('status', StatusState.ACTIVE.value)
+            )
+            
+            if hasattr(result, 'error') and result.error:
+                raise DatabaseError(f"Supabase error: {result.error}")
+            
+            return [DocumentType(**dt) for dt in result.data or []]
+        except Exception as e:
+            self._handle_db_error(e, "get_effective_document_types")
+
+    async def get_sections(self, document_type_ids: List[uuid.UUID]) -> List[Section]:
+        """Get the sections of several document types, in section order"""
+        try:
+            if not document_type_ids:
+                return []
+            
+            result = await self._execute(
+                self.client.table("sections").select('*')
+                .in_('document_type_id', [str(document_type_id) for document_type_id in document_type_ids])
+                .order('order_no')
+            )
+            
+            if hasattr(result, 'error') and result.error:
+                raise DatabaseError(f"Supabase error: {result.error}")
+            
+            return [Section(**section) for section in result.data or []]
+        except Exception as e:
+            self._handle_db_error(e, "get_sections")
+
     # Obligation Operations
     async def create_obligation(self, org_id: uuid.UUID, obligation_data: ObligationCreate) -> Optional[Obligation]:
         """Create a new obligation"""
@@ -482,7 +665,7 @@ class DatabaseService:
             if offset:
                 query = query.offset(offset)
             
-            result = query.execute()
+            result = await self._execute(query)
             
             if hasattr(result, 'error') and result.error:
                 raise DatabaseError(f"Supabase error: {result.error}")
@@ -573,11 +756,12 @@ class DatabaseService:
         try:
             logger.info(f"Uploading file to storage: {file_path}")
             
-            result = self.client.storage.from_('documents').upload(
-                file_path,
-                file_content,
-                {"content-type": content_type, "cache-control": "3600"}
-            )
+            with supabase_breaker.guard():
+                result = self.client.storage.from_('documents').upload(
+                    file_path,
+                    file_content,
+                    {"content-type": content_type, "cache-control": "3600"}
+                )
             
             if hasattr(result, 'error') and result.error:
                 raise DatabaseError(f"Storage upload error: {result.error}")
@@ -689,7 +873,7 @@ class DatabaseService:
             
             # Find stuck documents (in processing state for too long)
             query = self.client.table("documents").select('*').eq("ocr_status", OcrStatus.PROCESSING.value)
-            result = query.execute()
+            result = await self._execute(query)
             
             if hasattr(result, 'error') and result.error:
                 raise DatabaseError(f"Query failed: {result.error}")
@@ -757,7 +941,7 @@ class DatabaseService:
             # This is a simplified search - in production you'd use full-text search
             # For now, we'll search in the parsed_index JSON
             query = self.client.table("documents").select('*').eq("org_id", str(org_id))
-            result = query.execute()
+            result = await self._execute(query)
             
             if hasattr(result, 'error') and result.error:
                 raise DatabaseError(f"Search query failed: {result.error}")
@@ -0,0 +1,226 @@
+"""
+Detection rules loaded from the database
+Builds an organization's detection patterns from the rule tables on top of the built-in
+NMTCPatterns: section anchors from sections.anchor_patterns, for the template document
+types and the organization's own.
+Compiled matchers are cached per (org, rule version), so workers only recompile when
+the rules actually change.
+"""
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import time
+import uuid
+
+from app.config import settings
+from app.models.database import DocumentType, Section
+from app.services.database_service import database_service
+from app.utils.nmtc_patterns import (
+    NMTCPatterns,
+    NMTCDocumentType,
+    CombinedPatternMatcher,
+    compile_matcher
+)
+
+logger = logging.getLogger(__name__)
+
+# document_types.key values whose wording differs from NMTCDocumentType
+DOCUMENT_TYPE_KEY_ALIASES = {
+    'qlici_loan_agreement': NMTCDocumentType.QLICI_LOAN,
+    'qlici_promissory_note': NMTCDocumentType.PROMISSORY_NOTE,
+    'community_benefits_agreement': NMTCDocumentType.COMMUNITY_BENEFITS_AGREEMENT,
+    'qalicb_annual_certification': NMTCDocumentType.QALICB_CERTIFICATION,
+    'insurance_document': NMTCDocumentType.INSURANCE_DOCUMENT,
+    'insurance_certificate': NMTCDocumentType.INSURANCE_DOCUMENT
+}
+
+SECTION_ANCHOR_CATEGORY = 'section_anchors'
+
+
+def resolve_document_type(key: str) -> Optional[NMTCDocumentType]:
+    """NMTCDocumentType a document_types.key stands for, if any"""
+    key = key.strip().lower()
+    if key in DOCUMENT_TYPE_KEY_ALIASES:
+        return DOCUMENT_TYPE_KEY_ALIASES[key]
+    try:
+        doc_type = NMTCDocumentType(key)
+    except ValueError:
+        return None
+    return doc_type if doc_type != NMTCDocumentType.UNKNOWN else None
+
+
+def anchor_pattern(anchor: str) -> Optional[str]:
+    """Pattern for a section anchor: the literal phrase, with any run of whitespace between words"""
+    words = anchor.split()
+    return r'\s+'.join(re.escape(word) for word in words) if words else None
+
+
+def build_document_patterns(
+    document_types: List[DocumentType],
+    sections: List[Section]
+) -> Dict[NMTCDocumentType, Dict[str, List[str]]]:
+    """
+    NMTCPatterns.DOCUMENT_PATTERNS extended with the rule tables
+    
+    An organization's document type counts as its parent's when its own key isn't a known
+    type. Rows for types that don't resolve, and patterns that don't compile, are skipped.
+    normalization_rules are left out: their date, currency, percentage and text patterns
+    describe values found in most financial documents, not evidence of a document type.
+    """
+    document_patterns = {
+        doc_type: {category: list(pattern_list) for category, pattern_list in categories.items()}
+        for doc_type, categories in NMTCPatterns.DOCUMENT_PATTERNS.items()
+    }
+    
+    by_id = {document_type.id: document_type for document_type in document_types}
+    resolved: Dict[uuid.UUID, NMTCDocumentType] = {}
+    for document_type in document_types:
+        doc_type = resolve_document_type(document_type.key)
+        if doc_type is None and document_type.parent_id in by_id:
+            doc_type = resolve_document_type(by_id[document_type.parent_id].key)
+        if doc_type is None:
+            logger.debug(f"Document type {document_type.key} has no detection type; its rules are skipped")
+            continue
+        resolved[document_type.id] = doc_type
+    
+    def add(doc_type: NMTCDocumentType, category: str, pattern: str, source: str) -> None:
+        try:
+            re.compile(pattern)
+        except re.error as e:
+            logger.warning(f"Skipping invalid detection pattern {pattern!r} from {source}: {e}")
+            return
+        pattern_list = document_patterns.setdefault(doc_type, {}).setdefault(category, [])
+        if pattern not in pattern_list:
+            pattern_list.append(pattern)
+    
+    for section in sections:
+        doc_type = resolved.get(section.document_type_id)
+        if doc_type is None:
+            continue
+        for anchor in section.anchor_patterns:
+            pattern = anchor_pattern(anchor)
+            if pattern:
+                add(doc_type, SECTION_ANCHOR_CATEGORY, pattern, f"section {section.canonical_name!r}")
+    
+    return document_patterns
+
+
+def rule_version(document_types: List[DocumentType], sections: List[Section]) -> str:
+    """Fingerprint of every rule row detection uses; any edit to them changes it"""
+    rows = sorted(
+        [("document_type", str(t.id), t.key, str(t.parent_id), t.version) for t in document_types]
+        + [("section", str(s.id), str(s.document_type_id), s.version, list(s.anchor_patterns)) for s in sections],
+        key=lambda row: (row[0], row[1])
+    )
+    return hashlib.sha256(json.dumps(rows, default=str).encode()).hexdigest()[:16]
+
+
+class DetectionRuleService:
+    """
+    Matchers compiled from the rule tables, cached per (org, rule version)
+    
+    Each organization's rule version is re-read at most every refresh_seconds, or sooner
+    after invalidate() bumps the shared generation counter in Redis. A matcher is only
+    compiled when a version hasn't been seen before.
+    """
+    
+    GENERATION_KEY = "nmtc:detection-rules:generation"
+    MAX_CACHED_MATCHERS = 32
+    
+    def __init__(self, refresh_seconds: int):
+        self.refresh_seconds = refresh_seconds
+        self._matchers: 'OrderedDict[Tuple[Optional[uuid.UUID], str], CombinedPatternMatcher]' = OrderedDict()
+        # org -> (rule version, when it was read, generation it was read at)
+        self._versions: Dict[Optional[uuid.UUID], Tuple[str, float, Optional[int]]] = {}
+    
+    def _generation(self) -> Optional[int]:
+        """The shared invalidation counter, or None when Redis can't be read"""
+        try:
+            from app.services.redis_service import get_redis_client
+            return int(get_redis_client().get(self.GENERATION_KEY) or 0)
+        except Exception as e:
+            logger.warning(f"Could not read detection rule generation, relying on refresh interval: {e}")
+            return None
+    
+    def _cached(self, org_id: Optional[uuid.UUID], generation: Optional[int]) -> Optional[CombinedPatternMatcher]:
+        if org_id not in self._versions:
+            return None
+        version, read_at, read_generation = self._versions[org_id]
+        if time.monotonic() - read_at > self.refresh_seconds or generation != read_generation:
+            return None
+        matcher = self._matchers.get((org_id, version))
+        if matcher is not None:
+            self._matchers.move_to_end((org_id, version))
+        return matcher
+    
+    async def get_matcher(self, org_id: Optional[uuid.UUID] = None) -> CombinedPatternMatcher:
+        """
+        The detection matcher for an organization (template rules only when org_id is None)
+        
+        When the rule tables can't be read, the last matcher for the organization is kept,
+        or the built-in patterns are used.
+        """
+        if not settings.DETECTION_RULES_ENABLED:
+            return compile_matcher(NMTCPatterns.DOCUMENT_PATTERNS)
+        
+        generation = await asyncio.to_thread(self._generation)
+        matcher = self._cached(org_id, generation)
+        if matcher is not None:
+            return matcher
+        
+        try:
+            document_types = await database_service.get_effective_document_types(org_id)
+            sections = await database_service.get_sections([t.id for t in document_types])
+        except Exception as e:
+            previous = self._versions.get(org_id)
+            matcher = self._matchers.get((org_id, previous[0])) if previous else None
+            logger.warning(f"Could not load detection rules for org {org_id}, using "
+                           f"{'previous' if matcher else 'built-in'} patterns: {e}")
+            return matcher or compile_matcher(NMTCPatterns.DOCUMENT_PATTERNS)
+        
+        version = rule_version(document_types, sections)
+        self._versions[org_id] = (version, time.monotonic(), generation)
+        
+        matcher = self._matchers.get((org_id, version))
+        if matcher is None:
+            matcher = compile_matcher(build_document_patterns(document_types, sections))
+            # Older versions for this organization won't be asked for again
+            for key in [key for key in self._matchers if key[0] == org_id]:
+                del self._matchers[key]
+            self._matchers[(org_id, version)] = matcher
+            while len(self._matchers) > self.MAX_CACHED_MATCHERS:
+                self._matchers.popitem(last=False)
+            logger.info(f"Compiled detection rules for org {org_id} at version {version} "
+                        f"({len(matcher.patterns)} patterns)")
+        else:
+            self._matchers.move_to_end((org_id, version))
+        
+        return matcher
+    
+    def invalidate(self) -> Optional[int]:
+        """
+        Make every worker re-read the rule tables on its next detection
+        
+        Call after editing document_types or sections. Returns the
+        new generation, or None when Redis is unavailable (workers then pick the edit up
+        within refresh_seconds).
+        """
+        # Stale locally too, even if Redis can't be reached
+        self._versions = {
+            org_id: (version, float('-inf'), generation)
+            for org_id, (version, _, generation) in self._versions.items()
+        }
+        try:
+            from app.services.redis_service import get_redis_client
+            return int(get_redis_client().incr(self.GENERATION_KEY))
+        except Exception as e:
+            logger.warning(f"Could not publish detection rule invalidation: {e}")
+            return None
+
+
+# Global service instance
+detection_rule_service = DetectionRuleService(settings.DETECTION_RULES_REFRESH_SECONDS)
@@ -2,22 +2,32 @@
 NMTC Document Type Detection Service
 This service analyzes OCR text to identify NMTC document types and extract metadata.
 """
-import re
-from typing import Dict, List, Optional, Tuple, Any
+import math
+import multiprocessing
+import weakref
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from typing import Dict, List, Optional, Tuple, Any, Iterable, Iterator, Hashable
 from datetime import datetime
 import uuid
 
+import numpy as np
+
 from app.utils.nmtc_patterns import (
     NMTCPatterns, 
     NMTCDocumentType, 
     PatternMatch, 
     DocumentTypeResult,
-    NMTC_KEY_FIELDS,
-    DOCUMENT_STRUCTURE_INDICATORS,
-    COMPLIANCE_TERMS,
+    LazyPatternHits,
+    CombinedPatternMatcher,
+    fold_case,
+    pattern_bank,
     get_confidence_level_description
 )
 from app.utils.exceptions import DocumentProcessingError
+from app.utils.regex_safety import BOUNDED_WINDOW
 import logging
 
 logger = logging.getLogger(__name__)
@@ -28,13 +38,18 @@ class NMTCDetectionService:
     
     def __init__(self):
         self.patterns = NMTCPatterns()
+        self._band_confidence_cache: Dict[str, np.ndarray] = {}
+        self._scoring_tables: 'weakref.WeakKeyDictionary[CombinedPatternMatcher, ScoringTable]' = weakref.WeakKeyDictionary()
         logger.info("NMTC Detection Service initialized")
     
     def detect_document_type(
         self, 
         text_content: str, 
         document_id: Optional[uuid.UUID] = None,
-        filename: Optional[str] = None
+        filename: Optional[str] = None,
+        tiered: bool = True,
+        top_k: int = 1,
+        matcher: Optional[CombinedPatternMatcher] = None
     ) -> DocumentTypeResult:
         """
         Detect the document type based on text content
@@ -43,6 +58,11 @@ class NMTCDetectionService:
             text_content: OCR extracted text
             document_id: Optional document ID for logging
             filename: Optional filename for additional context
+            tiered: Skip document types that provably can't rank in the top_k (same result
+                as scoring every type); False scores every type in full
+            top_k: Number of ranked types to report in metadata["ranked_types"] when above 1
+            matcher: Detection patterns to use, e.g. an organization's from detection_rules;
+                defaults to the built-in NMTCPatterns
             
         Returns:
             DocumentTypeResult with classification and metadata
@@ -56,24 +76,15 @@ class NMTCDetectionService:
             if not text_content or len(text_content.strip()) < 50:
                 return self._create_unknown_result("Insufficient text content for classification")
             
-            # Score each document type
-            type_scores = {}
-            all_matches = {}
-            
-            for doc_type in self.patterns.get_all_document_types():
-                score, matches = self._score_document_type(text_content, doc_type)
-                type_scores[doc_type] = score
-                all_matches[doc_type] = matches
-                
-                logger.debug("Document type scoring",
-                                      doc_type=doc_type.value,
-                                      score=score,
-                                      match_count=len(matches))
+            folded = fold_case(text_content)
+            matcher = matcher or self.patterns.matcher
+            if tiered:
+                ranked, scoring = self._rank_document_types_tiered(text_content, folded, matcher, top_k)
+            else:
+                ranked, scoring = self._rank_document_types(text_content, folded, matcher, top_k)
             
             # Find the best match
-            best_type = max(type_scores, key=type_scores.get)
-            best_score = type_scores[best_type]
-            best_matches = all_matches[best_type]
+            best_type, best_score, best_matches = ranked[0]
             
             # If confidence is too low, return unknown
             min_threshold = self.patterns.MIN_CONFIDENCE_THRESHOLDS['low_confidence']
@@ -83,7 +94,13 @@ class NMTCDetectionService:
                 )
             
             # Extract metadata based on document type
-            metadata = self._extract_metadata(text_content, best_type, filename)
+            metadata = self._extract_metadata(text_content, best_type, filename, folded)
+            metadata["scoring"] = scoring
+            if top_k > 1:
+                metadata["ranked_types"] = [
+                    {"document_type": doc_type.value, "confidence": score}
+                    for doc_type, score, _ in ranked
+                ]
             
             # Create result
             result = DocumentTypeResult(
@@ -110,67 +127,240 @@ class NMTCDetectionService:
                                   error=str(e))
             raise DocumentProcessingError(f"Document type detection failed: {e}", document_id)
     
-    def _score_document_type(self, text_content: str, doc_type: NMTCDocumentType) -> Tuple[float, List[PatternMatch]]:
-        """Score how well the text matches a specific document type"""
-        patterns = self.patterns.get_document_patterns(doc_type)
+    def detect_many(
+        self,
+        documents: Iterable[Tuple[Hashable, str, Optional[str]]],
+        executor: Optional[Executor] = None,
+        matcher: Optional[CombinedPatternMatcher] = None
+    ) -> Iterator[Tuple[Hashable, Optional[DocumentTypeResult], Optional[str]]]:
+        """
+        Detect the document type of many documents
+        
+        Args:
+            documents: (key, text_content, filename) per document; key is passed through
+            executor: Pool to run detection in (see detection_pool); None runs it inline
+            matcher: Detection patterns for every document, as in detect_document_type
+            
+        Yields:
+            (key, result, None), or (key, None, error message) where detection failed, in input order
+        """
+        detect = partial(_detect_one, matcher=matcher)
+        if executor is None:
+            for document in documents:
+                yield detect(document)
+            return
+        
+        # The matcher is pickled with every chunk sent to a worker, so send a few large
+        # chunks (about four per core) rather than one document at a time
+        documents = list(documents)
+        chunksize = max(1, math.ceil(len(documents) / (4 * (os.cpu_count() or 1))))
+        yield from executor.map(detect, documents, chunksize=chunksize)
+    
+    def _rank_document_types(
+        self,
+        text_content: str,
+        folded: str,
+        matcher: CombinedPatternMatcher,
+        top_k: int = 1
+    ) -> Tuple[List[Tuple[NMTCDocumentType, float, List[PatternMatch]]], Dict[str, Any]]:
+        """Score every document type in full; returns the top_k (type, score, matches), best first"""
+        # Run every distinct pattern once, then score each document type from the shared hits
+        pattern_hits = matcher.scan(text_content, folded)
+        type_scores = self._scoring_table(matcher).score_all(pattern_hits, len(text_content))
+        
+        # Highest score first; ties go to the type listed first
+        ranked = []
+        for doc_type in sorted(type_scores, key=lambda t: -type_scores[t])[:max(1, top_k)]:
+            # Indicators are only cut for the types reported
+            _, matches = self._score_document_type(text_content, doc_type, pattern_hits, matcher)
+            ranked.append((doc_type, type_scores[doc_type], matches))
+        
+        return ranked, {"mode": "full", "types_scored": len(type_scores), "patterns_run": len(pattern_hits)}
+    
+    def _rank_document_types_tiered(
+        self,
+        text_content: str,
+        folded: str,
+        matcher: CombinedPatternMatcher,
+        top_k: int = 1
+    ) -> Tuple[List[Tuple[NMTCDocumentType, float, List[PatternMatch]]], Dict[str, Any]]:
+        """
+        Rank document types like _rank_document_types, skipping the ones that can't place
+        
+        Title patterns over the first PREFIX_SCAN_CHARS decide which types to score first.
+        Each type's categories are then scored over the full text, heaviest first, and the
+        type is dropped as soon as an upper bound on its score (scored categories plus the
+        best confidence still possible in the rest) can't beat the current top_k.
+        """
+        pattern_hits = matcher.lazy_scan(text_content, folded)
+        doc_types = self.patterns.get_all_document_types()
+        type_order = {doc_type: index for index, doc_type in enumerate(doc_types)}
+        top_k = max(1, top_k)
+        
+        # Tier 1: the strongest title evidence near the top of the document is scored first
+        prefix = text_content[:self.patterns.PREFIX_SCAN_CHARS]
+        prefix_evidence = {doc_type: self._prefix_title_evidence(prefix, doc_type, matcher) for doc_type in doc_types}
+        
+        # Tier 2: exact scores, as (score, type order, type), highest first
+        leaders: List[Tuple[float, int, NMTCDocumentType]] = []
+        skipped = []
+        band_presence: Dict[int, np.ndarray] = {}  # pattern id -> bonus bands hit, shared by types
+        
+        for doc_type in sorted(doc_types, key=lambda t: (-prefix_evidence[t], type_order[t])):
+            cutoff = leaders[-1][:2] if len(leaders) >= top_k else None
+            score = self._bounded_type_score(
+                text_content, doc_type, matcher, pattern_hits, band_presence, type_order[doc_type], cutoff
+            )
+            if score is None:
+                skipped.append(doc_type.value)
+                continue
+            
+            leaders.append((score, type_order[doc_type], doc_type))
+            leaders.sort(key=lambda leader: (-leader[0], leader[1]))
+            del leaders[top_k:]
+        
+        ranked = []
+        for score, _, doc_type in leaders:
+            # Every category of a leader has been scored, so this only reuses cached hits
+            _, matches = self._score_document_type(text_content, doc_type, pattern_hits, matcher)
+            ranked.append((doc_type, score, matches))
+        
+        scoring = {
+            "mode": "tiered",
+            "types_scored": len(doc_types) - len(skipped),
+            "types_skipped": skipped,
+            "patterns_run": pattern_hits.patterns_run
+        }
+        return ranked, scoring
+    
+    def _prefix_title_evidence(self, prefix: str, doc_type: NMTCDocumentType, matcher: CombinedPatternMatcher) -> float:
+        """Best title pattern confidence within the prefix (only orders tiered scoring)"""
+        best = 0.0
+        for pattern_id in matcher.category_pattern_ids(doc_type).get('title_patterns', []):
+            match = matcher.patterns[pattern_id].search(prefix)
+            if match:
+                best = max(best, self._calculate_match_confidence(*match.span(), len(prefix), 'title_patterns'))
+        return best
+    
+    def _bounded_type_score(
+        self,
+        text_content: str,
+        doc_type: NMTCDocumentType,
+        matcher: CombinedPatternMatcher,
+        pattern_hits: LazyPatternHits,
+        band_presence: Dict[int, np.ndarray],
+        type_index: int,
+        cutoff: Optional[Tuple[float, int]]
+    ) -> Optional[float]:
+        """
+        Exact score of a document type, or None once it provably can't beat cutoff
+        
+        cutoff is the (score, type order) of the lowest-ranked leader; a type beats it with a
+        higher score, or an equal score and an earlier place in the type order.
+        """
+        categories = matcher.category_pattern_ids(doc_type)
+        text_length = len(text_content)
+        
+        # Until scored, a category is worth the best confidence it could reach (none if no pattern can match)
+        values = {
+            category: self._confidence_bound(category)
+            if any(pattern_hits.may_match(pattern_id) for pattern_id in pattern_ids) else 0.0
+            for category, pattern_ids in categories.items()
+        }
+        
+        def score() -> float:
+            # Same summation order as _score_document_type, so bounds and exact scores compare exactly
+            total_score = 0.0
+            for category in categories:
+                if values[category]:
+                    total_score += values[category] * self.patterns.SCORING_WEIGHTS.get(category, 0.1)
+            return min(total_score, 1.0)
+        
+        def can_beat_cutoff() -> bool:
+            if cutoff is None:
+                return True
+            upper_bound = score()
+            return upper_bound > cutoff[0] or (upper_bound == cutoff[0] and type_index < cutoff[1])
+        
+        by_weight = sorted(categories, key=lambda category: -self.patterns.SCORING_WEIGHTS.get(category, 0.1))
+        for category in by_weight:
+            if not can_beat_cutoff():
+                return None
+            if not values[category]:
+                continue
+            # Best confidence among the bonus bands any of the category's patterns hit
+            bands = np.zeros(9, dtype=bool)
+            for pattern_id in categories[category]:
+                if pattern_hits.may_match(pattern_id):
+                    if pattern_id not in band_presence:
+                        band_presence[pattern_id] = self._band_presence(pattern_hits.get(pattern_id, []), text_length)
+                    bands |= band_presence[pattern_id]
+            values[category] = float(self._band_confidences(category)[bands].max()) if bands.any() else 0.0
+        
+        return score() if can_beat_cutoff() else None
+    
+    def _confidence_bound(self, pattern_category: str) -> float:
+        """Highest confidence any match in a category can get (early and over 50 chars)"""
+        return self._calculate_match_confidence(0, 51, 1, pattern_category)
+    
+    def _score_document_type(
+        self,
+        text_content: str,
+        doc_type: NMTCDocumentType,
+        pattern_hits: Optional[Dict[int, List[Tuple[int, int]]]] = None,
+        matcher: Optional[CombinedPatternMatcher] = None
+    ) -> Tuple[float, List[PatternMatch]]:
+        """
+        Score how well the text matches a specific document type
+        
+        pattern_hits is the combined matcher's scan of the text, shared across document
+        types; it is computed here when not given. matcher defaults to the built-in patterns. Every hit counts towards the score, but
+        only the best MAX_INDICATORS_PER_CATEGORY per category are returned as matches.
+        """
+        matcher = matcher or self.patterns.matcher
+        if pattern_hits is None:
+            pattern_hits = matcher.scan(text_content)
+        
+        text_length = len(text_content)
+        max_indicators = self.patterns.MAX_INDICATORS_PER_CATEGORY
         matches = []
         total_score = 0.0
         
-        for pattern_category, pattern_list in patterns.items():
+        for pattern_category, pattern_ids in matcher.category_pattern_ids(doc_type).items():
             category_weight = self.patterns.SCORING_WEIGHTS.get(pattern_category, 0.1)
-            category_matches = []
-            
-            for pattern in pattern_list:
-                pattern_matches = list(pattern.finditer(text_content))
-                
-                for match in pattern_matches:
-                    # Calculate confidence based on match quality
-                    match_confidence = self._calculate_match_confidence(match, text_content, pattern_category)
-                    
-                    # Get context around the match
-                    context = self._extract_context(text_content, match.start(), match.end())
-                    
-                    pattern_match = PatternMatch(
-                        pattern_type=pattern_category,
-                        match_text=match.group(0),
-                        confidence=match_confidence,
-                        location=f"Position {match.start()}-{match.end()}",
-                        context=context
-                    )
-                    
-                    category_matches.append(pattern_match)
+            pattern_spans = [pattern_hits.get(pattern_id, []) for pattern_id in pattern_ids]
+            hit_count = sum(len(hits) for hits in pattern_spans)
             
             # Score this category
-            if category_matches:
+            if hit_count:
+                # Confidence of every hit at once, from its position and length bonus bands
+                spans = np.array([span for hits in pattern_spans for span in hits], dtype=np.int64)
+                hit_pattern_ids = np.repeat(pattern_ids, [len(hits) for hits in pattern_spans])
+                confidences = self._band_confidences(pattern_category)[self._bonus_bands(spans, text_length)]
+                
                 # Use the best match from this category
-                best_match = max(category_matches, key=lambda m: m.confidence)
-                category_score = best_match.confidence * category_weight
-                total_score += category_score
-                matches.extend(category_matches)
+                best_confidence = float(confidences.max())
+                total_score += best_confidence * category_weight
+                
+                # Keep the strongest hits (earliest first among equals), in document scan order
+                kept = np.sort(np.argsort(-confidences, kind='stable')[:max_indicators])
+                for index in kept.tolist():
+                    start, end = spans[index].tolist()
+                    matches.append(PatternMatch(
+                        pattern_category, float(confidences[index]), start, end, text_content, int(hit_pattern_ids[index])
+                    ))
         
         return min(total_score, 1.0), matches  # Cap at 1.0
     
-    def _calculate_match_confidence(self, match: re.Match, text_content: str, pattern_category: str) -> float:
-        """Calculate confidence score for a specific pattern match"""
+    def _calculate_match_confidence(self, start: int, end: int, text_length: int, pattern_category: str) -> float:
+        """Calculate confidence score for a pattern match spanning start:end"""
         base_confidence = 0.7
         
         # Adjust based on pattern category importance
-        category_multipliers = {
-            'title_patterns': 1.2,
-            'key_terms': 1.0,
-            'structural_patterns': 0.9,
-            'financial_patterns': 0.8,
-            'certification_patterns': 0.9,
-            'commitment_patterns': 0.8,
-            'reporting_patterns': 0.8,
-            'legal_patterns': 0.8,
-            'insurance_patterns': 0.8
-        }
-        
-        multiplier = category_multipliers.get(pattern_category, 1.0)
+        multiplier = self.patterns.CATEGORY_MULTIPLIERS.get(pattern_category, 1.0)
         
         # Adjust based on match position (title matches are more important)
-        match_position = match.start() / len(text_content) if text_content else 0
+        match_position = start / text_length if text_length else 0
         if match_position < 0.1:  # First 10% of document
             position_bonus = 0.1
         elif match_position < 0.3:  # First 30%
@@ -179,7 +369,7 @@ class NMTCDetectionService:
             position_bonus = 0.0
         
         # Adjust based on match length (longer matches generally better)
-        match_length = len(match.group(0))
+        match_length = end - start
         if match_length > 50:
             length_bonus = 0.1
         elif match_length > 20:
@@ -190,26 +380,62 @@ class NMTCDetectionService:
         final_confidence = min((base_confidence * multiplier) + position_bonus + length_bonus, 1.0)
         return final_confidence
     
-    def _extract_context(self, text_content: str, start: int, end: int, context_size: int = 100) -> str:
-        """Extract context around a match for better understanding"""
-        context_start = max(0, start - context_size)
-        context_end = min(len(text_content), end + context_size)
-        
-        context = text_content[context_start:context_end]
-        
-        # Clean up context
-        context = re.sub(r'\s+', ' ', context).strip()
-        
-        # Add ellipsis if truncated
-        if context_start > 0:
-            context = "..." + context
-        if context_end < len(text_content):
-            context = context + "..."
+    def _band_confidences(self, pattern_category: str) -> np.ndarray:
+        """
+        Confidence of a match in each bonus band of a category, indexed as _bonus_bands numbers them
         
-        return context
+        A match's confidence depends only on its category and on which position bonus and
+        which length bonus it gets, so the nine possible values are worked out once with
+        _calculate_match_confidence and looked up for every match.
+        """
+        confidences = self._band_confidence_cache.get(pattern_category)
+        if confidences is None:
+            confidences = np.array([
+                self._calculate_match_confidence(start, start + length, 100, pattern_category)
+                for start in (0, 10, 30)      # first 10%, first 30%, later (of 100 chars)
+                for length in (51, 21, 0)     # over 50, over 20, shorter
+            ])
+            self._band_confidence_cache[pattern_category] = confidences
+        return confidences
     
-    def _extract_metadata(self, text_content: str, doc_type: NMTCDocumentType, filename: Optional[str] = None) -> Dict[str, Any]:
+    @staticmethod
+    def _bonus_bands(spans: np.ndarray, text_length: int) -> np.ndarray:
+        """Bonus band (3 x position band + length band) of each (start, end) row"""
+        starts = spans[:, 0]
+        lengths = spans[:, 1] - starts
+        if text_length:
+            match_position = starts / text_length
+            position_band = (match_position >= 0.1).astype(np.intp) + (match_position >= 0.3)
+        else:
+            position_band = np.zeros(len(starts), dtype=np.intp)
+        length_band = (lengths <= 50).astype(np.intp) + (lengths <= 20)
+        return position_band * 3 + length_band
+    
+    def _band_presence(self, spans: List[Tuple[int, int]], text_length: int) -> np.ndarray:
+        """Which of the nine bonus bands the matches fall in"""
+        if not spans:
+            return np.zeros(9, dtype=bool)
+        bands = self._bonus_bands(np.array(spans, dtype=np.int64), text_length)
+        return np.bincount(bands, minlength=9) > 0
+    
+    def _scoring_table(self, matcher: CombinedPatternMatcher) -> 'ScoringTable':
+        table = self._scoring_tables.get(matcher)
+        if table is None:
+            table = ScoringTable(self, matcher)
+            self._scoring_tables[matcher] = table
+        return table
+    
+    def _extract_metadata(
+        self,
+        text_content: str,
+        doc_type: NMTCDocumentType,
+        filename: Optional[str] = None,
+        folded: Optional[str] = None
+    ) -> Dict[str, Any]:
         """Extract document-specific metadata"""
+        if folded is None:
+            folded = fold_case(text_content)
+        
         metadata = {
             "detection_timestamp": datetime.utcnow().isoformat(),
             "filename": filename,
@@ -221,123 +447,19 @@ class NMTCDetectionService:
         }
         
         # Extract key fields
-        metadata["extracted_fields"] = self._extract_key_fields(text_content)
+        metadata["extracted_fields"] = pattern_bank.extract_key_fields(text_content, folded)
         
         # Check document structure
-        metadata["structure_indicators"] = self._check_document_structure(text_content)
+        metadata["structure_indicators"] = pattern_bank.check_structure(text_content, folded)
         
         # Find compliance terms
-        metadata["compliance_terms"] = self._find_compliance_terms(text_content)
+        metadata["compliance_terms"] = pattern_bank.find_compliance_terms(text_content, folded)
         
         # Document type specific metadata
-        if doc_type == NMTCDocumentType.ALLOCATION_AGREEMENT:
-            metadata.update(self._extract_allocation_metadata(text_content))
-        elif doc_type == NMTCDocumentType.QLICI_LOAN:
-            metadata.update(self._extract_loan_metadata(text_content))
-        elif doc_type == NMTCDocumentType.QALICB_CERTIFICATION:
-            metadata.update(self._extract_certification_metadata(text_content))
-        elif doc_type == NMTCDocumentType.FINANCIAL_STATEMENT:
-            metadata.update(self._extract_financial_metadata(text_content))
+        metadata.update(pattern_bank.check_document_type(text_content, doc_type, folded))
         
         return metadata
     
-    def _extract_key_fields(self, text_content: str) -> Dict[str, List[str]]:
-        """Extract key fields like dates, amounts, entities"""
-        extracted_fields = {}
-        
-        for field_category, field_config in NMTC_KEY_FIELDS.items():
-            field_matches = []
-            
-            for pattern_str in field_config['patterns']:
-                pattern = re.compile(pattern_str, re.IGNORECASE | re.MULTILINE)
-                matches = pattern.findall(text_content)
-                
-                # Clean and deduplicate matches
-                clean_matches = list(set([match.strip() for match in matches if match.strip()]))
-                field_matches.extend(clean_matches)
-            
-            if field_matches:
-                extracted_fields[field_category] = field_matches
-        
-        return extracted_fields
-    
-    def _check_document_structure(self, text_content: str) -> Dict[str, bool]:
-        """Check for document structure indicators"""
-        structure_indicators = {}
-        
-        for indicator_name, pattern_str in DOCUMENT_STRUCTURE_INDICATORS.items():
-            pattern = re.compile(pattern_str, re.IGNORECASE | re.MULTILINE)
-            has_indicator = bool(pattern.search(text_content))
-            structure_indicators[indicator_name] = has_indicator
-        
-        return structure_indicators
-    
-    def _find_compliance_terms(self, text_content: str) -> List[Dict[str, Any]]:
-        """Find NMTC compliance and regulatory terms"""
-        found_terms = []
-        
-        for category, terms in COMPLIANCE_TERMS.items():
-            for term in terms:
-                pattern = re.compile(re.escape(term), re.IGNORECASE)
-                matches = list(pattern.finditer(text_content))
-                
-                if matches:
-                    found_terms.append({
-                        "category": category,
-                        "term": term,
-                        "count": len(matches),
-                        "positions": [match.start() for match in matches]
-                    })
-        
-        return found_terms
-    
-    def _extract_allocation_metadata(self, text_content: str) -> Dict[str, Any]:
-        """Extract allocation agreement specific metadata"""
-        return {
-            "allocation_specific": {
-                "has_qei_amount": bool(re.search(r'qei.*amount', text_content, re.IGNORECASE)),
-                "has_compliance_period": bool(re.search(r'7.*year.*compliance', text_content, re.IGNORECASE)),
-                "has_recapture_terms": bool(re.search(r'recapture', text_content, re.IGNORECASE)),
-                "mentions_cdfi_fund": bool(re.search(r'cdfi.*fund', text_content, re.IGNORECASE))
-            }
-        }
-    
-    def _extract_loan_metadata(self, text_content: str) -> Dict[str, Any]:
-        """Extract loan agreement specific metadata"""
-        return {
-            "loan_specific": {
-                "has_principal_amount": bool(re.search(r'principal.*amount', text_content, re.IGNORECASE)),
-                "has_interest_rate": bool(re.search(r'interest.*rate', text_content, re.IGNORECASE)),
-                "has_maturity_date": bool(re.search(r'maturity.*date', text_content, re.IGNORECASE)),
-                "mentions_qalicb_tests": bool(re.search(r'(?:70%|40%).*test', text_content, re.IGNORECASE)),
-                "has_security_provisions": bool(re.search(r'security|collateral', text_content, re.IGNORECASE))
-            }
-        }
-    
-    def _extract_certification_metadata(self, text_content: str) -> Dict[str, Any]:
-        """Extract QALICB certification specific metadata"""
-        return {
-            "certification_specific": {
-                "has_census_tract": bool(re.search(r'census.*tract', text_content, re.IGNORECASE)),
-                "mentions_income_test": bool(re.search(r'70%.*income', text_content, re.IGNORECASE)),
-                "mentions_property_test": bool(re.search(r'40%.*property', text_content, re.IGNORECASE)),
-                "has_certification_period": bool(re.search(r'certification.*period', text_content, re.IGNORECASE)),
-                "mentions_substantially_all": bool(re.search(r'substantially.*all', text_content, re.IGNORECASE))
-            }
-        }
-    
-    def _extract_financial_metadata(self, text_content: str) -> Dict[str, Any]:
-        """Extract financial statement specific metadata"""
-        return {
-            "financial_specific": {
-                "has_balance_sheet": bool(re.search(r'balance.*sheet', text_content, re.IGNORECASE)),
-                "has_income_statement": bool(re.search(r'income.*statement', text_content, re.IGNORECASE)),
-                "has_cash_flow": bool(re.search(r'cash.*flow', text_content, re.IGNORECASE)),
-                "has_audit_opinion": bool(re.search(r'(?:audit|opinion|independent)', text_content, re.IGNORECASE)),
-                "mentions_fiscal_year": bool(re.search(r'(?:fiscal.*year|year.*ended)', text_content, re.IGNORECASE))
-            }
-        }
-    
     def _generate_reasoning(self, doc_type: NMTCDocumentType, confidence: float, matches: List[PatternMatch]) -> str:
         """Generate human-readable reasoning for the classification"""
         confidence_desc = get_confidence_level_description(confidence)
@@ -409,5 +531,209 @@ class NMTCDetectionService:
         return descriptions.get(doc_type, "NMTC-related document")
 
 
+class ScoringTable:
+    """
+    Scores every document type of one matcher from a scan in a few array operations
+    
+    Rows of the membership matrix are (document type, category) cells in declaration
+    order, columns are pattern ids. The per-pattern bonus bands hit are combined into each
+    cell's bands with one product, and each cell's maximum confidence is looked up from
+    its category's band confidences. Weights come from a types x categories matrix built
+    from SCORING_WEIGHTS.
+    """
+    
+    def __init__(self, service: NMTCDetectionService, matcher: CombinedPatternMatcher):
+        self.service = service
+        self.doc_types = service.patterns.get_all_document_types()
+        self.categories: List[str] = []
+        cell_types, cell_categories, cell_patterns = [], [], []
+        
+        for type_index, doc_type in enumerate(self.doc_types):
+            for category, pattern_ids in matcher.category_pattern_ids(doc_type).items():
+                if category not in self.categories:
+                    self.categories.append(category)
+                cell_types.append(type_index)
+                cell_categories.append(self.categories.index(category))
+                cell_patterns.append(pattern_ids)
+        
+        self.weights = np.zeros((len(self.doc_types), len(self.categories)))
+        for category_index, category in enumerate(self.categories):
+            self.weights[:, category_index] = service.patterns.SCORING_WEIGHTS.get(category, 0.1)
+        
+        self.cell_types = np.array(cell_types, dtype=np.intp)
+        self.cell_weights = self.weights[self.cell_types, cell_categories]
+        self.membership = np.zeros((len(cell_patterns), len(matcher.patterns)), dtype=np.int32)
+        for cell, pattern_ids in enumerate(cell_patterns):
+            self.membership[cell, pattern_ids] = 1
+        self.cell_confidences = np.array(
+            [service._band_confidences(self.categories[category_index]) for category_index in cell_categories]
+        ).reshape(len(cell_patterns), 9)
+    
+    def score_all(self, pattern_hits: Dict[int, List[Tuple[int, int]]], text_length: int) -> Dict[NMTCDocumentType, float]:
+        """Score of every document type, equal to _score_document_type's"""
+        presence = np.zeros((self.membership.shape[1], 9), dtype=np.int32)
+        for pattern_id, spans in pattern_hits.items():
+            presence[pattern_id] = self.service._band_presence(spans, text_length)
+        
+        cell_bands = (self.membership @ presence) > 0
+        cell_best = np.where(cell_bands, self.cell_confidences, 0.0).max(axis=1, initial=0.0)
+        weighted = (cell_best * self.cell_weights).tolist()
+        
+        # Summed cell by cell in declaration order, so totals round exactly as before
+        totals = [0.0] * len(self.doc_types)
+        for cell, type_index in enumerate(self.cell_types.tolist()):
+            totals[type_index] += weighted[cell]
+        return {doc_type: min(total, 1.0) for doc_type, total in zip(self.doc_types, totals)}
+
+
+class StreamingDetector:
+    """
+    Provisional document type detection over OCR text that arrives in order, page by page
+    
+    Each new segment is scanned once (with a little of the previous text, for matches that
+    straddle the join). Per pattern it keeps the earliest match start in each length bonus
+    band, which is enough to recompute every category maximum exactly for the text seen so
+    far, as detect_document_type would score that text. Once the leading score reaches
+    high_confidence, feed() returns a provisional classification; the final one still
+    comes from detect_document_type over the whole document.
+    """
+    
+    # Previous text rescanned with each segment; matches of the bounded patterns are shorter
+    OVERLAP_CHARS = 2 * BOUNDED_WINDOW
+    
+    # Match lengths standing for each length bonus band (over 50, over 20, the rest)
+    LENGTH_BANDS = (51, 21, 0)
+    
+    def __init__(
+        self,
+        service: Optional[NMTCDetectionService] = None,
+        matcher: Optional[CombinedPatternMatcher] = None,
+        threshold: Optional[float] = None
+    ):
+        self.service = service or detection_service
+        self.matcher = matcher or self.service.patterns.matcher
+        self.threshold = threshold if threshold is not None else self.service.patterns.MIN_CONFIDENCE_THRESHOLDS['high_confidence']
+        self.text_length = 0
+        self.segments = 0
+        self.provisional: Optional[Dict[str, Any]] = None
+        self._tail = ""
+        # pattern id -> earliest start per length band
+        self._earliest: Dict[int, List[Optional[int]]] = {}
+    
+    def feed(self, segment: str) -> Optional[Dict[str, Any]]:
+        """
+        Add the next segment of text (joined to the previous one with a newline)
+        
+        Returns the provisional classification when this segment makes one (or changes its
+        type), else None.
+        """
+        if not segment:
+            return None
+        
+        # The rescanned tail starts at a line start, so ^ anchors behave as in the full text
+        prefix = self._tail + "\n" if self.segments else ""
+        window = prefix + segment
+        offset = self.text_length + (1 if self.segments else 0) - len(prefix)
+        self.text_length += len(segment) + (1 if self.segments else 0)
+        self.segments += 1
+        
+        hits = self.matcher.scan(window)
+        for pattern_id, spans in hits.items():
+            earliest = self._earliest.setdefault(pattern_id, [None] * len(self.LENGTH_BANDS))
+            for start, end in spans:
+                band = self._length_band(end - start)
+                if earliest[band] is None or offset + start < earliest[band]:
+                    earliest[band] = offset + start
+        
+        cut = max(0, len(window) - self.OVERLAP_CHARS)
+        self._tail = window[window.rfind("\n", 0, cut) + 1:] if cut else window
+        
+        doc_type, score = self.leader()
+        if score < self.threshold:
+            return None
+        if self.provisional and self.provisional["document_type_detected"] == doc_type.value:
+            return None
+        
+        self.provisional = {
+            "document_type_detected": doc_type.value,
+            "confidence": score,
+            "provisional": True,
+            "chars_seen": self.text_length,
+            "segments_seen": self.segments,
+            "detected_at": datetime.utcnow().isoformat()
+        }
+        return self.provisional
+    
+    def _length_band(self, length: int) -> int:
+        for band, band_length in enumerate(self.LENGTH_BANDS):
+            if length >= band_length:
+                return band
+        return len(self.LENGTH_BANDS) - 1
+    
+    def scores(self) -> Dict[NMTCDocumentType, float]:
+        """Score of every document type over the text seen so far"""
+        service = self.service
+        scores = {}
+        for doc_type in service.patterns.get_all_document_types():
+            total_score = 0.0
+            for category, pattern_ids in self.matcher.category_pattern_ids(doc_type).items():
+                best_confidence = max(
+                    (
+                        service._calculate_match_confidence(start, start + length, self.text_length, category)
+                        for pattern_id in pattern_ids
+                        for start, length in zip(self._earliest.get(pattern_id, ()), self.LENGTH_BANDS)
+                        if start is not None
+                    ),
+                    default=None
+                )
+                if best_confidence is not None:
+                    total_score += best_confidence * service.patterns.SCORING_WEIGHTS.get(category, 0.1)
+            scores[doc_type] = min(total_score, 1.0)
+        return scores
+    
+    def leader(self) -> Tuple[NMTCDocumentType, float]:
+        """Best scoring document type so far (the first listed among equals)"""
+        scores = self.scores()
+        best_type = max(scores, key=scores.get)
+        return best_type, scores[best_type]
+
+
 # Global service instance
-detection_service = NMTCDetectionService()
\ No newline at end of file
+detection_service = NMTCDetectionService()
+
+
+def _detect_one(
+    document: Tuple[Hashable, str, Optional[str]],
+    matcher: Optional[CombinedPatternMatcher] = None
+) -> Tuple[Hashable, Optional[DocumentTypeResult], Optional[str]]:
+    """detect_many's unit of work; runs in pool worker processes, so failures come back as text"""
+    key, text_content, filename = document
+    try:
+        return key, detection_service.detect_document_type(
+            text_content=text_content, filename=filename, matcher=matcher
+        ), None
+    except Exception as e:
+        return key, None, str(e)
+
+
+@contextmanager
+def detection_pool(max_workers: Optional[int] = None):
+    """
+    Process pool for detect_many, or None where detection has to run inline
+    
+    Pattern matching is CPU-bound and holds the GIL, so documents are spread over processes.
+    A daemonic process (e.g. a prefork pool child) can't start children, so batch
+    detection runs on the solo-pool batch worker (app.tasks.queues); a single worker
+    gains nothing over running inline.
+    """
+    workers = max_workers or os.cpu_count() or 1
+    if workers <= 1:
+        yield None
+        return
+    if multiprocessing.current_process().daemon:
+        logger.warning(f"Daemonic process {os.getpid()} can't start a detection pool; detecting inline")
+        yield None
+        return
+    
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield executor
\ No newline at end of file
@@ -0,0 +1,347 @@
+"""
+Fair scheduling of quick detection across organizations.
+Submissions wait here instead of going straight onto the Celery queues, where one
+organization's bulk upload would hold every worker for hours. The scheduler keeps
+a FIFO queue per organization in two priority lanes, interactive (single uploads,
+reprocessing) before bulk (backfills), and starts documents as pipeline capacity
+frees up:
+- across organizations by weighted fair queuing: each organization's next document
+  is tagged with a virtual finish time (its previous tag plus 1 / weight) and the
+  lowest tag goes first, so organizations share capacity in proportion to their
+  plan's weight however much each has queued;
+- within SCHEDULER_MAX_IN_FLIGHT documents in the pipeline overall and
+  SCHEDULER_ORG_MAX_IN_FLIGHT per organization.
+Weights come from the organization's plan type, reduced once its usage for the month
+passes the plan's document limit.
+"""
+from app.config import settings
+from app.services.database_service import database_service
+from datetime import date, datetime, timedelta
+from typing import Dict, Any, List, Optional
+import asyncio
+import json
+import logging
+import math
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE_LANE = "interactive"
+BULK_LANE = "bulk"
+LANES = (INTERACTIVE_LANE, BULK_LANE)
+
+# Queued entries outlive any realistic backlog; they are deleted when dispatched
+ENTRY_TTL_SECONDS = 7 * 24 * 3600
+
+# Weight of the latest pipeline duration in the running average used for estimates
+DURATION_SMOOTHING = 0.2
+
+# Virtual times closer than this are equal when estimating queue positions
+TAG_EPSILON = 1e-9
+
+# Drop an organization from a lane once its queue there is empty (atomically, so a
+# document queued meanwhile is not stranded)
+_REMOVE_IF_EMPTY = "if redis.call('llen', KEYS[1]) == 0 then return redis.call('zrem', KEYS[2], ARGV[1]) end return 0"
+
+# Free a document's in-flight slot; returns its in-flight record, or false when it held none
+_FINISH = """
+local raw = redis.call('hget', KEYS[1], ARGV[1])
+if not raw then return false end
+redis.call('hdel', KEYS[1], ARGV[1])
+local org_id = cjson.decode(raw)['org_id']
+if redis.call('hincrby', KEYS[2], org_id, -1) <= 0 then redis.call('hdel', KEYS[2], org_id) end
+return raw
+"""
+
+
+class DocumentScheduler:
+    """Redis-backed priority lanes with weighted fair queuing and in-flight caps"""
+
+    KEY_PREFIX = "nmtc:scheduler:"
+
+    def __init__(
+        self,
+        max_in_flight: int,
+        org_max_in_flight: int,
+        interactive_org_max_queued: int,
+        default_duration_seconds: float
+    ):
+        self.max_in_flight = max_in_flight
+        self.org_max_in_flight = org_max_in_flight
+        self.interactive_org_max_queued = interactive_org_max_queued
+        self.default_duration_seconds = default_duration_seconds
+        self._redis = None
+
+    @property
+    def redis(self):
+        if self._redis is None:
+            from app.services.redis_service import get_redis_client
+            self._redis = get_redis_client()
+        return self._redis
+
+    def _key(self, *parts: str) -> str:
+        return self.KEY_PREFIX + ":".join(parts)
+
+    @staticmethod
+    def _text(value) -> Optional[str]:
+        return value.decode() if isinstance(value, bytes) else value
+
+    def enqueue(self, document_id: str, org_id: str, lane: str, submission: Dict[str, Any]) -> str:
+        """
+        Queue a document behind its organization's earlier submissions; returns the lane used
+
+        submission is handed back by next_entry when the document's turn comes. Interactive
+        submissions beyond SCHEDULER_INTERACTIVE_ORG_MAX_QUEUED for one organization are
+        treated as bulk, so a client looping over single uploads cannot take the fast lane.
+        """
+        if lane == INTERACTIVE_LANE and \
+                self.redis.llen(self._key("queue", lane, org_id)) >= self.interactive_org_max_queued:
+            lane = BULK_LANE
+
+        # An organization joining a lane starts at the lane's virtual time: no credit for idling
+        virtual_time = float(self.redis.get(self._key("vtime", lane)) or 0)
+        entry = {**submission, "document_id": document_id, "org_id": org_id, "lane": lane, "enqueued_at": time.time()}
+
+        pipe = self.redis.pipeline()
+        pipe.set(self._key("entry", document_id), json.dumps(entry, default=str), ex=ENTRY_TTL_SECONDS)
+        pipe.rpush(self._key("queue", lane, org_id), document_id)
+        pipe.zadd(self._key("orgs", lane), {org_id: virtual_time}, nx=True)
+        pipe.execute()
+        return lane
+
+    def requeue(self, entry: Dict[str, Any]) -> None:
+        """Put a dispatched entry back at the head of its organization's queue (it failed to start)"""
+        lane, org_id, document_id = entry["lane"], entry["org_id"], entry["document_id"]
+        virtual_time = float(self.redis.get(self._key("vtime", lane)) or 0)
+
+        pipe = self.redis.pipeline()
+        pipe.set(self._key("entry", document_id), json.dumps(entry, default=str), ex=ENTRY_TTL_SECONDS)
+        pipe.lpush(self._key("queue", lane, org_id), document_id)
+        pipe.zadd(self._key("orgs", lane), {org_id: virtual_time}, nx=True)
+        pipe.execute()
+        self.finish(document_id, record_duration=False)
+
+    def weights(self) -> Dict[str, float]:
+        return {self._text(org_id): float(weight) for org_id, weight in self.redis.hgetall(self._key("weights")).items()}
+
+    def next_entry(self) -> Optional[Dict[str, Any]]:
+        """
+        Take the next document to start and count it in flight, or None when nothing can start
+
+        Call with the dispatch lock held. Interactive documents go before bulk ones; within a
+        lane the organization with the lowest virtual finish time goes next, skipping those
+        at their in-flight cap.
+        """
+        if self.redis.hlen(self._key("in-flight")) >= self.max_in_flight:
+            return None
+
+        org_in_flight = {self._text(org_id): int(count)
+                         for org_id, count in self.redis.hgetall(self._key("in-flight-orgs")).items()}
+        weights = self.weights()
+
+        for lane in LANES:
+            for org_id, score in self.redis.zrange(self._key("orgs", lane), 0, -1, withscores=True):
+                org_id = self._text(org_id)
+                if org_in_flight.get(org_id, 0) >= self.org_max_in_flight:
+                    continue
+
+                queue_key = self._key("queue", lane, org_id)
+                document_id = self._text(self.redis.lpop(queue_key))
+                raw_entry = None
+                if document_id:
+                    pipe = self.redis.pipeline()
+                    pipe.get(self._key("entry", document_id))
+                    pipe.delete(self._key("entry", document_id))
+                    raw_entry, _ = pipe.execute()
+                if raw_entry is None:
+                    # Empty queue, or an entry that expired or was superseded
+                    self.redis.eval(_REMOVE_IF_EMPTY, 2, queue_key, self._key("orgs", lane), org_id)
+                    continue
+
+                entry = json.loads(raw_entry)
+                weight = weights.get(org_id, settings.SCHEDULER_DEFAULT_WEIGHT)
+
+                pipe = self.redis.pipeline()
+                pipe.zadd(self._key("orgs", lane), {org_id: score + 1 / weight}, xx=True)
+                pipe.set(self._key("vtime", lane), max(score, float(self.redis.get(self._key("vtime", lane)) or 0)))
+                pipe.hset(self._key("in-flight"), document_id, json.dumps({
+                    "org_id": org_id,
+                    "lane": lane,
+                    "dispatched_at": time.time()
+                }))
+                pipe.hincrby(self._key("in-flight-orgs"), org_id, 1)
+                pipe.execute()
+                self.redis.eval(_REMOVE_IF_EMPTY, 2, queue_key, self._key("orgs", lane), org_id)
+                return entry
+
+        return None
+
+    def finish(self, document_id: str, record_duration: bool = True) -> bool:
+        """Free a document's in-flight slot; False when it held none (not scheduled, or already freed)"""
+        raw = self.redis.eval(_FINISH, 2, self._key("in-flight"), self._key("in-flight-orgs"), document_id)
+        if not raw:
+            return False
+
+        if record_duration:
+            duration = time.time() - json.loads(raw)["dispatched_at"]
+            average = float(self.redis.get(self._key("duration")) or duration)
+            self.redis.set(self._key("duration"), average + DURATION_SMOOTHING * (duration - average))
+        return True
+
+    def reap_stale(self) -> List[str]:
+        """Free the slots of documents dispatched too long ago to still be running (a lost worker)"""
+        cutoff = time.time() - settings.SCHEDULER_IN_FLIGHT_TIMEOUT_SECONDS
+        stale = [self._text(document_id) for document_id, raw in self.redis.hgetall(self._key("in-flight")).items()
+                 if json.loads(raw)["dispatched_at"] < cutoff]
+        for document_id in stale:
+            logger.warning(f"Reclaiming scheduler slot of document {document_id}; its pipeline never reported back")
+            self.finish(document_id, record_duration=False)
+        return stale
+
+    def queued_orgs(self) -> List[str]:
+        """Organizations with documents waiting in any lane"""
+        return sorted({self._text(org_id) for lane in LANES for org_id in self.redis.zrange(self._key("orgs", lane), 0, -1)})
+
+    def stale_weight_orgs(self, org_ids: List[str]) -> List[str]:
+        """Those of org_ids whose weight is missing or older than SCHEDULER_WEIGHT_TTL_SECONDS"""
+        if not org_ids:
+            return []
+        checked = self.redis.hmget(self._key("weights-checked"), org_ids)
+        cutoff = time.time() - settings.SCHEDULER_WEIGHT_TTL_SECONDS
+        return [org_id for org_id, checked_at in zip(org_ids, checked) if checked_at is None or float(checked_at) < cutoff]
+
+    def set_weight(self, org_id: str, weight: float) -> None:
+        pipe = self.redis.pipeline()
+        pipe.hset(self._key("weights"), org_id, weight)
+        pipe.hset(self._key("weights-checked"), org_id, time.time())
+        pipe.execute()
+
+    async def refresh_weights(self, org_ids: List[str]) -> None:
+        """Recompute the weights that are missing or stale, from plans and monthly usage"""
+        for org_id in await asyncio.to_thread(self.stale_weight_orgs, org_ids):
+            weight = await organization_weight(uuid.UUID(org_id))
+            await asyncio.to_thread(self.set_weight, org_id, weight)
+
+    def request_dispatch(self) -> bool:
+        """Ask for a dispatch run; False when one is already requested and has not started yet"""
+        return bool(self.redis.set(self._key("dispatch-requested"), 1, nx=True, ex=30))
+
+    def clear_dispatch_request(self) -> None:
+        self.redis.delete(self._key("dispatch-requested"))
+
+    def dispatch_lock(self):
+        """Lock serializing dispatch runs (redis-py Lock; acquire(blocking_timeout=...) before use)"""
+        return self.redis.lock(self._key("dispatch-lock"), timeout=60)
+
+    def queue_position(self, document_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Where a document stands: its place in line and estimated start, or when it started
+
+        The place counts the documents that will start before it under the current weights:
+        the queued interactive documents if it is in the bulk lane, those of its organization
+        ahead of it, and those of other organizations that next_entry reaches first: a lower
+        virtual time when their turn comes, or an equal one and a lower organization id.
+        The estimate assumes pipelines keep taking the average measured duration. Returns
+        None for documents the scheduler does not know (never queued, or finished).
+        """
+        raw_entry = self.redis.get(self._key("entry", document_id))
+        if raw_entry is None:
+            in_flight = self.redis.hget(self._key("in-flight"), document_id)
+            if in_flight is None:
+                return None
+            in_flight = json.loads(in_flight)
+            return {
+                "document_id": document_id,
+                "state": "dispatched",
+                "lane": in_flight["lane"],
+                "position": 0,
+                "started_at": datetime.utcfromtimestamp(in_flight["dispatched_at"]).isoformat()
+            }
+
+        entry = json.loads(raw_entry)
+        lane, org_id = entry["lane"], entry["org_id"]
+        org_ahead = self.redis.lpos(self._key("queue", lane, org_id), document_id)
+        if org_ahead is None:
+            return None
+
+        weights = self.weights()
+        orgs = [(self._text(other_id), score) for other_id, score in self.redis.zrange(self._key("orgs", lane), 0, -1, withscores=True)]
+        org_scores = dict(orgs)
+        # The organization's virtual time when this document's turn comes
+        start_tag = org_scores.get(org_id, 0.0) + org_ahead / weights.get(org_id, settings.SCHEDULER_DEFAULT_WEIGHT)
+
+        pipe = self.redis.pipeline()
+        for other_id, _ in orgs:
+            pipe.llen(self._key("queue", lane, other_id))
+        queued = pipe.execute()
+
+        ahead = org_ahead
+        for (other_id, score), length in zip(orgs, queued):
+            if other_id != org_id:
+                other_weight = weights.get(other_id, settings.SCHEDULER_DEFAULT_WEIGHT)
+                # Its k-th document comes at score + k / weight; ties go in sorted set order.
+                # TAG_EPSILON absorbs the rounding of scores built up one 1 / weight at a time
+                turns = (start_tag - score) * other_weight
+                before = math.floor(turns + TAG_EPSILON) + 1 if other_id < org_id else math.ceil(turns - TAG_EPSILON)
+                ahead += min(length, max(0, before))
+
+        if lane == BULK_LANE:
+            interactive = self.redis.zrange(self._key("orgs", INTERACTIVE_LANE), 0, -1)
+            pipe = self.redis.pipeline()
+            for other_id in interactive:
+                pipe.llen(self._key("queue", INTERACTIVE_LANE, self._text(other_id)))
+            ahead += sum(pipe.execute())
+
+        # Start estimate: when enough slots free up overall, and for the organization
+        duration = float(self.redis.get(self._key("duration")) or self.default_duration_seconds)
+        free_slots = max(0, self.max_in_flight - self.redis.hlen(self._key("in-flight")))
+        org_in_flight = int(self.redis.hget(self._key("in-flight-orgs"), org_id) or 0)
+        org_free_slots = max(0, self.org_max_in_flight - org_in_flight)
+        wait_seconds = duration * max(
+            math.ceil(max(0, ahead + 1 - free_slots) / self.max_in_flight),
+            math.ceil(max(0, org_ahead + 1 - org_free_slots) / self.org_max_in_flight)
+        )
+
+        return {
+            "document_id": document_id,
+            "state": "queued",
+            "lane": lane,
+            "position": ahead + 1,
+            "queued_ahead": ahead,
+            "org_queued_ahead": org_ahead,
+            "queued_at": datetime.utcfromtimestamp(entry["enqueued_at"]).isoformat(),
+            "estimated_wait_seconds": wait_seconds,
+            "estimated_start_at": (datetime.utcnow() + timedelta(seconds=wait_seconds)).isoformat()
+        }
+
+
+async def organization_weight(org_id: uuid.UUID) -> float:
+    """Scheduling weight of an organization: its plan's, reduced once past the month's document limit"""
+    try:
+        active_plan = await database_service.get_active_organization_plan(org_id)
+        if not active_plan:
+            return settings.SCHEDULER_DEFAULT_WEIGHT
+
+        plan, plan_type = active_plan
+        weight = settings.SCHEDULER_PLAN_WEIGHTS.get(plan_type.key, settings.SCHEDULER_DEFAULT_WEIGHT)
+
+        # -1 means unlimited
+        document_limit = plan.custom_document_limit if plan.custom_document_limit is not None else plan_type.document_limit
+        if document_limit >= 0:
+            usage = await database_service.get_organization_usage(org_id, date.today().replace(day=1))
+            if usage and usage.documents_processed >= document_limit:
+                weight *= settings.SCHEDULER_OVER_LIMIT_WEIGHT_FACTOR
+        return weight
+    except Exception as e:
+        logger.warning(f"Could not determine scheduling weight for org {org_id}, using the default: {e}")
+        return settings.SCHEDULER_DEFAULT_WEIGHT
+
+
+# Global instance
+document_scheduler = DocumentScheduler(
+    max_in_flight=settings.SCHEDULER_MAX_IN_FLIGHT,
+    org_max_in_flight=settings.SCHEDULER_ORG_MAX_IN_FLIGHT,
+    interactive_org_max_queued=settings.SCHEDULER_INTERACTIVE_ORG_MAX_QUEUED,
+    default_duration_seconds=settings.SCHEDULER_DEFAULT_DURATION_SECONDS
+)
@@ -0,0 +1,227 @@
+"""
+Content-addressed cache for processed OCR results.
+Results are keyed on the SHA-256 of the document bytes plus the Azure model id and
+API version, so a re-uploaded, reprocessed or retried document skips Azure entirely.
+"""
+from abc import ABC, abstractmethod
+from app.config import settings
+from typing import Dict, Any, Optional
+from pathlib import Path
+import hashlib
+import json
+import logging
+import os
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+
+def compute_content_hash(document_content: bytes) -> bytes:
+    """SHA-256 digest of the raw document bytes (stored in documents.hash)"""
+    return hashlib.sha256(document_content).digest()
+
+
+class OCRCacheBackend(ABC):
+    """Storage backend interface for the OCR result cache"""
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[bytes]:
+        """Stored value, or None when missing or expired"""
+
+    @abstractmethod
+    def set(self, key: str, value: bytes, ttl_seconds: int) -> None:
+        """Store a value for ttl_seconds, evicting least recently used entries over the size limit"""
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """Drop a value (no error when missing)"""
+
+
+class LocalDiskCacheBackend(OCRCacheBackend):
+    """Cache entries stored as files; mtime holds the expiry time (TTL) and atime the last read (LRU)"""
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.bin"
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            stat = path.stat()
+            if stat.st_mtime < time.time():
+                path.unlink(missing_ok=True)
+                return None
+
+            value = path.read_bytes()
+            # Record the access for LRU eviction without touching the expiry time
+            os.utime(path, (time.time(), stat.st_mtime))
+            return value
+        except FileNotFoundError:
+            return None
+
+    def set(self, key: str, value: bytes, ttl_seconds: int) -> None:
+        path = self._path(key)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_bytes(value)
+        now = time.time()
+        os.utime(tmp_path, (now, now + ttl_seconds))
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def delete(self, key: str) -> None:
+        self._path(key).unlink(missing_ok=True)
+
+    def _evict(self) -> None:
+        """Drop expired entries, then least recently used ones until under max_bytes"""
+        now = time.time()
+        entries = []
+        total_bytes = 0
+
+        for path in self.cache_dir.glob("*.bin"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+
+            if stat.st_mtime < now:
+                path.unlink(missing_ok=True)
+                continue
+
+            entries.append((stat.st_atime, stat.st_size, path))
+            total_bytes += stat.st_size
+
+        if total_bytes <= self.max_bytes:
+            return
+
+        for _, size, path in sorted(entries, key=lambda entry: entry[0]):
+            path.unlink(missing_ok=True)
+            total_bytes -= size
+            if total_bytes <= self.max_bytes:
+                break
+
+
+class RedisCacheBackend(OCRCacheBackend):
+    """Cache entries stored in Redis with native TTL; a sorted set tracks recency for size-based LRU"""
+
+    KEY_PREFIX = "nmtc:ocr-cache:"
+    LRU_KEY = "nmtc:ocr-cache:lru"
+    SIZES_KEY = "nmtc:ocr-cache:sizes"
+
+    def __init__(self, max_bytes: int):
+        from app.services.redis_service import get_redis_client
+        self.redis = get_redis_client()
+        self.max_bytes = max_bytes
+
+    def get(self, key: str) -> Optional[bytes]:
+        value = self.redis.get(self.KEY_PREFIX + key)
+        if value is None:
+            # Expired by TTL; forget its bookkeeping
+            self.redis.zrem(self.LRU_KEY, key)
+            self.redis.hdel(self.SIZES_KEY, key)
+            return None
+
+        self.redis.zadd(self.LRU_KEY, {key: time.time()})
+        return value
+
+    def set(self, key: str, value: bytes, ttl_seconds: int) -> None:
+        pipe = self.redis.pipeline()
+        pipe.set(self.KEY_PREFIX + key, value, ex=ttl_seconds)
+        pipe.zadd(self.LRU_KEY, {key: time.time()})
+        pipe.hset(self.SIZES_KEY, key, len(value))
+        pipe.execute()
+        self._evict()
+
+    def delete(self, key: str) -> None:
+        pipe = self.redis.pipeline()
+        pipe.delete(self.KEY_PREFIX + key)
+        pipe.zrem(self.LRU_KEY, key)
+        pipe.hdel(self.SIZES_KEY, key)
+        pipe.execute()
+
+    def _evict(self) -> None:
+        """Drop least recently used entries until the tracked size is under max_bytes"""
+        sizes = self.redis.hgetall(self.SIZES_KEY)
+        total_bytes = sum(int(size) for size in sizes.values())
+        if total_bytes <= self.max_bytes:
+            return
+
+        for key in self.redis.zrange(self.LRU_KEY, 0, -1):
+            key = key.decode() if isinstance(key, bytes) else key
+            total_bytes -= int(sizes.get(key.encode(), 0))
+            self.delete(key)
+            if total_bytes <= self.max_bytes:
+                break
+
+
+class OCRResultCache:
+    """Processed OCR results keyed on document content hash, model id and API version"""
+
+    def __init__(self, backend: Optional[OCRCacheBackend], ttl_seconds: int):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    def make_key(self, content_hash: bytes, model_id: str, api_version: str) -> str:
+        """Cache key for a document digest analysed by a given model and API version"""
+        return hashlib.sha256(
+            content_hash + f"|{model_id}|{api_version}".encode()
+        ).hexdigest()
+
+    def get(self, content_hash: bytes, model_id: str, api_version: str) -> Optional[Dict[str, Any]]:
+        """Return the cached processed result, or None on a miss or backend failure"""
+        if not self.enabled:
+            return None
+
+        key = self.make_key(content_hash, model_id, api_version)
+        try:
+            value = self.backend.get(key)
+            if value is None:
+                return None
+            return json.loads(zlib.decompress(value))
+        except Exception as e:
+            logger.warning(f"OCR cache read failed for key {key}: {e}")
+            return None
+
+    def set(self, content_hash: bytes, model_id: str, api_version: str, result: Dict[str, Any]) -> None:
+        """Store a processed result; failures are logged and never fail the analysis"""
+        if not self.enabled or "error" in result:
+            return
+
+        key = self.make_key(content_hash, model_id, api_version)
+        try:
+            value = zlib.compress(json.dumps(result, default=str).encode())
+            self.backend.set(key, value, self.ttl_seconds)
+        except Exception as e:
+            logger.warning(f"OCR cache write failed for key {key}: {e}")
+
+
+def create_ocr_cache() -> OCRResultCache:
+    """Build the OCR result cache from settings"""
+    backend_name = settings.OCR_CACHE_BACKEND.lower()
+    backend: Optional[OCRCacheBackend] = None
+
+    try:
+        if backend_name == "disk":
+            backend = LocalDiskCacheBackend(settings.OCR_CACHE_DIR, settings.OCR_CACHE_MAX_BYTES)
+        elif backend_name == "redis":
+            backend = RedisCacheBackend(settings.OCR_CACHE_MAX_BYTES)
+        elif backend_name != "none":
+            logger.warning(f"Unknown OCR_CACHE_BACKEND '{settings.OCR_CACHE_BACKEND}', caching disabled")
+    except Exception as e:
+        logger.error(f"Failed to initialize OCR cache backend '{backend_name}': {e}")
+        backend = None
+
+    logger.info(f"OCR result cache backend: {type(backend).__name__ if backend else 'disabled'}")
+    return OCRResultCache(backend, settings.OCR_CACHE_TTL_SECONDS)
+
+
+# Global cache instance
+ocr_cache = create_ocr_cache()
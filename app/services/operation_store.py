@@ -0,0 +1,124 @@
+"""
+Persistence of in-flight Azure Document Intelligence operations.
+The poller continuation token and Operation-Location of every submitted analysis are
+kept in Redis until it completes, so a retried or recycled Celery task resumes polling
+the existing operation instead of re-submitting (and re-paying for) the document.
+"""
+from app.config import settings
+from typing import Dict, Any, Optional
+import hashlib
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def operation_id_from_location(operation_location: str) -> str:
+    """Azure's result id is the last path segment of the Operation-Location URL"""
+    return operation_location.split("?", 1)[0].rstrip("/").rsplit("/", 1)[-1]
+
+
+class AzureOperationStore:
+    """Redis-backed records of submitted analyses, keyed by document content and model"""
+
+    KEY_PREFIX = "nmtc:azure-op:"
+    ID_PREFIX = "nmtc:azure-op-id:"
+
+    def __init__(self, ttl_seconds: int, enabled: bool = True):
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+        self._redis = None
+
+    @property
+    def redis(self):
+        if self._redis is None:
+            from app.services.redis_service import get_redis_client
+            self._redis = get_redis_client()
+        return self._redis
+
+    def make_key(self, content_hash: bytes, model_id: str, api_version: str, part: str = "") -> str:
+        """Operation key for a document digest (or one shard of it) analysed by a model and API version"""
+        return hashlib.sha256(
+            content_hash + f"|{model_id}|{api_version}|{part}".encode()
+        ).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the persisted operation for a key, or None; failures are logged and treated as a miss"""
+        if not self.enabled:
+            return None
+
+        try:
+            value = self.redis.get(self.KEY_PREFIX + key)
+            return json.loads(value) if value else None
+        except Exception as e:
+            logger.warning(f"Azure operation lookup failed for key {key}: {e}")
+            return None
+
+    def get_by_operation_id(self, operation_id: str) -> Optional[Dict[str, Any]]:
+        """Return the persisted operation with the given Azure result id"""
+        if not self.enabled:
+            return None
+
+        try:
+            key = self.redis.get(self.ID_PREFIX + operation_id)
+            if not key:
+                return None
+            return self.get(key.decode() if isinstance(key, bytes) else key)
+        except Exception as e:
+            logger.warning(f"Azure operation lookup failed for operation {operation_id}: {e}")
+            return None
+
+    def save(
+        self,
+        key: str,
+        continuation_token: str,
+        operation_location: Optional[str],
+        model_id: str,
+        document_id: Optional[str] = None
+    ) -> None:
+        """Record a submitted operation; failures are logged and never fail the analysis"""
+        if not self.enabled:
+            return
+
+        operation_id = operation_id_from_location(operation_location) if operation_location else None
+        record = {
+            "key": key,
+            "operation_id": operation_id,
+            "operation_location": operation_location,
+            "continuation_token": continuation_token,
+            "model_id": model_id,
+            "document_id": document_id,
+            "submitted_at": time.time()
+        }
+
+        try:
+            pipe = self.redis.pipeline()
+            pipe.set(self.KEY_PREFIX + key, json.dumps(record), ex=self.ttl_seconds)
+            if operation_id:
+                pipe.set(self.ID_PREFIX + operation_id, key, ex=self.ttl_seconds)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"Failed to persist Azure operation {operation_id} for key {key}: {e}")
+
+    def delete(self, key: str) -> None:
+        """Forget a finished or unusable operation"""
+        if not self.enabled:
+            return
+
+        try:
+            record = self.get(key)
+            pipe = self.redis.pipeline()
+            pipe.delete(self.KEY_PREFIX + key)
+            if record and record.get("operation_id"):
+                pipe.delete(self.ID_PREFIX + record["operation_id"])
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"Failed to delete Azure operation record {key}: {e}")
+
+
+# Global operation store (Azure keeps analyze results for 24 hours)
+operation_store = AzureOperationStore(
+    settings.AZURE_OPERATION_TTL_SECONDS,
+    enabled=settings.AZURE_RESUME_OPERATIONS
+)
@@ -0,0 +1,64 @@
+"""
+Short-lived store for the bulky values handed between stages of the document pipeline.
+Celery messages are JSON and should stay small, so a stage puts document bytes or OCR
+results in Redis under a random key, passes the key to the next stage and the consumer
+deletes it. Entries expire on their own if a pipeline is abandoned.
+"""
+from app.config import settings
+from app.utils.exceptions import StorageError
+from typing import Any
+import json
+import logging
+import uuid
+import zlib
+
+logger = logging.getLogger(__name__)
+
+
+class PayloadStore:
+    """Redis-backed payloads, compressed, with a TTL"""
+
+    KEY_PREFIX = "nmtc:payload:"
+
+    def __init__(self, ttl_seconds: int):
+        self.ttl_seconds = ttl_seconds
+
+    @property
+    def redis(self):
+        from app.services.redis_service import get_redis_client
+        return get_redis_client()
+
+    def put_bytes(self, value: bytes) -> str:
+        """Store value and return its key"""
+        key = uuid.uuid4().hex
+        self.redis.set(self.KEY_PREFIX + key, zlib.compress(value, 1), ex=self.ttl_seconds)
+        return key
+
+    def get_bytes(self, key: str) -> bytes:
+        value = self.redis.get(self.KEY_PREFIX + key)
+        if value is None:
+            raise StorageError(f"Pipeline payload {key} is missing or expired")
+        return zlib.decompress(value)
+
+    def put_json(self, value: Any) -> str:
+        return self.put_bytes(json.dumps(value, default=str).encode("utf-8"))
+
+    def get_json(self, key: str) -> Any:
+        return json.loads(self.get_bytes(key))
+
+    def exists(self, *keys: str) -> bool:
+        """Whether every one of the payloads is still stored"""
+        return self.redis.exists(*(self.KEY_PREFIX + key for key in keys)) == len(keys) if keys else True
+
+    def delete(self, *keys: str) -> None:
+        """Drop payloads that are no longer needed; failures are left to the TTL"""
+        if not keys:
+            return
+        try:
+            self.redis.delete(*(self.KEY_PREFIX + key for key in keys))
+        except Exception as e:
+            logger.warning(f"Failed to delete pipeline payloads {', '.join(keys)}: {e}")
+
+
+# Global instance
+payload_store = PayloadStore(settings.PIPELINE_PAYLOAD_TTL_SECONDS)
@@ -0,0 +1,119 @@
+"""
+Idempotent submission and execution of the document pipeline.
+A submission claims its document and content hash in Redis (SET NX), so a double click or
+client retry attaches to the task already in flight instead of queueing a second Azure
+job. Each stage records its output per document, content hash and stage, so a re-run
+(a resubmission, or a redelivered message) skips stages that already completed unless
+forced. Redis failures are logged and treated as "no record": work is never blocked on them.
+"""
+from app.config import settings
+from typing import Dict, Any, Optional, Union
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Compare-and-set / compare-and-delete on a claim, so only its holder can move or drop it
+_TAKE_OVER = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('set', KEYS[1], ARGV[2], 'EX', ARGV[3]) end return false"
+_RELEASE = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+_EXTEND = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('expire', KEYS[1], ARGV[2]) end return 0"
+
+
+def content_hash_hex(content_hash: Union[bytes, str, None]) -> Optional[str]:
+    """Hex form of a documents.hash value (raw digest, hex, or PostgREST's \\x-prefixed hex)"""
+    if not content_hash:
+        return None
+    if isinstance(content_hash, bytes):
+        return content_hash.hex()
+    return content_hash[2:] if content_hash.startswith("\\x") else content_hash
+
+
+class PipelineIdempotency:
+    """Redis-backed submission claims and completed-stage records"""
+
+    KEY_PREFIX = "nmtc:pipeline:"
+
+    def __init__(self, claim_ttl_seconds: int, completed_ttl_seconds: int):
+        self.claim_ttl_seconds = claim_ttl_seconds
+        self.completed_ttl_seconds = completed_ttl_seconds
+        self._redis = None
+
+    @property
+    def redis(self):
+        if self._redis is None:
+            from app.services.redis_service import get_redis_client
+            self._redis = get_redis_client()
+        return self._redis
+
+    def submission_key(self, document_id: str, content_hash: Optional[str]) -> str:
+        return f"{self.KEY_PREFIX}{document_id}:{content_hash or '-'}:submission"
+
+    def stage_key(self, document_id: str, content_hash: Optional[str], stage: str) -> str:
+        return f"{self.KEY_PREFIX}{document_id}:{content_hash or '-'}:stage:{stage}"
+
+    def claim(self, key: str, task_id: str) -> Optional[str]:
+        """Claim a submission for task_id; returns the task id already holding it, else None"""
+        try:
+            if self.redis.set(key, task_id, nx=True, ex=self.claim_ttl_seconds):
+                return None
+            holder = self.redis.get(key)
+            return holder.decode() if isinstance(holder, bytes) else holder
+        except Exception as e:
+            logger.warning(f"Pipeline submission claim failed for {key}, submitting anyway: {e}")
+            return None
+
+    def take_over(self, key: str, stale_task_id: str, task_id: str) -> bool:
+        """Move a claim from a finished task to a new one; False when someone else got there first"""
+        try:
+            return bool(self.redis.eval(_TAKE_OVER, 1, key, stale_task_id, task_id, self.claim_ttl_seconds))
+        except Exception as e:
+            logger.warning(f"Pipeline submission take-over failed for {key}, submitting anyway: {e}")
+            return True
+
+    def extend(self, key: str, task_id: str, ttl_seconds: Optional[int] = None) -> None:
+        """Reset the expiry of a claim held by task_id (claim_ttl_seconds by default)"""
+        try:
+            self.redis.eval(_EXTEND, 1, key, task_id, ttl_seconds or self.claim_ttl_seconds)
+        except Exception as e:
+            logger.warning(f"Failed to extend pipeline submission {key}: {e}")
+
+    def release(self, key: str, task_id: str) -> None:
+        """Drop a claim held by task_id (once its pipeline has finished, either way)"""
+        try:
+            self.redis.eval(_RELEASE, 1, key, task_id)
+        except Exception as e:
+            logger.warning(f"Failed to release pipeline submission {key}; it expires on its own: {e}")
+
+    def completed_stage(self, document_id: str, content_hash: Optional[str], stage: str) -> Optional[Dict[str, Any]]:
+        """Recorded output of a stage that completed for this document content, or None"""
+        try:
+            value = self.redis.get(self.stage_key(document_id, content_hash, stage))
+            return json.loads(value) if value else None
+        except Exception as e:
+            logger.warning(f"Completed stage lookup failed for document {document_id} stage {stage}: {e}")
+            return None
+
+    def complete_stage(
+        self,
+        document_id: str,
+        content_hash: Optional[str],
+        stage: str,
+        output: Dict[str, Any],
+        ttl_seconds: Optional[int] = None
+    ) -> None:
+        """Record a stage's output; outputs referring to pipeline payloads should expire with them"""
+        try:
+            self.redis.set(
+                self.stage_key(document_id, content_hash, stage),
+                json.dumps(output, default=str),
+                ex=ttl_seconds or self.completed_ttl_seconds
+            )
+        except Exception as e:
+            logger.warning(f"Failed to record completed stage {stage} for document {document_id}: {e}")
+
+
+# Global instance
+pipeline_idempotency = PipelineIdempotency(
+    claim_ttl_seconds=settings.PIPELINE_PAYLOAD_TTL_SECONDS,
+    completed_ttl_seconds=settings.PIPELINE_COMPLETED_TTL_SECONDS
+)
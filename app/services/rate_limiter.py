@@ -0,0 +1,290 @@
+"""
+Client-side rate limiting for Azure Document Intelligence, shared across worker processes.
+Each model id has a Redis token bucket for submissions and a lease-based in-flight
+semaphore for running operations. Callers queue for up to a bounded wait instead of
+provoking 429s that turn into full Celery task retries.
+"""
+from app.config import settings
+from app.utils.exceptions import RateLimitExceededError
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, asdict
+from typing import Dict, Any, Optional, AsyncIterator
+import asyncio
+import logging
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Refill the bucket from server time, then take the requested tokens if available.
+# Returns {allowed, tokens left, seconds until enough tokens}; floats are returned as strings.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+local wait = 0
+if tokens >= requested then
+  tokens = tokens - requested
+  allowed = 1
+else
+  wait = (requested - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 60)
+return {allowed, tostring(tokens), tostring(wait)}
+"""
+
+# Take an in-flight slot if fewer than the limit are held; leases of crashed workers expire.
+SEMAPHORE_ACQUIRE_SCRIPT = """
+local limit = tonumber(ARGV[1])
+local lease = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZCARD', KEYS[1]) < limit then
+  redis.call('ZADD', KEYS[1], now + lease, ARGV[2])
+  redis.call('EXPIRE', KEYS[1], math.ceil(lease) + 60)
+  return 1
+end
+return 0
+"""
+
+# Shortest and longest pause between acquisition attempts while queued
+MIN_RETRY_SECONDS = 0.05
+MAX_RETRY_SECONDS = 1.0
+
+
+@dataclass
+class ModelLimits:
+    """Limits applied to one Document Intelligence model id"""
+    rate_per_second: float
+    burst: int
+    max_in_flight: int
+
+
+class AzureRateLimiter:
+    """Redis-backed token bucket and in-flight governor, configurable per model id"""
+
+    KEY_PREFIX = "nmtc:azure-limiter:"
+
+    def __init__(
+        self,
+        default_limits: ModelLimits,
+        overrides: Optional[Dict[str, Dict[str, float]]] = None,
+        max_wait_seconds: float = 30.0,
+        enabled: bool = True
+    ):
+        self.default_limits = default_limits
+        self.overrides = overrides or {}
+        self.max_wait_seconds = max_wait_seconds
+        self.enabled = enabled
+        self._redis = None
+        self._scripts: Dict[str, Any] = {}
+        self._models_seen = set(self.overrides)
+
+    @property
+    def redis(self):
+        if self._redis is None:
+            from app.services.redis_service import get_redis_client
+            self._redis = get_redis_client()
+        return self._redis
+
+    def _script(self, source: str):
+        """Registered Lua script (loaded by SHA and re-sent by redis-py if the server lost it)"""
+        if source not in self._scripts:
+            self._scripts[source] = self.redis.register_script(source)
+        return self._scripts[source]
+
+    def limits_for(self, model_id: str) -> ModelLimits:
+        """Default limits with any per-model overrides applied"""
+        override = self.overrides.get(model_id, {})
+        limits = asdict(self.default_limits)
+        limits.update({key: value for key, value in override.items() if key in limits})
+        return ModelLimits(
+            rate_per_second=float(limits["rate_per_second"]),
+            burst=int(limits["burst"]),
+            max_in_flight=int(limits["max_in_flight"])
+        )
+
+    def _key(self, model_id: str, suffix: str) -> str:
+        return f"{self.KEY_PREFIX}{model_id}:{suffix}"
+
+    def _try_acquire_slot(self, model_id: str, holder: str, limits: ModelLimits) -> bool:
+        # Slots outlive the longest analysis so a crashed worker's lease frees itself
+        lease_seconds = settings.PROCESSING_TIMEOUT_SECONDS + 60
+        return bool(self._script(SEMAPHORE_ACQUIRE_SCRIPT)(
+            keys=[self._key(model_id, "in-flight")],
+            args=[limits.max_in_flight, holder, lease_seconds]
+        ))
+
+    def _try_take_token(self, model_id: str, limits: ModelLimits) -> float:
+        """Take one submission token; returns 0 on success or the seconds until one is available"""
+        allowed, _, wait = self._script(TOKEN_BUCKET_SCRIPT)(
+            keys=[self._key(model_id, "bucket")],
+            args=[limits.rate_per_second, limits.burst, 1]
+        )
+        return 0.0 if int(allowed) else float(wait)
+
+    def _release_slot(self, model_id: str, holder: str) -> None:
+        self.redis.zrem(self._key(model_id, "in-flight"), holder)
+
+    def _set_waiting(self, model_id: str, holder: str, waiting: bool) -> None:
+        key = self._key(model_id, "waiting")
+        if waiting:
+            self.redis.zadd(key, {holder: time.time() + self.max_wait_seconds})
+            self.redis.expire(key, int(self.max_wait_seconds) + 60)
+        else:
+            self.redis.zrem(key, holder)
+
+    def _record_wait(self, model_id: str, wait_seconds: float, acquired: bool) -> None:
+        key = self._key(model_id, "stats")
+        pipe = self.redis.pipeline()
+        pipe.hincrby(key, "acquired" if acquired else "rejected", 1)
+        pipe.hincrbyfloat(key, "wait_ms_total", wait_seconds * 1000)
+        pipe.hset(key, "last_wait_ms", wait_seconds * 1000)
+        pipe.execute()
+
+    async def _acquire(self, model_id: str, holder: str, limits: ModelLimits, needs_token: bool) -> bool:
+        """Queue for an in-flight slot (and a token) until acquired or max_wait_seconds has passed"""
+        deadline = time.monotonic() + self.max_wait_seconds
+        has_slot = False
+        queued = False
+
+        try:
+            while True:
+                if not has_slot:
+                    has_slot = await asyncio.to_thread(self._try_acquire_slot, model_id, holder, limits)
+
+                retry_in = MAX_RETRY_SECONDS
+                if has_slot:
+                    if not needs_token:
+                        return True
+                    retry_in = await asyncio.to_thread(self._try_take_token, model_id, limits)
+                    if retry_in == 0:
+                        return True
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    if has_slot:
+                        await asyncio.to_thread(self._release_slot, model_id, holder)
+                    return False
+
+                if not queued:
+                    await asyncio.to_thread(self._set_waiting, model_id, holder, True)
+                    queued = True
+                await asyncio.sleep(min(max(retry_in, MIN_RETRY_SECONDS), MAX_RETRY_SECONDS, remaining))
+        except BaseException:
+            if has_slot:
+                await asyncio.to_thread(self._release_slot, model_id, holder)
+            raise
+        finally:
+            if queued:
+                await asyncio.to_thread(self._set_waiting, model_id, holder, False)
+
+    @asynccontextmanager
+    async def slot(self, model_id: str, needs_token: bool = True) -> AsyncIterator[float]:
+        """
+        Hold an in-flight slot for model_id for the duration of the block
+
+        needs_token also takes a submission token (resumed operations only poll, so they don't).
+        Yields the seconds spent queued. Raises RateLimitExceededError when nothing frees up
+        within max_wait_seconds. Redis failures let the call through rather than blocking work.
+        """
+        if not self.enabled:
+            yield 0.0
+            return
+
+        self._models_seen.add(model_id)
+        limits = self.limits_for(model_id)
+        holder = uuid.uuid4().hex
+        started = time.monotonic()
+
+        try:
+            acquired = await self._acquire(model_id, holder, limits, needs_token)
+        except Exception as e:
+            logger.warning(f"Azure rate limiter unavailable for {model_id}, proceeding without it: {e}")
+            acquired = None
+
+        if acquired is None:
+            yield 0.0
+            return
+
+        wait_seconds = time.monotonic() - started
+        try:
+            await asyncio.to_thread(self._record_wait, model_id, wait_seconds, acquired)
+        except Exception as e:
+            logger.warning(f"Failed to record Azure rate limiter stats for {model_id}: {e}")
+
+        if not acquired:
+            logger.warning(f"Azure rate limiter queue timed out for {model_id} after {wait_seconds:.1f}s")
+            raise RateLimitExceededError(
+                int(limits.rate_per_second), "second", retry_after=int(self.max_wait_seconds)
+            )
+
+        if wait_seconds >= 1:
+            logger.info(f"Waited {wait_seconds:.1f}s for Azure rate limiter slot ({model_id})")
+
+        try:
+            yield wait_seconds
+        finally:
+            try:
+                await asyncio.to_thread(self._release_slot, model_id, holder)
+            except Exception as e:
+                logger.warning(f"Failed to release Azure in-flight slot for {model_id}: {e}")
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Current tokens, in-flight operations, queue depth and wait times per model id"""
+        if not self.enabled:
+            return {"enabled": False}
+
+        metrics: Dict[str, Any] = {"enabled": True, "max_wait_seconds": self.max_wait_seconds, "models": {}}
+        try:
+            now = time.time()
+            for model_id in sorted(self._models_seen | {"prebuilt-read", "prebuilt-layout"}):
+                limits = self.limits_for(model_id)
+                bucket = self.redis.hgetall(self._key(model_id, "bucket"))
+                stats = self.redis.hgetall(self._key(model_id, "stats"))
+
+                # Project the stored token count forward to now, as the bucket script would
+                tokens = float(limits.burst)
+                if bucket:
+                    elapsed = max(0.0, now - float(bucket[b"ts"]))
+                    tokens = min(float(limits.burst), float(bucket[b"tokens"]) + elapsed * limits.rate_per_second)
+
+                acquired = int(stats.get(b"acquired", 0))
+                wait_ms_total = float(stats.get(b"wait_ms_total", 0))
+                metrics["models"][model_id] = {
+                    **asdict(limits),
+                    "tokens": tokens,
+                    "in_flight": self.redis.zcount(self._key(model_id, "in-flight"), now, "+inf"),
+                    "queue_depth": self.redis.zcount(self._key(model_id, "waiting"), now, "+inf"),
+                    "acquired": acquired,
+                    "rejected": int(stats.get(b"rejected", 0)),
+                    "average_wait_ms": wait_ms_total / acquired if acquired else 0.0,
+                    "last_wait_ms": float(stats.get(b"last_wait_ms", 0))
+                }
+        except Exception as e:
+            logger.warning(f"Failed to read Azure rate limiter metrics: {e}")
+            metrics["error"] = str(e)
+
+        return metrics
+
+
+# Global limiter instance
+azure_rate_limiter = AzureRateLimiter(
+    ModelLimits(
+        rate_per_second=settings.AZURE_RATE_LIMIT_PER_SECOND,
+        burst=settings.AZURE_RATE_LIMIT_BURST,
+        max_in_flight=settings.AZURE_MAX_IN_FLIGHT
+    ),
+    overrides=settings.AZURE_RATE_LIMIT_OVERRIDES,
+    max_wait_seconds=settings.AZURE_RATE_LIMIT_MAX_WAIT_SECONDS,
+    enabled=settings.AZURE_RATE_LIMIT_ENABLED
+)
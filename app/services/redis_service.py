@@ -0,0 +1,25 @@
+from app.config import settings
+from typing import Optional
+import logging
+import redis
+
+logger = logging.getLogger(__name__)
+
+
+_redis_client: Optional[redis.Redis] = None
+
+
+def get_redis_client() -> redis.Redis:
+    """Get the shared Redis client (connection pool is created lazily and is fork-safe)"""
+    global _redis_client
+
+    if _redis_client is None:
+        _redis_client = redis.Redis.from_url(
+            settings.REDIS_URL,
+            password=settings.REDIS_PASSWORD or None,
+            socket_timeout=5,
+            socket_connect_timeout=5
+        )
+        logger.info("Redis client initialized")
+
+    return _redis_client
@@ -27,6 +27,10 @@ class SupabaseService:
                 'ocr_status': 'processing'
             }
             
+            # documents.hash is bytea; PostgREST expects "\\x"-prefixed hex
+            if metadata.get('content_hash'):
+                insert_data['hash'] = '\\x' + metadata['content_hash']
+            
             # Skip document_type_id for now - it requires UUID mapping
             # if metadata.get('document_type'):
             #     insert_data['document_type_id'] = metadata.get('document_type')
@@ -1,9 +1,20 @@
-from celery import Celery
+from celery import Celery, chain
+from celery.signals import worker_process_shutdown, worker_shutdown
+from celery.states import READY_STATES
 from app.config import settings
 from app.services.azure_service import azure_service
 from app.services.database_service import database_service
-from app.services.detection_service import detection_service
+from app.services.detection_service import detection_service, detection_pool, StreamingDetector
+from app.services.detection_rules import detection_rule_service
+from app.services.document_scheduler import document_scheduler, INTERACTIVE_LANE, ENTRY_TTL_SECONDS
+from app.services.ocr_cache_service import compute_content_hash
+from app.services.payload_store import payload_store
+from app.services.pipeline_idempotency import pipeline_idempotency, content_hash_hex
 from app.models.database import OcrStatus, DocumentUpdate
+from app.utils.circuit_breaker import CircuitOpenError
+from app.utils.worker_loop import worker_loop
+from app.tasks.queues import TASK_ROUTES
+from app.tasks.retry_policies import STAGE_POLICIES, is_permanent_failure
 from app.utils.exceptions import (
     DocumentProcessingError, 
     OCRProcessingError, 
@@ -12,9 +23,10 @@ from app.utils.exceptions import (
 )
 import uuid
 import logging
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List, Union
 from datetime import datetime
 import asyncio
+import time
 
 logger = logging.getLogger(__name__)
 # Removed structured logger to avoid circular import
@@ -38,29 +50,408 @@ celery_app.conf.update(
     task_soft_time_limit=25 * 60,  # 25 minutes
     worker_prefetch_multiplier=1,
     worker_max_tasks_per_child=50,
+    task_routes=TASK_ROUTES,
 )
 
 
 def run_async(coro):
-    """Helper to run async functions in Celery tasks"""
+    """
+    Run a coroutine on this worker process's event loop
+    
+    The loop lives as long as the process (see app.utils.worker_loop), so each task hands
+    over its whole pipeline as one coroutine rather than one call per database step.
+    """
+    return worker_loop.run(coro)
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def close_worker_loop(**kwargs):
+    worker_loop.close()
+
+
+def defer_on_open_circuit(task, exc: Exception, document_uuid: Optional[uuid.UUID] = None) -> None:
+    """
+    Re-queue a task whose dependency has an open circuit breaker
+    
+    The task is retried once the breaker is due to let probe calls through, instead of
+    burning its normal retries (and multi-minute backoff) against a service known to be down.
+    Deferrals are capped by CIRCUIT_BREAKER_MAX_DEFERRALS on top of the task's own retries.
+    """
+    if not isinstance(exc, CircuitOpenError):
+        return
+    
+    max_retries = (task.max_retries or 0) + settings.CIRCUIT_BREAKER_MAX_DEFERRALS
+    if task.request.retries >= max_retries:
+        return
+    
+    logger.warning(f"Deferring task {task.request.id} for {exc.retry_after}s: {exc.detail}")
+    if document_uuid:
+        try:
+            # Back to queued so the document does not look stuck in processing meanwhile
+            run_async(database_service.update_document(
+                document_uuid,
+                DocumentUpdate(ocr_status=OcrStatus.QUEUED)
+            ))
+        except Exception as status_error:
+            logger.warning(f"Failed to requeue document {document_uuid} while deferring: {status_error}")
+    
+    raise task.retry(countdown=exc.retry_after, exc=exc, max_retries=max_retries)
+
+
+def serialize_detection_result(detection_result) -> Dict[str, Any]:
+    """The detection_results entry stored in a document's parsed_index"""
+    def indicators(matches):
+        return [
+            {
+                "pattern_type": indicator.pattern_type,
+                "match_text": indicator.match_text,
+                "confidence": indicator.confidence,
+                "location": indicator.location,
+                "context": indicator.context
+            }
+            for indicator in matches
+        ]
+    
+    return {
+        "document_type_detected": detection_result.document_type.value,
+        "confidence": detection_result.confidence,
+        "primary_indicators": indicators(detection_result.primary_indicators),
+        "secondary_indicators": indicators(detection_result.secondary_indicators),
+        "metadata": detection_result.metadata,
+        "reasoning": detection_result.reasoning,
+        "processed_at": datetime.utcnow().isoformat()
+    }
+
+
+def download_document(document) -> bytes:
+    """Content of a document from Supabase Storage (blocking; run it in a thread)"""
+    document_id = str(document.id)
+    logger.info("Downloading document from storage",
+                         document_id=document_id,
+                         storage_path=document.storage_path)
+    
     try:
-        loop = asyncio.get_event_loop()
-    except RuntimeError:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        # Use the storage client to download the file
+        result = database_service.client.storage.from_('documents').download(document.storage_path)
+        if not result:
+            raise StorageError(f"Failed to download file: {document.storage_path}")
+        
+        logger.info("Successfully downloaded document from storage",
+                             document_id=document_id,
+                             file_size=len(result))
+        return result
     
-    return loop.run_until_complete(coro)
+    except Exception as download_error:
+        # Fallback: try getting public URL and downloading via HTTP
+        logger.warning("Direct download failed, trying public URL method",
+                                document_id=document_id,
+                                error=str(download_error))
+        
+        file_url = database_service.get_file_url(document.storage_path)
+        if not file_url:
+            raise StorageError(f"Could not get URL for file: {document.storage_path}")
+        
+        import requests
+        
+        response = requests.get(file_url, timeout=30)
+        response.raise_for_status()
+        
+        logger.info("Downloaded document via public URL",
+                             document_id=document_id,
+                             file_size=len(response.content))
+        return response.content
 
 
-@celery_app.task(bind=True, max_retries=3, default_retry_delay=300)
-def process_document_quick_detection(self, document_id: str, user_id: str = None):
+async def record_task_failure(
+    document_uuid: uuid.UUID,
+    user_uuid: Optional[uuid.UUID],
+    action: str,
+    diff: Dict[str, Any]
+) -> None:
+    """Mark a document failed for good and audit it; errors are logged, not raised"""
+    try:
+        document = await database_service.update_document(
+            document_uuid,
+            DocumentUpdate(ocr_status=OcrStatus.ERROR)
+        )
+        
+        await database_service.create_audit_log(
+            scope="document_processing",
+            action=action,
+            org_id=document.org_id if document else None,
+            actor_user_id=user_uuid,
+            record_id=document_uuid,
+            diff=diff
+        )
+    except Exception as cleanup_error:
+        logger.error("Failed to clean up after task failure",
+                              document_id=str(document_uuid),
+                              error=str(cleanup_error))
+
+
+# Context entries naming pipeline payloads, and those describing the run rather than a stage's output
+PAYLOAD_KEYS = ("content_key", "analysis_key")
+RUN_KEYS = ("force", "submission_key", "submission_task_id")
+
+
+def submit_quick_detection(
+    document_id: str,
+    user_id: Optional[str] = None,
+    content_hash: Union[bytes, str, None] = None,
+    force: bool = False,
+    org_id: Optional[str] = None,
+    lane: str = INTERACTIVE_LANE
+) -> Dict[str, Any]:
     """
-    Celery task for quick document detection and OCR processing
+    Queue quick detection for a document unless it is already queued, running or done
+    
+    Submissions are keyed on the document id and content hash. One made while another is
+    in flight returns the in-flight task id; one for content already processed returns
+    the completed task id without queueing anything, unless force is set. An in-flight
+    task is never duplicated, forced or not.
+    
+    With the organization known, the document waits its turn in the fair scheduler
+    (app.services.document_scheduler) rather than going straight onto the Celery queues.
     
     Args:
         document_id: UUID string of the document to process
         user_id: UUID string of the user who initiated the processing
+        content_hash: The document's stored content hash, when known
+        force: Re-run every stage even if it already completed for this content
+        org_id: UUID string of the document's organization
+        lane: Scheduler priority lane, interactive or bulk
+    
+    Returns:
+        Dict with task_id, status (queued, in_progress or completed) and deduplicated
+    """
+    hash_hex = content_hash_hex(content_hash)
+    
+    if not force:
+        completed = pipeline_idempotency.completed_stage(document_id, hash_hex, "persist")
+        if completed:
+            logger.info(f"Quick detection of document {document_id} already completed by task "
+                        f"{completed.get('task_id')}; not resubmitting")
+            return {"task_id": completed.get("task_id"), "status": "completed", "deduplicated": True}
+    
+    submission_key = pipeline_idempotency.submission_key(document_id, hash_hex)
+    task_id = str(uuid.uuid4())
+    holder = pipeline_idempotency.claim(submission_key, task_id)
+    
+    if holder and celery_app.AsyncResult(holder).state in READY_STATES:
+        # The claim outlived its pipeline (a lost worker); take it over unless another
+        # submission just did
+        holder = None if pipeline_idempotency.take_over(submission_key, holder, task_id) else \
+            pipeline_idempotency.claim(submission_key, task_id)
+    
+    if holder:
+        logger.info(f"Quick detection of document {document_id} already in flight as task {holder}")
+        return {"task_id": holder, "status": "in_progress", "deduplicated": True}
+    
+    submission = {"task_id": task_id, "user_id": user_id, "force": force, "submission_key": submission_key}
+    if settings.SCHEDULER_ENABLED and org_id:
+        try:
+            document_scheduler.enqueue(document_id, str(org_id), lane, submission)
+        except Exception as e:
+            logger.warning(f"Could not schedule document {document_id}, submitting it directly: {e}")
+        else:
+            # The claim has to last as long as the document may wait in the scheduler
+            pipeline_idempotency.extend(submission_key, task_id, ENTRY_TTL_SECONDS)
+            request_dispatch()
+            return {"task_id": task_id, "status": "queued", "deduplicated": False}
+    
+    try:
+        start_quick_detection(document_id, submission)
+    except Exception:
+        pipeline_idempotency.release(submission_key, task_id)
+        raise
+    
+    return {"task_id": task_id, "status": "queued", "deduplicated": False}
+
+
+def start_quick_detection(document_id: str, submission: Dict[str, Any]) -> None:
+    """Put a submission on the Celery queues"""
+    process_document_quick_detection.apply_async(
+        args=[document_id, submission["user_id"]],
+        kwargs={"force": submission["force"], "submission_key": submission["submission_key"]},
+        task_id=submission["task_id"]
+    )
+
+
+def request_dispatch() -> None:
+    """Have the dispatcher start whatever scheduled documents can start now"""
+    try:
+        if document_scheduler.request_dispatch():
+            dispatch_quick_detection.delay()
+    except Exception as e:
+        # The periodic dispatch picks the documents up
+        logger.warning(f"Failed to request a scheduler dispatch: {e}")
+
+
+@celery_app.task
+def dispatch_quick_detection():
+    """
+    Start scheduled quick detection runs while pipeline capacity allows
+    
+    Runs on request (a submission, or a pipeline finishing) and periodically, to reclaim
+    slots of lost pipelines. Runs are serialized by a Redis lock.
+    """
+    document_scheduler.clear_dispatch_request()
+    
+    lock = document_scheduler.dispatch_lock()
+    if not lock.acquire(blocking_timeout=10):
+        logger.info("Scheduler dispatch already running")
+        return {"dispatched": 0}
+    
+    dispatched = 0
+    try:
+        document_scheduler.reap_stale()
+        run_async(document_scheduler.refresh_weights(document_scheduler.queued_orgs()))
         
+        while True:
+            entry = document_scheduler.next_entry()
+            if entry is None:
+                break
+            
+            try:
+                # Back to the running pipeline's claim expiry now that the wait is over
+                pipeline_idempotency.extend(entry["submission_key"], entry["task_id"])
+                start_quick_detection(entry["document_id"], entry)
+            except Exception as e:
+                logger.error(f"Failed to start scheduled document {entry['document_id']}, requeued: {e}")
+                document_scheduler.requeue(entry)
+                break
+            dispatched += 1
+    finally:
+        lock.release()
+    
+    if dispatched:
+        logger.info(f"Scheduler dispatched {dispatched} documents")
+    return {"dispatched": dispatched}
+
+
+def recorded_stage_output(document_id: str, content_hash: Optional[str], stage: str) -> Optional[Dict[str, Any]]:
+    """Output of a stage already completed for this content, if the payloads it names are still stored"""
+    recorded = pipeline_idempotency.completed_stage(document_id, content_hash, stage)
+    if recorded is None:
+        return None
+    try:
+        if payload_store.exists(*(recorded[key] for key in PAYLOAD_KEYS if key in recorded)):
+            return recorded
+    except Exception as e:
+        logger.warning(f"Could not check payloads of completed stage {stage} for document {document_id}: {e}")
+    return None
+
+
+async def run_stage(stage: str, context: Dict[str, Any], stage_function, *args, final: bool = False) -> Dict[str, Any]:
+    """
+    Run a quick detection stage, or skip it when it already completed for this content
+    
+    A completed stage's output is recorded per document, content hash and stage; a re-run
+    (a resubmission, or a redelivered message) returns it instead of repeating the work
+    unless the run is forced. The final stage's output is the task result.
+    """
+    run = {key: context[key] for key in RUN_KEYS if key in context}
+    
+    if not context.get("force"):
+        recorded = await asyncio.to_thread(recorded_stage_output, context["document_id"], context["content_hash"], stage)
+        if recorded is not None:
+            logger.info(f"Skipping stage {stage} for document {context['document_id']}; already completed")
+            # Payloads made upstream in this run that the recorded output doesn't use
+            unused = [context[key] for key in PAYLOAD_KEYS if key in context and context[key] != recorded.get(key)]
+            await asyncio.to_thread(payload_store.delete, *unused)
+            return recorded if final else {**recorded, **run}
+    
+    output = await stage_function(context, *args)
+    await asyncio.to_thread(
+        pipeline_idempotency.complete_stage,
+        context["document_id"],
+        context["content_hash"],
+        stage,
+        output if final else {key: value for key, value in output.items() if key not in RUN_KEYS},
+        # Intermediate outputs name payloads, so they are only good as long as those
+        None if final else settings.PIPELINE_PAYLOAD_TTL_SECONDS
+    )
+    return output
+
+
+def release_submission(context: Dict[str, Any]) -> None:
+    """Let the document be submitted again, and the next scheduled one start, once its pipeline has finished"""
+    if not context.get("submission_key"):
+        return
+    
+    pipeline_idempotency.release(context["submission_key"], context["submission_task_id"])
+    try:
+        if document_scheduler.finish(context["document_id"]):
+            request_dispatch()
+    except Exception as e:
+        # The slot is reclaimed after SCHEDULER_IN_FLIGHT_TIMEOUT_SECONDS
+        logger.warning(f"Failed to free the scheduler slot of document {context['document_id']}: {e}")
+
+
+def fail_pipeline_stage(
+    task,
+    stage: str,
+    exc: Exception,
+    context: Dict[str, Any],
+    failure_action: Optional[str] = "quick_detection_failed"
+) -> None:
+    """
+    Retry a failed pipeline stage under its own retry policy, or give up on it
+    
+    Only the stage is retried; it resumes from the checkpoint it was handed. Returns
+    once the stage is out of retries (or the failure is permanent), after the document
+    has been marked failed and audited as failure_action (unless None) and its
+    submission released; the caller re-raises. Payloads are left to expire, so a
+    resubmission picks up from the failed stage.
+    """
+    document_uuid = uuid.UUID(context["document_id"])
+    user_uuid = uuid.UUID(context["user_id"]) if context.get("user_id") else None
+    policy = STAGE_POLICIES[stage]
+    
+    defer_on_open_circuit(task, exc, document_uuid if failure_action else None)
+    
+    logger.error(f"Pipeline stage {stage} failed for document {document_uuid} "
+                 f"(task {task.request.id}, retries {task.request.retries}/{policy.max_retries}): {exc}")
+    
+    if task.request.retries < policy.max_retries and not is_permanent_failure(exc):
+        retry_delay = policy.delay(task.request.retries)
+        logger.info(f"Retrying pipeline stage {stage} for document {document_uuid} in {retry_delay}s")
+        raise task.retry(countdown=retry_delay, exc=exc, max_retries=policy.max_retries)
+    
+    # Out of retries, mark as failed
+    if failure_action:
+        run_async(record_task_failure(document_uuid, user_uuid, failure_action, {
+            "error": str(exc),
+            "stage": stage,
+            "retries": task.request.retries,
+            "task_id": task.request.id
+        }))
+    release_submission(context)
+
+
+@celery_app.task(bind=True, max_retries=STAGE_POLICIES["download"].max_retries, time_limit=10 * 60, soft_time_limit=9 * 60)
+def process_document_quick_detection(
+    self,
+    document_id: str,
+    user_id: str = None,
+    force: bool = False,
+    submission_key: Optional[str] = None
+):
+    """
+    Celery task for quick document detection and OCR processing
+    
+    Downloads the document on the io queue, then replaces itself with the rest of the
+    pipeline: OCR (ocr queue) -> type detection (cpu queue) -> persistence (db queue).
+    The task id carries through, so its result is that of the last stage. Submit it
+    with submit_quick_detection, which deduplicates submissions.
+    
+    Args:
+        document_id: UUID string of the document to process
+        user_id: UUID string of the user who initiated the processing
+        force: Re-run stages that already completed for this document content
+        submission_key: Submission claim held by this task, released when the pipeline ends
+    
     Returns:
         Dict containing processing results
     """
@@ -72,334 +463,360 @@ def process_document_quick_detection(self, document_id: str, user_id: str = None
                          user_id=user_id,
                          task_id=self.request.id)
     
+    run = {"force": force, "submission_key": submission_key, "submission_task_id": self.request.id}
     try:
-        # Step 1: Get document from database
-        document = run_async(database_service.get_document(document_uuid))
-        if not document:
-            error_msg = f"Document {document_id} not found"
-            logger.error("Document not found for processing",
-                                  document_id=document_id)
-            raise DocumentProcessingError(error_msg, document_uuid, "document_lookup")
+        context = {**run_async(download_stage(document_uuid, user_uuid, force)), **run}
+    except Exception as exc:
+        fail_pipeline_stage(self, "download", exc, {"document_id": document_id, "user_id": user_id, **run})
+        raise
+    
+    return self.replace(chain(
+        quick_detection_ocr.s(context),
+        quick_detection_detect.s(),
+        quick_detection_persist.s()
+    ))
+
+
+@celery_app.task(bind=True, max_retries=STAGE_POLICIES["ocr"].max_retries)
+def quick_detection_ocr(self, context: Dict[str, Any]):
+    """Quick detection stage: Azure OCR of the downloaded document"""
+    try:
+        return run_async(run_stage("ocr", context, ocr_stage))
+    except Exception as exc:
+        fail_pipeline_stage(self, "ocr", exc, context)
+        raise
+
+
+@celery_app.task(bind=True, max_retries=STAGE_POLICIES["detect"].max_retries, time_limit=10 * 60, soft_time_limit=9 * 60)
+def quick_detection_detect(self, context: Dict[str, Any]):
+    """Quick detection stage: NMTC document type detection on the OCR text"""
+    try:
+        return run_async(run_stage("detect", context, detection_stage))
+    except Exception as exc:
+        fail_pipeline_stage(self, "detect", exc, context)
+        raise
+
+
+@celery_app.task(bind=True, max_retries=STAGE_POLICIES["persist"].max_retries, time_limit=5 * 60, soft_time_limit=4 * 60)
+def quick_detection_persist(self, context: Dict[str, Any]):
+    """Quick detection stage: store the results and audit the run"""
+    try:
+        result = run_async(run_stage("persist", context, persist_stage, self.request.id, final=True))
+    except Exception as exc:
+        fail_pipeline_stage(self, "persist", exc, context)
+        raise
+    
+    release_submission(context)
+    return result
+
+
+async def download_stage(document_uuid: uuid.UUID, user_uuid: Optional[uuid.UUID], force: bool = False) -> Dict[str, Any]:
+    """Fetch a document and its content; returns the context handed along the pipeline"""
+    document_id = str(document_uuid)
+    
+    # Step 1: Get document from database
+    document = await database_service.get_document(document_uuid)
+    if not document:
+        error_msg = f"Document {document_id} not found"
+        logger.error("Document not found for processing",
+                              document_id=document_id)
+        raise DocumentProcessingError(error_msg, document_uuid, "document_lookup")
+    
+    logger.info("Document retrieved from database",
+                         document_id=document_id,
+                         filename=document.filename,
+                         storage_path=document.storage_path,
+                         current_status=document.ocr_status)
+    
+    # The content is still stored from an earlier run of this stage
+    known_hash = content_hash_hex(document.hash)
+    if known_hash and not force:
+        recorded = await asyncio.to_thread(recorded_stage_output, document_id, known_hash, "download")
+        if recorded is not None:
+            logger.info(f"Skipping stage download for document {document_id}; already completed")
+            await database_service.update_document(document_uuid, DocumentUpdate(ocr_status=OcrStatus.PROCESSING))
+            return {**recorded, "user_id": str(user_uuid) if user_uuid else None}
+    
+    # Steps 2-3: Update status to processing while downloading the PDF from Supabase Storage
+    status_update, download = await asyncio.gather(
+        database_service.update_document(
+            document_uuid,
+            DocumentUpdate(ocr_status=OcrStatus.PROCESSING)
+        ),
+        asyncio.to_thread(download_document, document),
+        return_exceptions=True
+    )
+    if isinstance(status_update, BaseException):
+        raise status_update
+    
+    logger.info("Updated document status to processing",
+                         document_id=document_id)
+    
+    if isinstance(download, BaseException):
+        error_msg = f"Failed to download document from storage: {str(download)}"
+        logger.error("Document download failed",
+                              document_id=document_id,
+                              storage_path=document.storage_path,
+                              error=str(download))
+        raise StorageError(error_msg, document.storage_path)
+    
+    async def store_content_hash(content_hash: bytes) -> None:
+        try:
+            await database_service.update_document(
+                document_uuid,
+                DocumentUpdate(hash=content_hash)
+            )
+        except Exception as hash_error:
+            logger.warning(f"Failed to store content hash for document {document_id}: {hash_error}")
+    
+    # Record the content hash so identical uploads can be recognised, while the content
+    # is handed over to the OCR stage
+    content_hash = compute_content_hash(download)
+    _, content_key = await asyncio.gather(
+        store_content_hash(content_hash) if document.hash != content_hash else asyncio.sleep(0),
+        asyncio.to_thread(payload_store.put_bytes, download)
+    )
+    
+    context = {
+        "document_id": document_id,
+        "user_id": str(user_uuid) if user_uuid else None,
+        "org_id": str(document.org_id),
+        "filename": document.filename,
+        "mime_type": document.mime_type,
+        "content_hash": content_hash.hex(),
+        "content_key": content_key
+    }
+    await asyncio.to_thread(
+        pipeline_idempotency.complete_stage, document_id, context["content_hash"], "download", context,
+        settings.PIPELINE_PAYLOAD_TTL_SECONDS
+    )
+    return context
+
+
+async def ocr_stage(context: Dict[str, Any]) -> Dict[str, Any]:
+    """OCR the downloaded content, publishing a provisional type as pages are read"""
+    document_id = context["document_id"]
+    document_uuid = uuid.UUID(document_id)
+    
+    # Detection patterns for this organization, also used to classify pages as they are read
+    document, document_content, detection_matcher = await asyncio.gather(
+        database_service.get_document(document_uuid),
+        asyncio.to_thread(payload_store.get_bytes, context["content_key"]),
+        detection_rule_service.get_matcher(uuid.UUID(context["org_id"]))
+    )
+    if not document:
+        raise DocumentProcessingError(f"Document {document_id} not found", document_uuid, "document_lookup")
+    
+    streaming_detector = StreamingDetector(matcher=detection_matcher)
+    
+    async def detect_from_ocr_text(text_chunk: str) -> None:
+        # Publish a provisional type as soon as the pages read so far are conclusive
+        provisional = await asyncio.to_thread(streaming_detector.feed, text_chunk)
+        if provisional:
+            logger.info(f"Provisional type {provisional['document_type_detected']} for document {document_id} "
+                        f"at {provisional['confidence']:.3f} after {provisional['chars_seen']} chars")
+            await database_service.update_document(
+                document_uuid,
+                DocumentUpdate(parsed_index={**(document.parsed_index or {}), "provisional_detection": provisional})
+            )
+    
+    # Step 4: Send to Azure OCR for quick text extraction (served from the OCR cache for known content)
+    try:
+        analysis_result = await azure_service.analyze_document_quick(
+            document_content=document_content,
+            document_id=document_uuid,
+            content_type=context["mime_type"],
+            content_hash=bytes.fromhex(context["content_hash"]),
+            on_text=detect_from_ocr_text
+        )
         
-        logger.info("Document retrieved from database",
+        logger.info("Azure OCR analysis completed",
                              document_id=document_id,
-                             filename=document.filename,
-                             storage_path=document.storage_path,
-                             current_status=document.ocr_status)
+                             pages_processed=analysis_result.get('page_count', 0),
+                             characters_extracted=len(analysis_result.get('full_text', '')),
+                             processing_duration=analysis_result.get('processing_duration_ms', 0))
+    
+    except CircuitOpenError:
+        raise
+    except Exception as e:
+        error_msg = f"Azure OCR processing failed: {str(e)}"
+        logger.error("Azure OCR processing failed",
+                              document_id=document_id,
+                              error=str(e))
+        raise OCRProcessingError(error_msg, document_uuid)
+    
+    analysis_key = await asyncio.to_thread(payload_store.put_json, analysis_result)
+    await asyncio.to_thread(payload_store.delete, context["content_key"])
+    
+    context = {key: value for key, value in context.items() if key != "content_key"}
+    return {**context, "analysis_key": analysis_key}
+
+
+async def detection_stage(context: Dict[str, Any]) -> Dict[str, Any]:
+    """Detect the document type from the OCR text"""
+    document_id = context["document_id"]
+    
+    analysis_result, detection_matcher = await asyncio.gather(
+        asyncio.to_thread(payload_store.get_json, context["analysis_key"]),
+        detection_rule_service.get_matcher(uuid.UUID(context["org_id"]))
+    )
+    
+    # Step 5: Perform NMTC document type detection
+    try:
+        full_text = analysis_result.get("full_text", "")
         
-        # Step 2: Update status to processing
-        run_async(database_service.update_document(
-            document_uuid,
-            DocumentUpdate(ocr_status=OcrStatus.PROCESSING)
-        ))
+        logger.info("Starting document type detection",
+                             document_id=document_id,
+                             text_length=len(full_text))
         
-        logger.info("Updated document status to processing",
-                             document_id=document_id)
+        # Detect document type using NMTC patterns, off the event loop
+        detection_result = await asyncio.to_thread(
+            detection_service.detect_document_type,
+            text_content=full_text,
+            document_id=uuid.UUID(document_id),
+            filename=context["filename"],
+            matcher=detection_matcher
+        )
         
-        # Step 3: Download PDF from Supabase Storage
-        try:
-            logger.info("Downloading document from storage",
-                                 document_id=document_id,
-                                 storage_path=document.storage_path)
-            
-            # Download file content from Supabase storage
-            try:
-                # Use the storage client to download the file
-                result = database_service.client.storage.from_('documents').download(document.storage_path)
-                if not result:
-                    raise StorageError(f"Failed to download file: {document.storage_path}")
-                
-                document_content = result
-                logger.info("Successfully downloaded document from storage",
-                                     document_id=document_id,
-                                     file_size=len(document_content))
-                
-            except Exception as download_error:
-                # Fallback: try getting public URL and downloading via HTTP
-                logger.warning("Direct download failed, trying public URL method",
-                                        document_id=document_id,
-                                        error=str(download_error))
-                
-                file_url = database_service.get_file_url(document.storage_path)
-                if not file_url:
-                    raise StorageError(f"Could not get URL for file: {document.storage_path}")
-                
-                import requests
-                import asyncio
-                
-                def download_file():
-                    response = requests.get(file_url, timeout=30)
-                    response.raise_for_status()
-                    return response.content
-                
-                # Run the synchronous request in a thread
-                import concurrent.futures
-                with concurrent.futures.ThreadPoolExecutor() as executor:
-                    document_content = executor.submit(download_file).result()
-                
-                logger.info("Downloaded document via public URL",
-                                     document_id=document_id,
-                                     file_size=len(document_content))
-            
-        except Exception as e:
-            error_msg = f"Failed to download document from storage: {str(e)}"
-            logger.error("Document download failed",
-                                  document_id=document_id,
-                                  storage_path=document.storage_path,
-                                  error=str(e))
-            
-            # Update status to error
-            run_async(database_service.update_document(
-                document_uuid,
-                DocumentUpdate(ocr_status=OcrStatus.ERROR)
-            ))
-            
-            raise StorageError(error_msg, document.storage_path)
+        logger.info("Document type detection completed",
+                             document_id=document_id,
+                             detected_type=detection_result.document_type.value,
+                             confidence=detection_result.confidence,
+                             primary_indicators=len(detection_result.primary_indicators),
+                             secondary_indicators=len(detection_result.secondary_indicators))
+    
+    except Exception as e:
+        # Don't fail the entire task if detection fails
+        logger.warning("Document type detection failed, continuing with OCR results",
+                                document_id=document_id,
+                                error=str(e))
         
-        # Step 4: Send to Azure OCR for quick text extraction
-        try:
-            analysis_result = run_async(azure_service.analyze_document_quick(
-                document_content=document_content,
-                document_id=document_uuid,
-                content_type=document.mime_type
-            ))
-            
-            logger.info("Azure OCR analysis completed",
-                                 document_id=document_id,
-                                 pages_processed=analysis_result.get('page_count', 0),
-                                 characters_extracted=len(analysis_result.get('full_text', '')),
-                                 processing_duration=analysis_result.get('processing_duration_ms', 0))
-            
-        except Exception as e:
-            error_msg = f"Azure OCR processing failed: {str(e)}"
-            logger.error("Azure OCR processing failed",
-                                  document_id=document_id,
-                                  error=str(e))
-            
-            # Update status to error
-            run_async(database_service.update_document(
-                document_uuid,
-                DocumentUpdate(ocr_status=OcrStatus.ERROR)
-            ))
-            
-            raise OCRProcessingError(error_msg, document_uuid)
+        # Create a fallback detection result
+        from app.utils.nmtc_patterns import NMTCDocumentType, DocumentTypeResult
+        detection_result = DocumentTypeResult(
+            document_type=NMTCDocumentType.UNKNOWN,
+            confidence=0.0,
+            primary_indicators=[],
+            secondary_indicators=[],
+            metadata={
+                "detection_timestamp": datetime.utcnow().isoformat(),
+                "detection_failed": True,
+                "failure_reason": str(e)
+            },
+            reasoning=f"Document type detection failed: {str(e)}"
+        )
+    
+    return {**context, "detection_results": serialize_detection_result(detection_result)}
+
+
+async def persist_stage(context: Dict[str, Any], task_id: str) -> Dict[str, Any]:
+    """Store OCR and detection results and audit the run; returns the task result"""
+    document_id = context["document_id"]
+    document_uuid = uuid.UUID(document_id)
+    user_id = context.get("user_id")
+    detection_results = context["detection_results"]
+    
+    analysis_result = await asyncio.to_thread(payload_store.get_json, context["analysis_key"])
+    
+    # Step 6: Process and structure results
+    try:
+        # Extract metadata for database storage
+        metadata = azure_service.extract_document_metadata(analysis_result)
         
-        # Step 5: Perform NMTC document type detection
-        try:
-            full_text = analysis_result.get("full_text", "")
-            
-            logger.info("Starting document type detection",
-                                 document_id=document_id,
-                                 text_length=len(full_text))
-            
-            # Detect document type using NMTC patterns
-            detection_result = detection_service.detect_document_type(
-                text_content=full_text,
-                document_id=document_uuid,
-                filename=document.filename
-            )
-            
-            logger.info("Document type detection completed",
-                                 document_id=document_id,
-                                 detected_type=detection_result.document_type.value,
-                                 confidence=detection_result.confidence,
-                                 primary_indicators=len(detection_result.primary_indicators),
-                                 secondary_indicators=len(detection_result.secondary_indicators))
-            
-        except Exception as e:
-            # Don't fail the entire task if detection fails
-            logger.warning("Document type detection failed, continuing with OCR results",
-                                    document_id=document_id,
-                                    error=str(e))
-            
-            # Create a fallback detection result
-            from app.utils.nmtc_patterns import NMTCDocumentType, DocumentTypeResult
-            detection_result = DocumentTypeResult(
-                document_type=NMTCDocumentType.UNKNOWN,
-                confidence=0.0,
-                primary_indicators=[],
-                secondary_indicators=[],
-                metadata={
-                    "detection_timestamp": datetime.utcnow().isoformat(),
-                    "detection_failed": True,
-                    "failure_reason": str(e)
-                },
-                reasoning=f"Document type detection failed: {str(e)}"
-            )
+        # Prepare parsed_index with structured results
+        parsed_index = {
+            "ocr_results": {
+                "full_text": analysis_result.get("full_text", ""),
+                "page_count": analysis_result.get("page_count", 0),
+                "confidence_summary": analysis_result.get("confidence_summary", {"count": 0}),
+                "overall_confidence": analysis_result.get("overall_confidence"),
+                "processing_metadata": metadata
+            },
+            "detection_results": detection_results,
+            "processing_history": [
+                {
+                    "stage": "quick_detection",
+                    "status": "completed",
+                    "processed_at": datetime.utcnow().isoformat(),
+                    "processing_duration_ms": analysis_result.get("processing_duration_ms", 0),
+                    "task_id": task_id,
+                    "user_id": user_id
+                }
+            ]
+        }
+        if "confidence_blob" in analysis_result:
+            parsed_index["ocr_results"]["confidence_blob"] = analysis_result["confidence_blob"]
         
-        # Step 6: Process and structure results
-        try:
-            # Extract metadata for database storage
-            metadata = azure_service.extract_document_metadata(analysis_result)
-            
-            # Prepare parsed_index with structured results
-            parsed_index = {
-                "ocr_results": {
-                    "full_text": analysis_result.get("full_text", ""),
-                    "page_count": analysis_result.get("page_count", 0),
-                    "confidence_scores": analysis_result.get("confidence_scores", []),
-                    "overall_confidence": analysis_result.get("overall_confidence"),
-                    "processing_metadata": metadata
-                },
-                "detection_results": {
-                    "document_type_detected": detection_result.document_type.value,
-                    "confidence": detection_result.confidence,
-                    "primary_indicators": [
-                        {
-                            "pattern_type": indicator.pattern_type,
-                            "match_text": indicator.match_text,
-                            "confidence": indicator.confidence,
-                            "location": indicator.location,
-                            "context": indicator.context
-                        }
-                        for indicator in detection_result.primary_indicators
-                    ],
-                    "secondary_indicators": [
-                        {
-                            "pattern_type": indicator.pattern_type,
-                            "match_text": indicator.match_text,
-                            "confidence": indicator.confidence,
-                            "location": indicator.location,
-                            "context": indicator.context
-                        }
-                        for indicator in detection_result.secondary_indicators
-                    ],
-                    "metadata": detection_result.metadata,
-                    "reasoning": detection_result.reasoning,
-                    "processed_at": datetime.utcnow().isoformat()
-                },
-                "processing_history": [
-                    {
-                        "stage": "quick_detection",
-                        "status": "completed",
-                        "processed_at": datetime.utcnow().isoformat(),
-                        "processing_duration_ms": analysis_result.get("processing_duration_ms", 0),
-                        "task_id": self.request.id,
-                        "user_id": user_id
-                    }
-                ]
-            }
-            
-            # Step 7: Update database with results
-            run_async(database_service.update_document(
+        # Steps 7-8: Update database with results and create the audit log entry together
+        update_result, audit_result = await asyncio.gather(
+            database_service.update_document(
                 document_uuid,
                 DocumentUpdate(
                     ocr_status=OcrStatus.COMPLETED,
                     parsed_index=parsed_index
                 )
-            ))
-            
-            logger.info("Document processing completed successfully",
-                                 document_id=document_id,
-                                 final_status=OcrStatus.COMPLETED.value,
-                                 text_length=len(analysis_result.get("full_text", "")),
-                                 ocr_confidence=analysis_result.get("overall_confidence"),
-                                 detected_type=detection_result.document_type.value,
-                                 detection_confidence=detection_result.confidence)
-            
-            # Step 8: Create audit log entry
-            try:
-                run_async(database_service.create_audit_log(
-                    scope="document_processing",
-                    action="quick_detection_completed",
-                    org_id=document.org_id,
-                    actor_user_id=user_uuid,
-                    record_id=document_uuid,
-                    diff={
-                        "old_status": "processing",
-                        "new_status": "completed",
-                        "pages_processed": analysis_result.get("page_count", 0),
-                        "characters_extracted": len(analysis_result.get("full_text", "")),
-                        "document_type_detected": detection_result.document_type.value,
-                        "detection_confidence": detection_result.confidence,
-                        "primary_indicators_count": len(detection_result.primary_indicators)
-                    }
-                ))
-            except Exception as audit_error:
-                # Don't fail the task if audit logging fails
-                logger.warning("Failed to create audit log",
-                                        document_id=document_id,
-                                        error=str(audit_error))
-            
-            # Return success result
-            return {
-                "document_id": document_id,
-                "status": "completed",
-                "pages_processed": analysis_result.get("page_count", 0),
-                "characters_extracted": len(analysis_result.get("full_text", "")),
-                "ocr_confidence": analysis_result.get("overall_confidence"),
-                "processing_duration_ms": analysis_result.get("processing_duration_ms", 0),
-                "document_type_detected": detection_result.document_type.value,
-                "detection_confidence": detection_result.confidence,
-                "primary_indicators_found": len(detection_result.primary_indicators),
-                "secondary_indicators_found": len(detection_result.secondary_indicators),
-                "task_id": self.request.id,
-                "completed_at": datetime.utcnow().isoformat()
-            }
-            
-        except Exception as e:
-            error_msg = f"Failed to update database with results: {str(e)}"
-            logger.error("Database update failed",
-                                  document_id=document_id,
-                                  error=str(e))
-            
-            # Try to update status to error
-            try:
-                run_async(database_service.update_document(
-                    document_uuid,
-                    DocumentUpdate(ocr_status=OcrStatus.ERROR)
-                ))
-            except Exception as db_error:
-                logger.error("Failed to update error status",
-                                      document_id=document_id,
-                                      error=str(db_error))
-            
-            raise DatabaseError(error_msg, "update_document_results")
+            ),
+            database_service.create_audit_log(
+                scope="document_processing",
+                action="quick_detection_completed",
+                org_id=uuid.UUID(context["org_id"]),
+                actor_user_id=uuid.UUID(user_id) if user_id else None,
+                record_id=document_uuid,
+                diff={
+                    "old_status": "processing",
+                    "new_status": "completed",
+                    "pages_processed": analysis_result.get("page_count", 0),
+                    "characters_extracted": len(analysis_result.get("full_text", "")),
+                    "document_type_detected": detection_results["document_type_detected"],
+                    "detection_confidence": detection_results["confidence"],
+                    "primary_indicators_count": len(detection_results["primary_indicators"])
+                }
+            ),
+            return_exceptions=True
+        )
+        if isinstance(update_result, BaseException):
+            raise update_result
         
-    except Exception as exc:
-        # Log the error and attempt retry
-        logger.error("Document processing task failed",
-                              document_id=document_id,
-                              task_id=self.request.id,
-                              error=str(exc),
-                              retries=self.request.retries)
+        logger.info("Document processing completed successfully",
+                             document_id=document_id,
+                             final_status=OcrStatus.COMPLETED.value,
+                             text_length=len(analysis_result.get("full_text", "")),
+                             ocr_confidence=analysis_result.get("overall_confidence"),
+                             detected_type=detection_results["document_type_detected"],
+                             detection_confidence=detection_results["confidence"])
         
-        # Retry logic
-        if self.request.retries < self.max_retries:
-            retry_delay = min(300 * (2 ** self.request.retries), 1800)  # Exponential backoff, max 30 min
-            logger.info("Retrying document processing task",
-                                 document_id=document_id,
-                                 retry_count=self.request.retries + 1,
-                                 retry_delay=retry_delay)
-            raise self.retry(countdown=retry_delay, exc=exc)
-        else:
-            # Max retries reached, mark as failed
-            try:
-                run_async(database_service.update_document(
-                    document_uuid,
-                    DocumentUpdate(ocr_status=OcrStatus.ERROR)
-                ))
-                
-                # Create audit log for failure
-                run_async(database_service.create_audit_log(
-                    scope="document_processing",
-                    action="quick_detection_failed",
-                    org_id=document.org_id if document else None,
-                    actor_user_id=user_uuid,
-                    record_id=document_uuid,
-                    diff={
-                        "error": str(exc),
-                        "retries": self.request.retries,
-                        "task_id": self.request.id
-                    }
-                ))
-            except Exception as cleanup_error:
-                logger.error("Failed to clean up after task failure",
-                                      document_id=document_id,
-                                      error=str(cleanup_error))
-            
-            # Re-raise the original exception
-            raise
+        if isinstance(audit_result, BaseException):
+            # Don't fail the task if audit logging fails
+            logger.warning("Failed to create audit log",
+                                    document_id=document_id,
+                                    error=str(audit_result))
+    
+    except CircuitOpenError:
+        raise
+    except Exception as e:
+        error_msg = f"Failed to update database with results: {str(e)}"
+        logger.error("Database update failed",
+                              document_id=document_id,
+                              error=str(e))
+        raise DatabaseError(error_msg, "update_document_results")
+    
+    await asyncio.to_thread(payload_store.delete, context["analysis_key"])
+    
+    # Return success result
+    return {
+        "document_id": document_id,
+        "status": "completed",
+        "pages_processed": analysis_result.get("page_count", 0),
+        "characters_extracted": len(analysis_result.get("full_text", "")),
+        "ocr_confidence": analysis_result.get("overall_confidence"),
+        "processing_duration_ms": analysis_result.get("processing_duration_ms", 0),
+        "document_type_detected": detection_results["document_type_detected"],
+        "detection_confidence": detection_results["confidence"],
+        "primary_indicators_found": len(detection_results["primary_indicators"]),
+        "secondary_indicators_found": len(detection_results["secondary_indicators"]),
+        "task_id": task_id,
+        "completed_at": datetime.utcnow().isoformat()
+    }
 
 
 @celery_app.task(bind=True, max_retries=2, default_retry_delay=60)
@@ -410,7 +827,7 @@ def process_document_type_detection(self, document_id: str, user_id: str = None)
     Args:
         document_id: UUID string of the document to process
         user_id: UUID string of the user who initiated the processing
-        
+    
     Returns:
         Dict containing detection results
     """
@@ -423,117 +840,11 @@ def process_document_type_detection(self, document_id: str, user_id: str = None)
                          task_id=self.request.id)
     
     try:
-        # Get document from database
-        document = run_async(database_service.get_document(document_uuid))
-        if not document:
-            raise DocumentProcessingError(f"Document {document_id} not found", 
-                                        document_uuid, "document_lookup")
-        
-        # Check if document has OCR text available
-        if not document.parsed_index or "ocr_results" not in document.parsed_index:
-            raise DocumentProcessingError("Document must have OCR results before type detection",
-                                        document_uuid, "prerequisite_check")
-        
-        full_text = document.parsed_index["ocr_results"].get("full_text", "")
-        if not full_text or len(full_text.strip()) < 50:
-            raise DocumentProcessingError("Document has insufficient OCR text for type detection",
-                                        document_uuid, "insufficient_text")
-        
-        # Perform document type detection
-        detection_result = detection_service.detect_document_type(
-            text_content=full_text,
-            document_id=document_uuid,
-            filename=document.filename
-        )
-        
-        # Update the detection results in parsed_index
-        current_parsed_index = document.parsed_index.copy()
-        current_parsed_index["detection_results"] = {
-            "document_type_detected": detection_result.document_type.value,
-            "confidence": detection_result.confidence,
-            "primary_indicators": [
-                {
-                    "pattern_type": indicator.pattern_type,
-                    "match_text": indicator.match_text,
-                    "confidence": indicator.confidence,
-                    "location": indicator.location,
-                    "context": indicator.context
-                }
-                for indicator in detection_result.primary_indicators
-            ],
-            "secondary_indicators": [
-                {
-                    "pattern_type": indicator.pattern_type,
-                    "match_text": indicator.match_text,
-                    "confidence": indicator.confidence,
-                    "location": indicator.location,
-                    "context": indicator.context
-                }
-                for indicator in detection_result.secondary_indicators
-            ],
-            "metadata": detection_result.metadata,
-            "reasoning": detection_result.reasoning,
-            "processed_at": datetime.utcnow().isoformat()
-        }
-        
-        # Update processing history
-        if "processing_history" not in current_parsed_index:
-            current_parsed_index["processing_history"] = []
-        
-        current_parsed_index["processing_history"].append({
-            "stage": "type_detection",
-            "status": "completed",
-            "processed_at": datetime.utcnow().isoformat(),
-            "task_id": self.request.id,
-            "user_id": user_id
-        })
-        
-        # Update database
-        run_async(database_service.update_document(
-            document_uuid,
-            DocumentUpdate(parsed_index=current_parsed_index)
-        ))
-        
-        logger.info("Standalone document type detection completed",
-                             document_id=document_id,
-                             detected_type=detection_result.document_type.value,
-                             confidence=detection_result.confidence,
-                             primary_indicators=len(detection_result.primary_indicators),
-                             secondary_indicators=len(detection_result.secondary_indicators))
-        
-        # Create audit log entry
-        try:
-            run_async(database_service.create_audit_log(
-                scope="document_processing",
-                action="type_detection_completed",
-                org_id=document.org_id,
-                actor_user_id=user_uuid,
-                record_id=document_uuid,
-                diff={
-                    "document_type_detected": detection_result.document_type.value,
-                    "detection_confidence": detection_result.confidence,
-                    "primary_indicators_count": len(detection_result.primary_indicators),
-                    "secondary_indicators_count": len(detection_result.secondary_indicators)
-                }
-            ))
-        except Exception as audit_error:
-            logger.warning("Failed to create audit log for type detection",
-                                    document_id=document_id,
-                                    error=str(audit_error))
-        
-        return {
-            "document_id": document_id,
-            "status": "completed",
-            "document_type_detected": detection_result.document_type.value,
-            "detection_confidence": detection_result.confidence,
-            "primary_indicators_found": len(detection_result.primary_indicators),
-            "secondary_indicators_found": len(detection_result.secondary_indicators),
-            "reasoning": detection_result.reasoning,
-            "task_id": self.request.id,
-            "completed_at": datetime.utcnow().isoformat()
-        }
-        
+        return run_async(type_detection_pipeline(document_uuid, user_uuid, self.request.id))
+    
     except Exception as exc:
+        defer_on_open_circuit(self, exc)
+        
         logger.error("Document type detection task failed",
                               document_id=document_id,
                               task_id=self.request.id,
@@ -557,20 +868,303 @@ def process_document_type_detection(self, document_id: str, user_id: str = None)
             raise
 
 
+async def type_detection_pipeline(
+    document_uuid: uuid.UUID,
+    user_uuid: Optional[uuid.UUID],
+    task_id: str
+) -> Dict[str, Any]:
+    """Re-detect one document's type from its stored OCR text; the body of process_document_type_detection"""
+    document_id = str(document_uuid)
+    user_id = str(user_uuid) if user_uuid else None
+    
+    # Get document from database
+    document = await database_service.get_document(document_uuid)
+    if not document:
+        raise DocumentProcessingError(f"Document {document_id} not found",
+                                    document_uuid, "document_lookup")
+    
+    # Check if document has OCR text available
+    if not document.parsed_index or "ocr_results" not in document.parsed_index:
+        raise DocumentProcessingError("Document must have OCR results before type detection",
+                                    document_uuid, "prerequisite_check")
+    
+    full_text = document.parsed_index["ocr_results"].get("full_text", "")
+    if not full_text or len(full_text.strip()) < 50:
+        raise DocumentProcessingError("Document has insufficient OCR text for type detection",
+                                    document_uuid, "insufficient_text")
+    
+    # Perform document type detection, off the event loop
+    detection_result = await asyncio.to_thread(
+        detection_service.detect_document_type,
+        text_content=full_text,
+        document_id=document_uuid,
+        filename=document.filename,
+        matcher=await detection_rule_service.get_matcher(document.org_id)
+    )
+    
+    # Update the detection results in parsed_index
+    current_parsed_index = document.parsed_index.copy()
+    current_parsed_index["detection_results"] = serialize_detection_result(detection_result)
+    
+    # Update processing history
+    if "processing_history" not in current_parsed_index:
+        current_parsed_index["processing_history"] = []
+    
+    current_parsed_index["processing_history"].append({
+        "stage": "type_detection",
+        "status": "completed",
+        "processed_at": datetime.utcnow().isoformat(),
+        "task_id": task_id,
+        "user_id": user_id
+    })
+    
+    # Update database and create the audit log entry together
+    update_result, audit_result = await asyncio.gather(
+        database_service.update_document(
+            document_uuid,
+            DocumentUpdate(parsed_index=current_parsed_index)
+        ),
+        database_service.create_audit_log(
+            scope="document_processing",
+            action="type_detection_completed",
+            org_id=document.org_id,
+            actor_user_id=user_uuid,
+            record_id=document_uuid,
+            diff={
+                "document_type_detected": detection_result.document_type.value,
+                "detection_confidence": detection_result.confidence,
+                "primary_indicators_count": len(detection_result.primary_indicators),
+                "secondary_indicators_count": len(detection_result.secondary_indicators)
+            }
+        ),
+        return_exceptions=True
+    )
+    if isinstance(update_result, BaseException):
+        raise update_result
+    
+    logger.info("Standalone document type detection completed",
+                         document_id=document_id,
+                         detected_type=detection_result.document_type.value,
+                         confidence=detection_result.confidence,
+                         primary_indicators=len(detection_result.primary_indicators),
+                         secondary_indicators=len(detection_result.secondary_indicators))
+    
+    if isinstance(audit_result, BaseException):
+        logger.warning("Failed to create audit log for type detection",
+                                document_id=document_id,
+                                error=str(audit_result))
+    
+    return {
+        "document_id": document_id,
+        "status": "completed",
+        "document_type_detected": detection_result.document_type.value,
+        "detection_confidence": detection_result.confidence,
+        "primary_indicators_found": len(detection_result.primary_indicators),
+        "secondary_indicators_found": len(detection_result.secondary_indicators),
+        "reasoning": detection_result.reasoning,
+        "task_id": task_id,
+        "completed_at": datetime.utcnow().isoformat()
+    }
+
+
 @celery_app.task(bind=True)
+def process_batch_type_detection(
+    self,
+    document_ids: Optional[List[str]] = None,
+    org_id: Optional[str] = None,
+    user_id: str = None,
+    batch_size: int = 50,
+    max_workers: Optional[int] = None
+):
+    """
+    Celery task re-running document type detection over many documents
+    
+    Documents are loaded, classified across a process pool and written back batch_size at
+    a time, with progress reported as task state. The next batch loads, and the previous
+    one is written back, while a batch is being classified. Documents without usable OCR
+    text are skipped; a document whose detection fails is reported and left unchanged.
+    
+    Args:
+        document_ids: UUID strings of the documents to process
+        org_id: UUID string of an organization whose completed documents are all processed
+            (when document_ids is not given)
+        user_id: UUID string of the user who initiated the processing
+        batch_size: Documents loaded and written back per database round-trip
+        max_workers: Detection processes (defaults to WORKER_BATCH_PROCESSES, else the CPU count)
+    
+    Returns:
+        Dict containing batch counts and throughput
+    """
+    if not document_ids and not org_id:
+        raise ValueError("Either document_ids or org_id is required")
+    
+    try:
+        return run_async(batch_type_detection_pipeline(
+            self, self.request.id, document_ids, org_id, user_id, batch_size, max_workers
+        ))
+    except Exception as exc:
+        defer_on_open_circuit(self, exc)
+        raise
+
+
+async def batch_type_detection_pipeline(
+    task,
+    task_id: str,
+    document_ids: Optional[List[str]],
+    org_id: Optional[str],
+    user_id: Optional[str],
+    batch_size: int,
+    max_workers: Optional[int]
+) -> Dict[str, Any]:
+    """The body of process_batch_type_detection"""
+    user_uuid = uuid.UUID(user_id) if user_id else None
+    
+    if document_ids:
+        document_uuids = [uuid.UUID(document_id) for document_id in document_ids]
+    else:
+        document_uuids = await database_service.get_organization_document_ids(
+            uuid.UUID(org_id), status=OcrStatus.COMPLETED
+        )
+    
+    total = len(document_uuids)
+    logger.info(f"Starting batch type detection of {total} documents (task {task_id})")
+    
+    counts = {"processed": 0, "completed": 0, "failed": 0, "skipped": 0}
+    failures = []
+    detected_types: Dict[str, int] = {}
+    orgs = set()
+    started = time.monotonic()
+    
+    def documents_per_second() -> float:
+        elapsed = time.monotonic() - started
+        return round(counts["processed"] / elapsed, 2) if elapsed > 0 else 0.0
+    
+    async def load_batch(batch_ids: List[uuid.UUID]) -> Dict[uuid.UUID, Any]:
+        return {document.id: document for document in await database_service.get_documents_by_ids(batch_ids)}
+    
+    async def write_batch(updated: list, batch_count: int) -> None:
+        written = await database_service.update_documents_detection_results(updated)
+        # Documents deleted while the batch ran are not written back
+        counts["completed"] += written
+        counts["skipped"] += len(updated) - written
+        counts["processed"] += batch_count
+        
+        task.update_state(task_id=task_id, state="PROGRESS", meta={
+            **counts,
+            "total": total,
+            "documents_per_second": documents_per_second()
+        })
+        logger.info(f"Batch type detection: {counts['processed']}/{total} documents "
+                    f"({documents_per_second()} docs/s)")
+    
+    step = max(1, batch_size)
+    batches = [document_uuids[batch_start:batch_start + step] for batch_start in range(0, total, step)]
+    next_batch = asyncio.ensure_future(load_batch(batches[0])) if batches else None
+    write_back = None
+    
+    try:
+        with detection_pool(max_workers or settings.WORKER_BATCH_PROCESSES or None) as executor:
+            for batch_index, batch_ids in enumerate(batches):
+                documents = await next_batch
+                if batch_index + 1 < len(batches):
+                    next_batch = asyncio.ensure_future(load_batch(batches[batch_index + 1]))
+                
+                pending: Dict[uuid.UUID, list] = {}  # org -> documents to detect
+                for document_uuid in batch_ids:
+                    document = documents.get(document_uuid)
+                    ocr_results = (document.parsed_index or {}).get("ocr_results") if document else None
+                    full_text = ocr_results.get("full_text", "") if ocr_results else ""
+                    if not full_text or len(full_text.strip()) < 50:
+                        counts["skipped"] += 1
+                        continue
+                    pending.setdefault(document.org_id, []).append((document_uuid, full_text, document.filename))
+                
+                updated = []
+                for document_org_id, org_documents in pending.items():
+                    # Each organization is detected with its own rules
+                    matcher = await detection_rule_service.get_matcher(document_org_id)
+                    results = await asyncio.to_thread(
+                        list, detection_service.detect_many(org_documents, executor, matcher)
+                    )
+                    for document_uuid, detection_result, error in results:
+                        if error:
+                            counts["failed"] += 1
+                            failures.append({"document_id": str(document_uuid), "error": error})
+                            continue
+                        
+                        document = documents[document_uuid]
+                        updated.append((document_uuid, serialize_detection_result(detection_result), {
+                            "stage": "type_detection",
+                            "status": "completed",
+                            "processed_at": datetime.utcnow().isoformat(),
+                            "task_id": task_id,
+                            "user_id": user_id
+                        }))
+                        
+                        detected_type = detection_result.document_type.value
+                        detected_types[detected_type] = detected_types.get(detected_type, 0) + 1
+                        orgs.add(document.org_id)
+                
+                if write_back:
+                    await write_back
+                write_back = asyncio.ensure_future(write_batch(updated, len(batch_ids)))
+            
+            if write_back:
+                await write_back
+        
+        # Create one audit log entry per organization touched
+        audit_results = await asyncio.gather(*[
+            database_service.create_audit_log(
+                scope="document_processing",
+                action="batch_type_detection_completed",
+                org_id=document_org_id,
+                actor_user_id=user_uuid,
+                diff={**counts, "total": total, "detected_types": detected_types}
+            )
+            for document_org_id in orgs
+        ], return_exceptions=True)
+        for audit_result in audit_results:
+            if isinstance(audit_result, BaseException):
+                logger.warning(f"Failed to create audit log for batch type detection: {audit_result}")
+        
+        return {
+            "status": "completed",
+            **counts,
+            "total": total,
+            "detected_types": detected_types,
+            "failures": failures,
+            "documents_per_second": documents_per_second(),
+            "elapsed_seconds": round(time.monotonic() - started, 2),
+            "task_id": task_id,
+            "completed_at": datetime.utcnow().isoformat()
+        }
+    
+    except Exception as exc:
+        logger.error(f"Batch type detection task failed after {counts['processed']}/{total} documents: {exc}")
+        raise
+    finally:
+        # Don't leave a prefetch or write-back running into the next task on this loop
+        for in_flight in (next_batch, write_back):
+            if in_flight and not in_flight.done():
+                in_flight.cancel()
+
+
+@celery_app.task(bind=True, max_retries=STAGE_POLICIES["layout"].max_retries)
 def process_document_layout_analysis(self, document_id: str, user_id: str = None):
     """
     Celery task for detailed document layout analysis
     
+    Runs the Azure layout analysis, checkpoints its result, then replaces itself with
+    the stage storing it (db queue), so a failure to store never repeats the analysis.
+    
     Args:
         document_id: UUID string of the document to process
         user_id: UUID string of the user who initiated the processing
-        
+    
     Returns:
         Dict containing layout analysis results
     """
     document_uuid = uuid.UUID(document_id)
-    user_uuid = uuid.UUID(user_id) if user_id else None
     
     logger.info("Starting document layout analysis task",
                          document_id=document_id,
@@ -578,77 +1172,142 @@ def process_document_layout_analysis(self, document_id: str, user_id: str = None
                          task_id=self.request.id)
     
     try:
-        # Get document from database
-        document = run_async(database_service.get_document(document_uuid))
-        if not document:
-            raise DocumentProcessingError(f"Document {document_id} not found", 
-                                        document_uuid, "document_lookup")
-        
-        # Ensure document has been through quick detection first
-        if document.ocr_status not in [OcrStatus.COMPLETED, OcrStatus.DONE]:
-            raise DocumentProcessingError("Document must complete quick detection first",
-                                        document_uuid, "prerequisite_check")
-        
-        # Download document content (simplified for now)
-        file_url = database_service.get_file_url(document.storage_path)
-        document_content = b"PDF content placeholder"  # TODO: Actual download
-        
-        # Perform layout analysis
-        analysis_result = run_async(azure_service.analyze_document_layout(
-            document_content=document_content,
-            document_id=document_uuid,
-            content_type=document.mime_type
-        ))
-        
-        # Update parsed_index with layout results
-        current_parsed_index = document.parsed_index or {}
-        current_parsed_index["layout_analysis"] = {
-            "tables": analysis_result.get("tables", []),
-            "paragraphs": analysis_result.get("paragraphs", []),
-            "key_value_pairs": analysis_result.get("key_value_pairs", []),
-            "processed_at": datetime.utcnow().isoformat(),
-            "processing_metadata": azure_service.extract_document_metadata(analysis_result)
-        }
-        
-        # Update processing history
-        if "processing_history" not in current_parsed_index:
-            current_parsed_index["processing_history"] = []
-        
-        current_parsed_index["processing_history"].append({
-            "stage": "layout_analysis",
-            "status": "completed",
-            "processed_at": datetime.utcnow().isoformat(),
-            "processing_duration_ms": analysis_result.get("processing_duration_ms", 0),
-            "task_id": self.request.id,
-            "user_id": user_id
-        })
-        
-        # Update database
-        run_async(database_service.update_document(
-            document_uuid,
-            DocumentUpdate(parsed_index=current_parsed_index)
-        ))
-        
-        logger.info("Document layout analysis completed",
-                             document_id=document_id,
-                             tables_found=len(analysis_result.get("tables", [])),
-                             paragraphs_found=len(analysis_result.get("paragraphs", [])))
-        
-        return {
-            "document_id": document_id,
-            "status": "completed",
-            "tables_found": len(analysis_result.get("tables", [])),
-            "paragraphs_found": len(analysis_result.get("paragraphs", [])),
-            "key_value_pairs_found": len(analysis_result.get("key_value_pairs", [])),
-            "task_id": self.request.id,
-            "completed_at": datetime.utcnow().isoformat()
-        }
-        
+        context = run_async(layout_analysis_stage(document_uuid, user_id))
     except Exception as exc:
+        fail_pipeline_stage(self, "layout", exc, {"document_id": document_id, "user_id": user_id},
+                            failure_action=None)
         logger.error("Layout analysis task failed",
                               document_id=document_id,
                               error=str(exc))
         raise
+    
+    return self.replace(layout_analysis_persist.s(context))
+
+
+@celery_app.task(bind=True, max_retries=STAGE_POLICIES["layout_persist"].max_retries)
+def layout_analysis_persist(self, context: Dict[str, Any]):
+    """Layout analysis stage: store the checkpointed results in the document's parsed_index"""
+    try:
+        return run_async(layout_persist_stage(context, self.request.id))
+    except Exception as exc:
+        fail_pipeline_stage(self, "layout_persist", exc, context, failure_action=None)
+        logger.error("Layout analysis task failed",
+                              document_id=context["document_id"],
+                              error=str(exc))
+        raise
+
+
+async def layout_analysis_stage(document_uuid: uuid.UUID, user_id: Optional[str]) -> Dict[str, Any]:
+    """Analyze a document's layout, or pick up the analysis checkpointed for its content"""
+    document_id = str(document_uuid)
+    
+    # Get document from database
+    document = await database_service.get_document(document_uuid)
+    if not document:
+        raise DocumentProcessingError(f"Document {document_id} not found",
+                                    document_uuid, "document_lookup")
+    
+    # Ensure document has been through quick detection first
+    if document.ocr_status not in [OcrStatus.COMPLETED, OcrStatus.DONE]:
+        raise DocumentProcessingError("Document must complete quick detection first",
+                                    document_uuid, "prerequisite_check")
+    
+    content_hash = content_hash_hex(document.hash)
+    if content_hash:
+        recorded = await asyncio.to_thread(recorded_stage_output, document_id, content_hash, "layout")
+        if recorded is not None:
+            logger.info(f"Skipping stage layout for document {document_id}; already completed")
+            return {**recorded, "user_id": user_id}
+    
+    # Download document content
+    try:
+        document_content = await asyncio.to_thread(download_document, document)
+    except Exception as download_error:
+        raise StorageError(f"Failed to download document from storage: {str(download_error)}",
+                           document.storage_path)
+    
+    if content_hash is None:
+        content_hash = (await asyncio.to_thread(compute_content_hash, document_content)).hex()
+    
+    # Perform layout analysis
+    analysis_result = await azure_service.analyze_document_layout(
+        document_content=document_content,
+        document_id=document_uuid,
+        content_type=document.mime_type,
+        content_hash=bytes.fromhex(content_hash)
+    )
+    
+    # Checkpoint the analysis before anything else can fail
+    context = {
+        "document_id": document_id,
+        "user_id": user_id,
+        "content_hash": content_hash,
+        "analysis_key": await asyncio.to_thread(payload_store.put_json, analysis_result)
+    }
+    await asyncio.to_thread(
+        pipeline_idempotency.complete_stage, document_id, content_hash, "layout", context,
+        settings.PIPELINE_PAYLOAD_TTL_SECONDS
+    )
+    return context
+
+
+async def layout_persist_stage(context: Dict[str, Any], task_id: str) -> Dict[str, Any]:
+    """Store a checkpointed layout analysis; returns the task result"""
+    document_id = context["document_id"]
+    document_uuid = uuid.UUID(document_id)
+    
+    document, analysis_result = await asyncio.gather(
+        database_service.get_document(document_uuid),
+        asyncio.to_thread(payload_store.get_json, context["analysis_key"])
+    )
+    if not document:
+        raise DocumentProcessingError(f"Document {document_id} not found",
+                                    document_uuid, "document_lookup")
+    
+    # Update parsed_index with layout results
+    current_parsed_index = document.parsed_index or {}
+    current_parsed_index["layout_analysis"] = {
+        "tables": analysis_result.get("tables", []),
+        "paragraphs": analysis_result.get("paragraphs", []),
+        "key_value_pairs": analysis_result.get("key_value_pairs", []),
+        "processed_at": datetime.utcnow().isoformat(),
+        "processing_metadata": azure_service.extract_document_metadata(analysis_result)
+    }
+    
+    # Update processing history
+    if "processing_history" not in current_parsed_index:
+        current_parsed_index["processing_history"] = []
+    
+    current_parsed_index["processing_history"].append({
+        "stage": "layout_analysis",
+        "status": "completed",
+        "processed_at": datetime.utcnow().isoformat(),
+        "processing_duration_ms": analysis_result.get("processing_duration_ms", 0),
+        "task_id": task_id,
+        "user_id": context.get("user_id")
+    })
+    
+    # Update database
+    await database_service.update_document(
+        document_uuid,
+        DocumentUpdate(parsed_index=current_parsed_index)
+    )
+    await asyncio.to_thread(payload_store.delete, context["analysis_key"])
+    
+    logger.info("Document layout analysis completed",
+                         document_id=document_id,
+                         tables_found=len(analysis_result.get("tables", [])),
+                         paragraphs_found=len(analysis_result.get("paragraphs", [])))
+    
+    return {
+        "document_id": document_id,
+        "status": "completed",
+        "tables_found": len(analysis_result.get("tables", [])),
+        "paragraphs_found": len(analysis_result.get("paragraphs", [])),
+        "key_value_pairs_found": len(analysis_result.get("key_value_pairs", [])),
+        "task_id": task_id,
+        "completed_at": datetime.utcnow().isoformat()
+    }
 
 
 @celery_app.task
@@ -705,6 +1364,14 @@ def get_document_processing_status(document_id: str):
         
         # Extract detection information if available
         detection_info = {}
+        if document.parsed_index and "provisional_detection" in document.parsed_index:
+            provisional = document.parsed_index["provisional_detection"]
+            detection_info = {
+                "document_type_detected": provisional.get("document_type_detected"),
+                "detection_confidence": provisional.get("confidence"),
+                "provisional": True,
+                "detection_processed_at": provisional.get("detected_at")
+            }
         if document.parsed_index and "detection_results" in document.parsed_index:
             detection_results = document.parsed_index["detection_results"]
             detection_info = {
@@ -745,6 +1412,10 @@ celery_app.conf.beat_schedule = {
         'task': 'app.tasks.document_tasks.cleanup_failed_documents',
         'schedule': 3600.0,  # Every hour
     },
+    'dispatch-quick-detection': {
+        'task': 'app.tasks.document_tasks.dispatch_quick_detection',
+        'schedule': 30.0,  # Picks up dispatches whose request was lost, and lost pipelines
+    },
 }
 
 
@@ -0,0 +1,104 @@
+"""
+Queues of the staged document pipeline and the worker serving each.
+
+Quick detection runs as a chain of tasks, one stage per queue, so a slot waiting on
+storage or Azure is never held by CPU-bound detection and the other way round:
+    io   downloading documents from storage
+    ocr  Azure Document Intelligence
+    cpu  document type detection
+    db   writing results, status reads and maintenance
+    batch  re-detection over many documents
+Each queue gets its own worker: I/O-bound queues run many concurrent tasks on a thread
+(or gevent/eventlet) pool, the CPU queue one process per core. Batch detection spreads
+its documents over a process pool of its own, which daemonic prefork children can't
+start, so the batch queue runs its tasks in the worker's main process (solo pool):
+    python -m app.tasks.queues io [extra celery worker options]
+"""
+from app.config import settings
+from typing import Any, Dict, List, Sequence
+import os
+import sys
+
+IO_QUEUE = "io"
+OCR_QUEUE = "ocr"
+CPU_QUEUE = "cpu"
+DB_QUEUE = "db"
+BATCH_QUEUE = "batch"
+
+PIPELINE_QUEUES = (IO_QUEUE, OCR_QUEUE, CPU_QUEUE, DB_QUEUE, BATCH_QUEUE)
+
+TASK_ROUTES = {
+    "app.tasks.document_tasks.process_document_quick_detection": {"queue": IO_QUEUE},
+    "app.tasks.document_tasks.quick_detection_ocr": {"queue": OCR_QUEUE},
+    "app.tasks.document_tasks.quick_detection_detect": {"queue": CPU_QUEUE},
+    "app.tasks.document_tasks.quick_detection_persist": {"queue": DB_QUEUE},
+    "app.tasks.document_tasks.process_document_type_detection": {"queue": CPU_QUEUE},
+    "app.tasks.document_tasks.process_batch_type_detection": {"queue": BATCH_QUEUE},
+    "app.tasks.document_tasks.process_document_layout_analysis": {"queue": OCR_QUEUE},
+    "app.tasks.document_tasks.layout_analysis_persist": {"queue": DB_QUEUE},
+    "app.tasks.document_tasks.dispatch_quick_detection": {"queue": DB_QUEUE},
+    "app.tasks.document_tasks.cleanup_failed_documents": {"queue": DB_QUEUE},
+    "app.tasks.document_tasks.get_document_processing_status": {"queue": DB_QUEUE},
+}
+
+
+def worker_profile(queue: str) -> Dict[str, Any]:
+    """Pool, concurrency and prefetch multiplier of the worker serving a queue"""
+    return {
+        IO_QUEUE: {
+            "pool": settings.WORKER_IO_POOL,
+            "concurrency": settings.WORKER_IO_CONCURRENCY,
+            "prefetch_multiplier": settings.WORKER_IO_PREFETCH
+        },
+        OCR_QUEUE: {
+            "pool": settings.WORKER_OCR_POOL,
+            "concurrency": settings.WORKER_OCR_CONCURRENCY,
+            "prefetch_multiplier": settings.WORKER_OCR_PREFETCH
+        },
+        CPU_QUEUE: {
+            # Detection holds its slot for the whole task, so don't reserve more than one
+            "pool": "prefork",
+            "concurrency": settings.WORKER_CPU_CONCURRENCY or os.cpu_count() or 1,
+            "prefetch_multiplier": 1
+        },
+        DB_QUEUE: {
+            "pool": settings.WORKER_DB_POOL,
+            "concurrency": settings.WORKER_DB_CONCURRENCY,
+            "prefetch_multiplier": settings.WORKER_DB_PREFETCH
+        },
+        BATCH_QUEUE: {
+            # One batch at a time, detected across WORKER_BATCH_PROCESSES processes
+            "pool": "solo",
+            "concurrency": 1,
+            "prefetch_multiplier": 1
+        }
+    }[queue]
+
+
+def worker_command(queue: str, extra_args: Sequence[str] = ()) -> List[str]:
+    """celery worker command line for the worker serving a queue"""
+    profile = worker_profile(queue)
+    return [
+        "celery", "-A", "app.tasks.document_tasks", "worker",
+        "--queues", queue,
+        "--hostname", f"{queue}@%h",
+        "--pool", profile["pool"],
+        "--concurrency", str(profile["concurrency"]),
+        "--prefetch-multiplier", str(profile["prefetch_multiplier"]),
+        *extra_args
+    ]
+
+
+def main(argv: List[str]) -> int:
+    if not argv or argv[0] not in PIPELINE_QUEUES:
+        print(f"Usage: python -m app.tasks.queues {{{'|'.join(PIPELINE_QUEUES)}}} [celery worker options]")
+        return 2
+
+    command = worker_command(argv[0], argv[1:])
+    print(" ".join(command))
+    sys.stdout.flush()
+    os.execvp(command[0], command)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
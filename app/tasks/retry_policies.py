@@ -0,0 +1,61 @@
+"""
+Retry policies of the pipeline stages.
+
+Every stage of a pipeline is its own task, handed a checkpoint of the stage before it,
+so a stage retries on its own: a database error while storing results retries the
+store, never the download or the Azure call. Each stage has its own retry budget and
+backoff, tunable through PIPELINE_STAGE_RETRY_OVERRIDES:
+    download        fetching the document from storage
+    ocr             Azure quick OCR
+    detect          document type detection
+    persist         storing quick detection results
+    layout          Azure layout analysis
+    layout_persist  storing layout analysis results
+"""
+from app.config import settings
+from app.utils.exceptions import DocumentProcessingError
+from dataclasses import dataclass, asdict
+from typing import Dict
+
+# Processing stages of DocumentProcessingError that no retry will fix
+PERMANENT_FAILURE_STAGES = ("document_lookup", "prerequisite_check")
+
+
+@dataclass
+class StageRetryPolicy:
+    """How often and how patiently one stage retries"""
+    max_retries: int
+    base_delay: int  # Seconds before the first retry, doubling with each one
+    max_delay: int
+
+    def delay(self, retries: int) -> int:
+        """Backoff before retry number retries + 1"""
+        return min(self.base_delay * (2 ** retries), self.max_delay)
+
+
+DEFAULT_POLICIES = {
+    "download": StageRetryPolicy(max_retries=3, base_delay=30, max_delay=600),
+    "ocr": StageRetryPolicy(max_retries=3, base_delay=300, max_delay=1800),
+    "detect": StageRetryPolicy(max_retries=1, base_delay=60, max_delay=60),
+    # Database blips are short and the results are already computed, so retry sooner and more
+    "persist": StageRetryPolicy(max_retries=5, base_delay=15, max_delay=600),
+    "layout": StageRetryPolicy(max_retries=3, base_delay=300, max_delay=1800),
+    "layout_persist": StageRetryPolicy(max_retries=5, base_delay=15, max_delay=600),
+}
+
+
+def stage_policy(stage: str) -> StageRetryPolicy:
+    """Default policy of a stage with any overrides applied"""
+    policy = asdict(DEFAULT_POLICIES[stage])
+    override = settings.PIPELINE_STAGE_RETRY_OVERRIDES.get(stage, {})
+    policy.update({key: int(value) for key, value in override.items() if key in policy})
+    return StageRetryPolicy(**policy)
+
+
+def is_permanent_failure(exc: Exception) -> bool:
+    """Whether a failure would only repeat on retry (the document is gone, or not ready)"""
+    return isinstance(exc, DocumentProcessingError) and \
+        exc.context.get("processing_stage") in PERMANENT_FAILURE_STAGES
+
+
+STAGE_POLICIES: Dict[str, StageRetryPolicy] = {stage: stage_policy(stage) for stage in DEFAULT_POLICIES}
@@ -0,0 +1,259 @@
+"""
+Circuit breaker for calls to external services (Azure Document Intelligence, Supabase).
+A breaker watches a sliding window of recent calls and opens when too many fail or run
+slow; while open, calls fail fast with CircuitOpenError instead of hanging on a degraded
+dependency. After a cool-down it lets a few probe calls through (half-open) and closes
+again once they succeed.
+"""
+from app.config import settings
+from app.utils.exceptions import ExternalServiceError
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from enum import Enum
+from typing import Dict, Any, Optional, Callable, Deque, Tuple
+import logging
+import math
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitState(str, Enum):
+    """Circuit breaker states"""
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(ExternalServiceError):
+    """Call rejected because the service's circuit breaker is open"""
+    def __init__(self, service_name: str, retry_after: float):
+        super().__init__(
+            service_name,
+            f"Circuit breaker open; failing fast for {math.ceil(retry_after)}s",
+            status_code=503
+        )
+        self.retry_after = max(1, math.ceil(retry_after))
+        self.context["retry_after"] = self.retry_after
+
+
+class CircuitBreaker:
+    """
+    Closed/open/half-open breaker over a count-based sliding window
+
+    The circuit opens when, over at least minimum_calls recent calls, the failure rate
+    reaches failure_rate_threshold or the share of calls slower than slow_call_seconds
+    reaches slow_call_rate_threshold. is_failure decides which exceptions count against
+    the service (e.g. not a 404 for a missing row). A call can bring its own slow-call
+    threshold when its expected duration varies (e.g. with the pages analysed).
+
+    State is per process: each worker process trips its own breakers.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate_threshold: float = 0.5,
+        slow_call_rate_threshold: float = 0.8,
+        slow_call_seconds: Optional[float] = None,
+        window_size: int = 20,
+        minimum_calls: int = 10,
+        open_seconds: float = 30.0,
+        half_open_max_calls: int = 3,
+        is_failure: Optional[Callable[[BaseException], bool]] = None
+    ):
+        self.name = name
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.minimum_calls = minimum_calls
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = half_open_max_calls
+        self.is_failure = is_failure or (lambda error: True)
+
+        self._lock = threading.Lock()
+        self._window: Deque[Tuple[bool, bool]] = deque(maxlen=window_size)
+        self._state = CircuitState.CLOSED
+        self._opened_at = 0.0
+        self._half_open_calls = 0
+        self._half_open_successes = 0
+        self._rejected_calls = 0
+
+    @property
+    def state(self) -> CircuitState:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> CircuitState:
+        # Caller holds the lock; an open circuit turns half-open once the cool-down has passed
+        if self._state == CircuitState.OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._transition(CircuitState.HALF_OPEN)
+        return self._state
+
+    def _transition(self, state: CircuitState) -> None:
+        if state == self._state:
+            return
+
+        logger.warning(f"Circuit breaker '{self.name}' {self._state.value} -> {state.value}")
+        self._state = state
+        if state == CircuitState.OPEN:
+            self._opened_at = time.monotonic()
+        elif state == CircuitState.HALF_OPEN:
+            self._half_open_calls = 0
+            self._half_open_successes = 0
+        elif state == CircuitState.CLOSED:
+            self._window.clear()
+
+    def before_call(self) -> None:
+        """Admit a call or raise CircuitOpenError"""
+        with self._lock:
+            state = self._current_state()
+            if state == CircuitState.CLOSED:
+                return
+
+            if state == CircuitState.HALF_OPEN and self._half_open_calls < self.half_open_max_calls:
+                self._half_open_calls += 1
+                return
+
+            self._rejected_calls += 1
+            retry_after = self.open_seconds - (time.monotonic() - self._opened_at)
+            raise CircuitOpenError(self.name, retry_after if state == CircuitState.OPEN else 1)
+
+    def _release_probe(self) -> None:
+        with self._lock:
+            if self._state == CircuitState.HALF_OPEN and self._half_open_calls > 0:
+                self._half_open_calls -= 1
+
+    def record(
+        self,
+        duration_seconds: float,
+        error: Optional[BaseException] = None,
+        slow_call_seconds: Optional[float] = None
+    ) -> None:
+        """Record the outcome of an admitted call (slow_call_seconds overrides the breaker's threshold)"""
+        failed = error is not None and self.is_failure(error)
+        slow_call_seconds = slow_call_seconds or self.slow_call_seconds
+        slow = slow_call_seconds is not None and duration_seconds >= slow_call_seconds
+
+        with self._lock:
+            state = self._current_state()
+
+            if state == CircuitState.HALF_OPEN:
+                if failed or slow:
+                    self._transition(CircuitState.OPEN)
+                else:
+                    self._half_open_successes += 1
+                    if self._half_open_successes >= self.half_open_max_calls:
+                        self._transition(CircuitState.CLOSED)
+                return
+
+            self._window.append((failed, slow))
+            if state == CircuitState.CLOSED and len(self._window) >= self.minimum_calls:
+                failure_rate = sum(1 for f, _ in self._window if f) / len(self._window)
+                slow_rate = sum(1 for _, s in self._window if s) / len(self._window)
+                if failure_rate >= self.failure_rate_threshold or slow_rate >= self.slow_call_rate_threshold:
+                    logger.error(f"Circuit breaker '{self.name}' opening - failure rate: {failure_rate:.0%}, slow call rate: {slow_rate:.0%}")
+                    self._transition(CircuitState.OPEN)
+
+    @contextmanager
+    def guard(self, slow_call_seconds: Optional[float] = None):
+        """Run a block as one call through the breaker"""
+        self.before_call()
+        started = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            self.record(time.monotonic() - started, e, slow_call_seconds)
+            raise
+        except BaseException:
+            # Cancelled, not failed: hand back a half-open probe slot without an outcome
+            self._release_probe()
+            raise
+        self.record(time.monotonic() - started, slow_call_seconds=slow_call_seconds)
+
+    @asynccontextmanager
+    async def guard_async(self, slow_call_seconds: Optional[float] = None):
+        """Run an async block as one call through the breaker"""
+        self.before_call()
+        started = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            self.record(time.monotonic() - started, e, slow_call_seconds)
+            raise
+        except BaseException:
+            # Cancelled, not failed: hand back a half-open probe slot without an outcome
+            self._release_probe()
+            raise
+        self.record(time.monotonic() - started, slow_call_seconds=slow_call_seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Breaker state and window statistics of this process, for health reporting"""
+        with self._lock:
+            state = self._current_state()
+            calls = len(self._window)
+            return {
+                "state": state.value,
+                "scope": "process",
+                "pid": os.getpid(),
+                "window_calls": calls,
+                "failure_rate": sum(1 for f, _ in self._window if f) / calls if calls else 0.0,
+                "slow_call_rate": sum(1 for _, s in self._window if s) / calls if calls else 0.0,
+                "rejected_calls": self._rejected_calls,
+                "retry_after_seconds": max(0.0, self.open_seconds - (time.monotonic() - self._opened_at)) if state == CircuitState.OPEN else 0.0
+            }
+
+
+def _is_azure_failure(error: BaseException) -> bool:
+    """Throttling, server errors, timeouts and transport errors count; client errors do not"""
+    from azure.core.exceptions import HttpResponseError, AzureError
+
+    if isinstance(error, HttpResponseError) and error.status_code is not None:
+        return error.status_code >= 500 or error.status_code in (408, 429)
+    if isinstance(error, ExternalServiceError):
+        return error.status_code >= 500
+    return isinstance(error, (AzureError, OSError, TimeoutError))
+
+
+def _is_supabase_failure(error: BaseException) -> bool:
+    """Transport errors and timeouts count; errors PostgREST answered with (bad query, constraint) do not"""
+    import httpx
+    from postgrest.exceptions import APIError
+
+    if isinstance(error, APIError):
+        return False
+    return isinstance(error, (httpx.TransportError, OSError, TimeoutError))
+
+
+# Per-process breakers shared by the services that call each dependency
+azure_breaker = CircuitBreaker(
+    "Azure Document Intelligence",
+    failure_rate_threshold=settings.CIRCUIT_BREAKER_FAILURE_RATE,
+    slow_call_rate_threshold=settings.CIRCUIT_BREAKER_SLOW_CALL_RATE,
+    slow_call_seconds=settings.AZURE_BREAKER_SLOW_CALL_SECONDS,  # Callers pass a per-page threshold
+    window_size=settings.CIRCUIT_BREAKER_WINDOW_SIZE,
+    minimum_calls=settings.CIRCUIT_BREAKER_MINIMUM_CALLS,
+    open_seconds=settings.CIRCUIT_BREAKER_OPEN_SECONDS,
+    is_failure=_is_azure_failure
+)
+
+supabase_breaker = CircuitBreaker(
+    "Supabase",
+    failure_rate_threshold=settings.CIRCUIT_BREAKER_FAILURE_RATE,
+    slow_call_rate_threshold=settings.CIRCUIT_BREAKER_SLOW_CALL_RATE,
+    slow_call_seconds=settings.SUPABASE_BREAKER_SLOW_CALL_SECONDS,
+    window_size=settings.CIRCUIT_BREAKER_WINDOW_SIZE,
+    minimum_calls=settings.CIRCUIT_BREAKER_MINIMUM_CALLS,
+    open_seconds=settings.CIRCUIT_BREAKER_OPEN_SECONDS,
+    is_failure=_is_supabase_failure
+)
+
+
+def get_breaker_states() -> Dict[str, Dict[str, Any]]:
+    """Snapshot of every breaker in this process, keyed by dependency"""
+    return {
+        "azure": azure_breaker.snapshot(),
+        "supabase": supabase_breaker.snapshot()
+    }
@@ -0,0 +1,56 @@
+"""
+Compact representation of per-word OCR confidences.
+Confidences are held as float32 arrays while a result is processed; only summary
+statistics (and optionally a compressed binary blob) are persisted.
+"""
+from typing import Dict, Any, Iterable, List
+import base64
+import zlib
+
+import numpy as np
+
+# Fixed [0, 1] histogram bins so page and document histograms are comparable
+HISTOGRAM_BINS = 10
+PERCENTILES = (5, 25, 50, 75, 95)
+
+
+def to_confidence_array(words: Iterable[Any]) -> np.ndarray:
+    """Collect the word confidences that Azure reported into a float32 array"""
+    return np.fromiter(
+        (word.confidence for word in words if getattr(word, 'confidence', None) is not None),
+        dtype=np.float32
+    )
+
+
+def confidence_histogram(confidences: np.ndarray) -> List[int]:
+    """Word counts per confidence bin over [0, 1]"""
+    counts, _ = np.histogram(confidences, bins=HISTOGRAM_BINS, range=(0.0, 1.0))
+    return counts.tolist()
+
+
+def summarize_confidences(confidences: np.ndarray) -> Dict[str, Any]:
+    """Vectorized mean/min/max, percentiles and histogram of a confidence array"""
+    if confidences.size == 0:
+        return {"count": 0}
+
+    percentiles = np.percentile(confidences, PERCENTILES)
+    return {
+        "count": int(confidences.size),
+        # Accumulate in float64 so the mean of a long float32 array does not drift
+        "mean": float(confidences.mean(dtype=np.float64)),
+        "min": float(confidences.min()),
+        "max": float(confidences.max()),
+        "percentiles": {f"p{p}": float(value) for p, value in zip(PERCENTILES, percentiles)},
+        "histogram": confidence_histogram(confidences)
+    }
+
+
+def encode_confidence_blob(confidences: np.ndarray) -> str:
+    """zlib-compressed little-endian float32 array, base64 encoded for JSONB storage"""
+    raw = confidences.astype('<f4', copy=False).tobytes()
+    return base64.b64encode(zlib.compress(raw)).decode('ascii')
+
+
+def decode_confidence_blob(blob: str) -> np.ndarray:
+    """Inverse of encode_confidence_blob"""
+    return np.frombuffer(zlib.decompress(base64.b64decode(blob)), dtype='<f4')
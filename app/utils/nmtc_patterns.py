@@ -4,6 +4,7 @@ This module contains patterns and rules for identifying different types of NMTC
 based on text content, structure, and key terminology.
 """
 import re
+from collections import OrderedDict
 from typing import Dict, List, Optional, Tuple, Any
 from dataclasses import dataclass
 from enum import Enum
@@ -22,14 +23,88 @@ class NMTCDocumentType(str, Enum):
     UNKNOWN = "unknown"
 
 
-@dataclass
+_WHITESPACE = re.compile(r'\s+')
+
+
+def extract_context(text_content: str, start: int, end: int, context_size: int = 100) -> str:
+    """Whitespace-normalized text around a match, with ellipses where it was cut"""
+    context_start = max(0, start - context_size)
+    context_end = min(len(text_content), end + context_size)
+    
+    context = _WHITESPACE.sub(' ', text_content[context_start:context_end]).strip()
+    
+    if context_start > 0:
+        context = "..." + context
+    if context_end < len(text_content):
+        context = context + "..."
+    
+    return context
+
+
 class PatternMatch:
-    """Represents a pattern match with confidence"""
-    pattern_type: str
-    match_text: str
-    confidence: float
-    location: str  # Where in document the match was found
-    context: str   # Surrounding text for context
+    """
+    Represents a pattern match with confidence
+    
+    Scoring records only the pattern id and span; the matched text, location string and
+    surrounding context are cut from the document when first read.
+    """
+    __slots__ = ('pattern_type', 'confidence', 'pattern_id', 'start', 'end', '_text_content', '_match_text', '_context')
+    
+    def __init__(
+        self,
+        pattern_type: str,
+        confidence: float,
+        start: int,
+        end: int,
+        text_content: str,
+        pattern_id: Optional[int] = None
+    ):
+        self.pattern_type = pattern_type
+        self.confidence = confidence
+        self.pattern_id = pattern_id
+        self.start = start
+        self.end = end
+        self._text_content = text_content
+        self._match_text = None
+        self._context = None
+    
+    @property
+    def match_text(self) -> str:
+        if self._match_text is None:
+            self._match_text = self._text_content[self.start:self.end]
+        return self._match_text
+    
+    @property
+    def location(self) -> str:
+        """Where in document the match was found"""
+        return f"Position {self.start}-{self.end}"
+    
+    @property
+    def context(self) -> str:
+        """Surrounding text for context"""
+        if self._context is None:
+            self._context = extract_context(self._text_content, self.start, self.end)
+        return self._context
+    
+    def __getstate__(self):
+        # Pickle without the document (e.g. back from a detection worker process): the
+        # match text and context are cut from it now instead
+        return None, {
+            'pattern_type': self.pattern_type,
+            'confidence': self.confidence,
+            'pattern_id': self.pattern_id,
+            'start': self.start,
+            'end': self.end,
+            '_text_content': None,
+            '_match_text': self.match_text,
+            '_context': self.context
+        }
+    
+    def __repr__(self) -> str:
+        return (
+            f"PatternMatch(pattern_type={self.pattern_type!r}, match_text={self.match_text!r}, "
+            f"confidence={self.confidence!r}, location={self.location!r})"
+        )
 
 
 @dataclass
@@ -43,12 +118,213 @@ class DocumentTypeResult:
     reasoning: str
 
 
+# Non-ASCII characters that case-insensitive regex matching equates with an ASCII letter
+# but str.lower() does not map to it
+_CASE_FOLD = (('\u0130', 'i'), ('\u0131', 'i'), ('\u017f', 's'), ('\u212a', 'k'))
+
+# Chunk size for lowercasing non-ASCII text
+_FOLD_CHUNK_CHARS = 64 * 1024
+
+
+def fold_case(text_content: str) -> str:
+    """
+    Lowercased copy of the text for case-insensitive literal search
+
+    Lowercase ASCII literals occur in the folded text exactly where a case-insensitive
+    regex would match them, at the same offsets (the fold never changes the length).
+    """
+    if text_content.isascii():
+        return text_content.lower()
+
+    for char, replacement in _CASE_FOLD:
+        if char in text_content:
+            text_content = text_content.replace(char, replacement)
+    # str.lower() on non-ASCII text reserves several bytes per character; go chunk by chunk
+    return ''.join(
+        text_content[i:i + _FOLD_CHUNK_CHARS].lower()
+        for i in range(0, len(text_content), _FOLD_CHUNK_CHARS)
+    )
+
+
+def literal_anchor(pattern: str) -> Optional[str]:
+    """
+    Longest literal run that every match of a pattern must contain, lowercased
+
+    Only top-level literals count: groups, character classes, escapes like \\s and
+    optional characters end a run. Returns None for patterns with a top-level
+    alternation or no literal at all; those can't be prefiltered.
+    """
+    runs = []
+    current = ""
+    i = 0
+
+    while i < len(pattern):
+        char = pattern[i]
+        literal = None
+
+        if char == '\\' and i + 1 < len(pattern):
+            escaped = pattern[i + 1]
+            i += 2
+            if not escaped.isalnum():
+                literal = escaped
+        elif char == '(':
+            depth = 0
+            while i < len(pattern):
+                if pattern[i] == '\\':
+                    i += 1
+                elif pattern[i] == '(':
+                    depth += 1
+                elif pattern[i] == ')':
+                    depth -= 1
+                    if depth == 0:
+                        break
+                i += 1
+            i += 1
+        elif char == '[':
+            i += 2 if pattern[i + 1:i + 2] == ']' else 1
+            while i < len(pattern) and pattern[i] != ']':
+                i += 2 if pattern[i] == '\\' else 1
+            i += 1
+        elif char == '{':
+            i = pattern.find('}', i) + 1 or len(pattern)
+        elif char == '|':
+            return None
+        elif char in '.^$*+?':
+            i += 1
+        else:
+            literal = char
+            i += 1
+
+        quantifier = pattern[i] if i < len(pattern) else ""
+        if literal is not None and quantifier not in ('*', '?', '{'):
+            current += literal
+            if quantifier != '+':
+                continue
+        if current:
+            runs.append(current)
+        current = ""
+
+    if current:
+        runs.append(current)
+    if not runs:
+        return None
+    return max(runs, key=len).lower()
+
+
+class CombinedPatternMatcher:
+    """
+    One matching engine over the patterns of every document type
+
+    Each distinct pattern is compiled and run once per text, however many
+    (doc_type, category) pairs own it. A pattern only runs when its literal anchor
+    occurs in the text; anchors are checked against a single case-folded copy of it.
+    """
+
+    def __init__(self, document_patterns: Dict[NMTCDocumentType, Dict[str, List[str]]]):
+        self.document_patterns = document_patterns
+        self.patterns: List[re.Pattern] = []
+        self.anchors: List[Optional[str]] = []
+        self.owners: Dict[NMTCDocumentType, Dict[str, List[int]]] = {}
+        pattern_ids: Dict[str, int] = {}
+
+        for doc_type, categories in document_patterns.items():
+            self.owners[doc_type] = {}
+            for category, pattern_list in categories.items():
+                ids = []
+                for pattern in pattern_list:
+                    if pattern not in pattern_ids:
+                        pattern_ids[pattern] = len(self.patterns)
+                        self.patterns.append(re.compile(pattern, re.IGNORECASE | re.MULTILINE))
+                        self.anchors.append(literal_anchor(pattern))
+                    ids.append(pattern_ids[pattern])
+                self.owners[doc_type][category] = ids
+
+    def candidate_ids(self, text_content: str, folded: Optional[str] = None) -> List[int]:
+        """Ids of the patterns whose anchor occurs in the text (or that have none)"""
+        if folded is None:
+            folded = fold_case(text_content)
+        present = {anchor: anchor in folded for anchor in set(self.anchors) if anchor}
+        return [
+            pattern_id for pattern_id, anchor in enumerate(self.anchors)
+            if anchor is None or present[anchor]
+        ]
+
+    def scan(self, text_content: str, folded: Optional[str] = None) -> Dict[int, List[Tuple[int, int]]]:
+        """(start, end) spans of every pattern that can occur in the text, keyed by pattern id"""
+        return {
+            pattern_id: [match.span() for match in self.patterns[pattern_id].finditer(text_content)]
+            for pattern_id in self.candidate_ids(text_content, folded)
+        }
+
+    def lazy_scan(self, text_content: str, folded: Optional[str] = None) -> 'LazyPatternHits':
+        """Like scan(), but each pattern only runs when its spans are first looked up"""
+        return LazyPatternHits(self, text_content, self.candidate_ids(text_content, folded))
+
+    def category_pattern_ids(self, doc_type: NMTCDocumentType) -> Dict[str, List[int]]:
+        """Pattern ids per category of a document type, in declaration order"""
+        return self.owners.get(doc_type, {})
+
+    def __reduce__(self):
+        # Pickles as its pattern source; unpickling compiles at most once per process
+        return compile_matcher, (self.document_patterns,)
+
+
+# Compiled matchers by pattern set, most recently used last
+_compiled_matchers: 'OrderedDict[Tuple, CombinedPatternMatcher]' = OrderedDict()
+MAX_COMPILED_MATCHERS = 32
+
+
+def compile_matcher(document_patterns: Dict[NMTCDocumentType, Dict[str, List[str]]]) -> CombinedPatternMatcher:
+    """CombinedPatternMatcher for a pattern set, reusing this process's matcher for an identical set"""
+    key = tuple(
+        (doc_type, tuple((category, tuple(pattern_list)) for category, pattern_list in categories.items()))
+        for doc_type, categories in document_patterns.items()
+    )
+    matcher = _compiled_matchers.get(key)
+    if matcher is None:
+        matcher = CombinedPatternMatcher(document_patterns)
+        _compiled_matchers[key] = matcher
+        while len(_compiled_matchers) > MAX_COMPILED_MATCHERS:
+            _compiled_matchers.popitem(last=False)
+    else:
+        _compiled_matchers.move_to_end(key)
+    return matcher
+
+
+class LazyPatternHits:
+    """Pattern spans for one text, computed on first lookup; a drop-in for scan()'s dict"""
+
+    def __init__(self, matcher: CombinedPatternMatcher, text_content: str, candidate_ids: List[int]):
+        self._matcher = matcher
+        self._text_content = text_content
+        self._candidates = set(candidate_ids)
+        self._spans: Dict[int, List[Tuple[int, int]]] = {}
+
+    def may_match(self, pattern_id: int) -> bool:
+        """False when the pattern's anchor is absent, so it has no hits"""
+        return pattern_id in self._candidates
+
+    def get(self, pattern_id: int, default: Optional[List[Tuple[int, int]]] = None) -> Optional[List[Tuple[int, int]]]:
+        if pattern_id not in self._candidates:
+            return default
+        if pattern_id not in self._spans:
+            self._spans[pattern_id] = [
+                match.span() for match in self._matcher.patterns[pattern_id].finditer(self._text_content)
+            ]
+        return self._spans[pattern_id]
+
+    @property
+    def patterns_run(self) -> int:
+        return len(self._spans)
+
+
 class NMTCPatterns:
     """NMTC document identification patterns"""
     
     def __init__(self):
         # Compile regex patterns for efficiency
         self._compile_patterns()
+        self._matcher = None
     
     def _compile_patterns(self):
         """Compile all regex patterns for better performance"""
@@ -68,7 +344,9 @@ class NMTCPatterns:
                         pattern_list, re.IGNORECASE | re.MULTILINE
                     )
     
-    # Document identification patterns
+    # Document identification patterns. Bridges between terms and runs that could backtrack
+    # are written in bounded-window form (app.utils.regex_safety); check_regex_safety.py
+    # times every pattern here, and in the tables below, against adversarial input
     DOCUMENT_PATTERNS = {
         NMTCDocumentType.ALLOCATION_AGREEMENT: {
             'title_patterns': [
@@ -91,7 +369,7 @@ class NMTCPatterns:
             'structural_patterns': [
                 r'section\s+\d+(\.\d+)*\.\s*qualified\s+equity\s+investment',
                 r'schedule\s+[a-zA-Z]\s*-\s*allocation\s+details',
-                r'exhibit\s+[a-zA-Z]\s*-.*allocation',
+                r'exhibit\s+[a-zA-Z]\s*-.{0,200}allocation',
                 r'compliance\s+period\s+begins',
                 r'initial\s+investment\s+date'
             ]
@@ -108,8 +386,8 @@ class NMTCPatterns:
                 r'qualified\s+active\s+low-income\s+community\s+business',
                 r'qalicb',
                 r'substantially\s+all\s+test',
-                r'70%.*income\s+test',
-                r'40%.*property\s+test',
+                r'70%.{0,200}income\s+test',
+                r'40%.{0,200}property\s+test',
                 r'qualified\s+low-income\s+community\s+investment',
                 r'qlici',
                 r'loan\s+principal',
@@ -117,12 +395,12 @@ class NMTCPatterns:
                 r'maturity\s+date'
             ],
             'financial_patterns': [
-                r'\$[\d,]+\.?\d*\s+principal\s+amount',
-                r'\d+(\.\d+)?%\s+per\s+annum',
-                r'interest.*rate.*\d+(\.\d+)?%',
-                r'loan\s+amount.*\$[\d,]+',
-                r'principal.*\$[\d,]+',
-                r'maturity.*\d{1,2}/\d{1,2}/\d{4}'
+                r'\$[\d,]{1,200}\.?\d{0,200}\s+principal\s+amount',
+                r'(?<!\d)\d+(\.\d+)?%\s+per\s+annum',
+                r'interest.{0,200}rate.{0,200}\d+(\.\d+)?%',
+                r'loan\s+amount.{0,200}\$[\d,]+',
+                r'principal.{0,200}\$[\d,]+',
+                r'maturity.{0,200}\d{1,2}/\d{1,2}/\d{4}'
             ]
         },
         
@@ -141,8 +419,8 @@ class NMTCPatterns:
                 r'median\s+family\s+income',
                 r'poverty\s+rate',
                 r'qualifying\s+business\s+activities',
-                r'40%.*property\s+test',
-                r'70%.*income\s+test'
+                r'40%.{0,200}property\s+test',
+                r'70%.{0,200}income\s+test'
             ],
             'certification_patterns': [
                 r'hereby\s+certifies?\s+that',
@@ -168,7 +446,7 @@ class NMTCPatterns:
                 r'affordable\s+housing',
                 r'community\s+impact',
                 r'local\s+procurement',
-                r'minority.*business\s+enterprise',
+                r'minority.{0,200}business\s+enterprise',
                 r'disadvantaged\s+business\s+enterprise'
             ],
             'commitment_patterns': [
@@ -214,7 +492,7 @@ class NMTCPatterns:
                 r'audited\s+financial\s+statements?',
                 r'balance\s+sheet',
                 r'income\s+statement',
-                r'statement\s+of.*operations',
+                r'statement\s+of.{0,200}operations',
                 r'cash\s+flow\s+statement'
             ],
             'key_terms': [
@@ -230,10 +508,10 @@ class NMTCPatterns:
                 r'investing\s+activities'
             ],
             'financial_patterns': [
-                r'\$\s*[\d,]+\.?\d*\s*\(\d+\)',  # Financial amounts
-                r'total\s+assets.*\$[\d,]+',
-                r'total\s+liabilities.*\$[\d,]+',
-                r'net\s+income.*\$[\d,]+',
+                r'\$\s*[\d,]{1,200}\.?\d{0,200}\s*\(\d{1,200}\)',  # Financial amounts
+                r'total\s+assets.{0,200}\$[\d,]+',
+                r'total\s+liabilities.{0,200}\$[\d,]+',
+                r'net\s+income.{0,200}\$[\d,]+',
                 r'for\s+the\s+years?\s+ended',
                 r'december\s+31,\s+\d{4}'
             ]
@@ -282,10 +560,10 @@ class NMTCPatterns:
                 r'deductible'
             ],
             'insurance_patterns': [
-                r'policy\s+#?\s*[\w\d-]+',
-                r'limits?.*\$[\d,]+',
-                r'effective.*\d{1,2}/\d{1,2}/\d{4}',
-                r'expires?.*\d{1,2}/\d{1,2}/\d{4}'
+                r'policy\s{1,200}#?\s{0,200}[\w\d-]+',
+                r'limits?.{0,200}\$[\d,]+',
+                r'effective.{0,200}\d{1,2}/\d{1,2}/\d{4}',
+                r'expires?.{0,200}\d{1,2}/\d{1,2}/\d{4}'
             ]
         }
     }
@@ -300,9 +578,30 @@ class NMTCPatterns:
         'commitment_patterns': 0.15,
         'reporting_patterns': 0.15,
         'legal_patterns': 0.15,
-        'insurance_patterns': 0.15
+        'insurance_patterns': 0.15,
+        'section_anchors': 0.2      # Section anchors from the sections table
+    }
+    
+    # Match confidence multipliers by pattern category (others count 1.0)
+    CATEGORY_MULTIPLIERS = {
+        'title_patterns': 1.2,
+        'key_terms': 1.0,
+        'structural_patterns': 0.9,
+        'financial_patterns': 0.8,
+        'certification_patterns': 0.9,
+        'commitment_patterns': 0.8,
+        'reporting_patterns': 0.8,
+        'legal_patterns': 0.8,
+        'insurance_patterns': 0.8,
+        'section_anchors': 0.9
     }
     
+    # Characters scanned for title patterns to decide which types tiered detection scores first
+    PREFIX_SCAN_CHARS = 5000
+    
+    # Matches kept as indicators per pattern category (the best ones; scoring uses all)
+    MAX_INDICATORS_PER_CATEGORY = 10
+    
     # Minimum confidence thresholds
     MIN_CONFIDENCE_THRESHOLDS = {
         'high_confidence': 0.7,    # Very confident in classification
@@ -314,6 +613,13 @@ class NMTCPatterns:
         """Get compiled patterns for a specific document type"""
         return self.compiled_patterns.get(doc_type, {})
     
+    @property
+    def matcher(self) -> CombinedPatternMatcher:
+        """Combined matcher over all document type patterns, built on first use"""
+        if self._matcher is None:
+            self._matcher = compile_matcher(self.DOCUMENT_PATTERNS)
+        return self._matcher
+    
     def get_all_document_types(self) -> List[NMTCDocumentType]:
         """Get all supported document types"""
         return [doc_type for doc_type in NMTCDocumentType if doc_type != NMTCDocumentType.UNKNOWN]
@@ -344,17 +650,17 @@ NMTC_KEY_FIELDS = {
         'patterns': [
             r'interest\s+rate[:\s]*([\d.]+)%',
             r'(\d{1,2}(?:\.\d+)?)%\s+per\s+annum',
-            r'substantially\s+all.*(\d{1,2})%'
+            r'substantially\s+all.{0,200}(\d{1,2})%'
         ],
         'field_type': 'percentage'
     },
     
     'entities': {
         'patterns': [
-            r'(?:cde|community\s+development\s+entity)[:\s]*([A-Z].*?)(?:\n|$)',
-            r'(?:qalicb|qualified.*business)[:\s]*([A-Z].*?)(?:\n|$)',
-            r'(?:borrower|maker)[:\s]*([A-Z].*?)(?:\n|$)',
-            r'(?:lender|payee)[:\s]*([A-Z].*?)(?:\n|$)'
+            r'(?:cde|community\s+development\s+entity)[:\s]*([A-Z].{0,200}?)(?:\n|$)',
+            r'(?:qalicb|qualified.{0,200}business)[:\s]*([A-Z].{0,200}?)(?:\n|$)',
+            r'(?:borrower|maker)[:\s]*([A-Z].{0,200}?)(?:\n|$)',
+            r'(?:lender|payee)[:\s]*([A-Z].{0,200}?)(?:\n|$)'
         ],
         'field_type': 'entity'
     },
@@ -374,10 +680,10 @@ NMTC_KEY_FIELDS = {
 DOCUMENT_STRUCTURE_INDICATORS = {
     'has_schedules': r'schedule\s+[a-zA-Z]\s*[-:]',
     'has_exhibits': r'exhibit\s+[a-zA-Z]\s*[-:]',
-    'has_signatures': r'(?:signature|signed|executed).*(?:date|this)',
+    'has_signatures': r'(?:signature|signed|executed).{0,200}(?:date|this)',
     'has_notarization': r'notary\s+public|acknowledged\s+before\s+me',
-    'has_witness': r'witness.*signature|in\s+the\s+presence\s+of',
-    'has_financial_tables': r'(?:total|subtotal).*\$[\d,]+\.?\d*',
+    'has_witness': r'witness.{0,200}signature|in\s+the\s+presence\s+of',
+    'has_financial_tables': r'(?:total|subtotal).{0,200}\$[\d,]+\.?\d*',
     'has_legal_disclaimers': r'(?:disclaimer|limitation\s+of\s+liability)',
     'multi_party': r'(?:party|parties)\s+(?:of\s+the\s+)?(?:first|second|third)\s+part'
 }
@@ -403,6 +709,186 @@ COMPLIANCE_TERMS = {
 }
 
 
+# Type-specific presence checks, reported in the metadata under one key per document type
+DOCUMENT_TYPE_CHECKS = {
+    NMTCDocumentType.ALLOCATION_AGREEMENT: ('allocation_specific', {
+        'has_qei_amount': r'qei.{0,200}?amount',
+        'has_compliance_period': r'7.{0,200}?year.{0,200}?compliance',
+        'has_recapture_terms': r'recapture',
+        'mentions_cdfi_fund': r'cdfi.{0,200}?fund'
+    }),
+    NMTCDocumentType.QLICI_LOAN: ('loan_specific', {
+        'has_principal_amount': r'principal.{0,200}?amount',
+        'has_interest_rate': r'interest.{0,200}?rate',
+        'has_maturity_date': r'maturity.{0,200}?date',
+        'mentions_qalicb_tests': r'(?:70%|40%).{0,200}?test',
+        'has_security_provisions': r'security|collateral'
+    }),
+    NMTCDocumentType.QALICB_CERTIFICATION: ('certification_specific', {
+        'has_census_tract': r'census.{0,200}?tract',
+        'mentions_income_test': r'70%.{0,200}?income',
+        'mentions_property_test': r'40%.{0,200}?property',
+        'has_certification_period': r'certification.{0,200}?period',
+        'mentions_substantially_all': r'substantially.{0,200}?all'
+    }),
+    NMTCDocumentType.FINANCIAL_STATEMENT: ('financial_specific', {
+        'has_balance_sheet': r'balance.{0,200}?sheet',
+        'has_income_statement': r'income.{0,200}?statement',
+        'has_cash_flow': r'cash.{0,200}?flow',
+        'has_audit_opinion': r'(?:audit|opinion|independent)',
+        'mentions_fiscal_year': r'(?:fiscal.{0,200}?year|year.{0,200}?ended)'
+    })
+}
+
+
+class LiteralTermMatcher:
+    """
+    Case-insensitive search for many literal terms in one pass over the text
+
+    All terms are merged into a single alternation that is tried at every offset of the
+    case-folded text. Per term it reports the same non-overlapping occurrences as running
+    re.finditer(re.escape(term), text, re.IGNORECASE) for each term separately.
+    """
+
+    def __init__(self, terms: List[str]):
+        # Longest first, so a hit is the longest term starting at that offset
+        self.terms = sorted({term.lower() for term in terms}, key=len, reverse=True)
+        self.regex = re.compile('(?=(%s))' % '|'.join(re.escape(term) for term in self.terms))
+        # Shorter terms that are prefixes of a hit occur at the same offset
+        self._prefixes = {
+            term: [other for other in self.terms if other != term and term.startswith(other)]
+            for term in self.terms
+        }
+
+    def find(self, folded: str) -> Dict[str, List[int]]:
+        """Start offsets of each term found, keyed by lowercased term; takes fold_case() text"""
+        positions: Dict[str, List[int]] = {}
+        next_start: Dict[str, int] = {}
+
+        for match in self.regex.finditer(folded):
+            start = match.start()
+            hit = match.group(1)
+            for term in (hit, *self._prefixes[hit]):
+                if start >= next_start.get(term, 0):
+                    positions.setdefault(term, []).append(start)
+                    next_start[term] = start + len(term)
+
+        return positions
+
+
+class MetadataPatternBank:
+    """
+    Key field, structure indicator, compliance term and type-specific patterns, compiled once
+
+    Regexes are skipped when their literal anchor is absent, and
+    the compliance terms are matched together in a single pass. Pass the fold_case() copy
+    of the text to share it across extractors.
+    """
+
+    FLAGS = re.IGNORECASE | re.MULTILINE
+
+    def __init__(self):
+        self.key_fields = {
+            field_category: [
+                (re.compile(pattern, self.FLAGS), literal_anchor(pattern))
+                for pattern in field_config['patterns']
+            ]
+            for field_category, field_config in NMTC_KEY_FIELDS.items()
+        }
+        self.structure_indicators = {
+            indicator_name: (re.compile(pattern, self.FLAGS), literal_anchor(pattern))
+            for indicator_name, pattern in DOCUMENT_STRUCTURE_INDICATORS.items()
+        }
+        self.compliance_terms = LiteralTermMatcher(
+            [term for terms in COMPLIANCE_TERMS.values() for term in terms]
+        )
+        self.type_checks = {
+            doc_type: (metadata_key, {
+                check_name: (re.compile(pattern, re.IGNORECASE), literal_anchor(pattern))
+                for check_name, pattern in checks.items()
+            })
+            for doc_type, (metadata_key, checks) in DOCUMENT_TYPE_CHECKS.items()
+        }
+
+    @staticmethod
+    def _may_match(anchor: Optional[str], folded: str) -> bool:
+        return anchor is None or anchor in folded
+
+    def extract_key_fields(self, text_content: str, folded: Optional[str] = None) -> Dict[str, List[str]]:
+        """Distinct values captured by each key field category, in order of first occurrence"""
+        if folded is None:
+            folded = fold_case(text_content)
+
+        extracted_fields = {}
+        for field_category, patterns in self.key_fields.items():
+            field_matches = []
+
+            for pattern, anchor in patterns:
+                if not self._may_match(anchor, folded):
+                    continue
+                matches = (match.strip() for match in pattern.findall(text_content))
+                field_matches.extend(dict.fromkeys(match for match in matches if match))
+
+            if field_matches:
+                extracted_fields[field_category] = field_matches
+
+        return extracted_fields
+
+    def check_structure(self, text_content: str, folded: Optional[str] = None) -> Dict[str, bool]:
+        """Which document structure indicators are present"""
+        if folded is None:
+            folded = fold_case(text_content)
+
+        return {
+            indicator_name: self._may_match(anchor, folded) and bool(pattern.search(text_content))
+            for indicator_name, (pattern, anchor) in self.structure_indicators.items()
+        }
+
+    def find_compliance_terms(self, text_content: str, folded: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Compliance terms found, with occurrence counts and offsets, in COMPLIANCE_TERMS order"""
+        if folded is None:
+            folded = fold_case(text_content)
+
+        positions = self.compliance_terms.find(folded)
+        found_terms = []
+        for category, terms in COMPLIANCE_TERMS.items():
+            for term in terms:
+                term_positions = positions.get(term.lower())
+                if term_positions:
+                    found_terms.append({
+                        "category": category,
+                        "term": term,
+                        "count": len(term_positions),
+                        "positions": term_positions
+                    })
+
+        return found_terms
+
+    def check_document_type(
+        self,
+        text_content: str,
+        doc_type: NMTCDocumentType,
+        folded: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Type-specific presence checks for a document type (empty for types without any)"""
+        if doc_type not in self.type_checks:
+            return {}
+        if folded is None:
+            folded = fold_case(text_content)
+
+        metadata_key, checks = self.type_checks[doc_type]
+        return {
+            metadata_key: {
+                check_name: self._may_match(anchor, folded) and bool(pattern.search(text_content))
+                for check_name, (pattern, anchor) in checks.items()
+            }
+        }
+
+
+# Shared pattern bank, compiled at import
+pattern_bank = MetadataPatternBank()
+
+
 def get_confidence_level_description(confidence: float) -> str:
     """Get human-readable confidence level description"""
     patterns = NMTCPatterns()
@@ -0,0 +1,66 @@
+"""
+Guards against super-linear regex behaviour in the detection patterns.
+Patterns whose repetitions can backtrack super-linearly (notably the .* bridges between
+terms) are written in bounded-window form, with those repetitions capped at
+BOUNDED_WINDOW characters, so the work per start offset is bounded and a scan stays
+linear in the text length. check_regex_safety.py times every pattern to keep it so.
+"""
+import re
+
+# Upper bound on a repetition written in bounded-window form
+BOUNDED_WINDOW = 200
+
+# {m}, {m,n}, {,n} or the unbounded {m,}
+_REPEAT = re.compile(r'\{(\d*)(,?)(\d*)\}')
+
+
+def bounded_pattern(pattern: str, window: int = BOUNDED_WINDOW) -> str:
+    """
+    Bounded-window form of a pattern: every unbounded repetition capped at window
+
+    .* becomes .{0,window}, \\s+ becomes \\s{1,window}, {m,} becomes {m,window}; lazy
+    and possessive suffixes are kept. Matches are unchanged unless a repeated run is
+    longer than the window.
+    """
+    out = []
+    i = 0
+    quantifiable = False
+
+    while i < len(pattern):
+        char = pattern[i]
+
+        if char == '\\':
+            out.append(pattern[i:i + 2])
+            i += 2
+            quantifiable = True
+        elif char == '[':
+            end = i + 1
+            if pattern[end:end + 1] == '^':
+                end += 1
+            if pattern[end:end + 1] == ']':
+                end += 1
+            while end < len(pattern) and pattern[end] != ']':
+                end += 2 if pattern[end] == '\\' else 1
+            out.append(pattern[i:end + 1])
+            i = end + 1
+            quantifiable = True
+        elif char in '*+' and quantifiable:
+            out.append('{%d,%d}' % (0 if char == '*' else 1, window))
+            i += 1
+            quantifiable = False
+        elif char == '{' and quantifiable and _REPEAT.match(pattern, i):
+            repeat = _REPEAT.match(pattern, i)
+            if repeat.group(2) and not repeat.group(3):
+                minimum = int(repeat.group(1) or 0)
+                out.append('{%d,%d}' % (minimum, max(minimum, window)))
+            else:
+                out.append(repeat.group(0))
+            i = repeat.end()
+            quantifiable = False
+        else:
+            out.append(char)
+            i += 1
+            # Nothing repeats an opening paren, an alternation or a quantifier
+            quantifiable = char not in '(|?^'
+
+    return ''.join(out)
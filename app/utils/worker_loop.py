@@ -0,0 +1,161 @@
+"""
+One long-lived asyncio event loop per Celery worker process.
+
+Tasks hand a whole pipeline to the loop as a single coroutine, so independent steps can
+be awaited together, and clients bound to the loop (connection pools, locks) survive
+from one task to the next instead of being rebuilt per call.
+
+Under the prefork and solo pools the loop is driven from the process's main thread with
+run_until_complete. Under the threads pool, and under the gevent and eventlet pools used
+for I/O-bound OCR work, many tasks run at once in one process; there the loop runs
+forever in its own native thread, tasks submit coroutines to it, and a green task waits
+for its result on the pool's native thread pool so other greenlets keep running:
+    celery -A app.tasks.document_tasks worker -P gevent -c 100
+"""
+from typing import Any, Awaitable, Callable, Optional
+import asyncio
+import logging
+import os
+import sys
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Longest close() waits for outstanding coroutines to finish cancelling
+SHUTDOWN_TIMEOUT_SECONDS = 5.0
+
+
+def green_pool() -> Optional[str]:
+    """'gevent' or 'eventlet' when the process is monkey-patched by one, else None"""
+    gevent_monkey = sys.modules.get("gevent.monkey")
+    if gevent_monkey and gevent_monkey.is_module_patched("socket"):
+        return "gevent"
+    eventlet_patcher = sys.modules.get("eventlet.patcher")
+    if eventlet_patcher and eventlet_patcher.is_monkey_patched("socket"):
+        return "eventlet"
+    return None
+
+
+def _start_native_thread(target: Callable[[], None]) -> None:
+    # A monkey-patched threading.Thread would be a greenlet, and the loop would stall the hub
+    pool = green_pool()
+    if pool == "gevent":
+        from gevent.monkey import get_original
+        get_original("_thread", "start_new_thread")(target, ())
+    elif pool == "eventlet":
+        from eventlet.patcher import original
+        original("_thread").start_new_thread(target, ())
+    else:
+        threading.Thread(target=target, name="worker-event-loop", daemon=True).start()
+
+
+def _wait_green(future) -> Any:
+    """Result of a concurrent future, blocking only the calling greenlet"""
+    pool = green_pool()
+    if pool == "gevent":
+        import gevent
+        return gevent.get_hub().threadpool.apply(future.result)
+    if pool == "eventlet":
+        from eventlet import tpool
+        return tpool.execute(future.result)
+    return future.result()
+
+
+class WorkerEventLoop:
+    """
+    The event loop of the current worker process
+
+    Created on first use and again after a fork, so prefork children never drive the
+    parent's loop.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None  # Driven by the main thread
+        self._thread_loop: Optional[asyncio.AbstractEventLoop] = None  # Running in its own thread
+
+    def _reset_after_fork(self) -> None:
+        if self._pid != os.getpid():
+            # The parent's loops (and the thread running one) don't exist in this process
+            self._lock = threading.Lock()
+            self._loop = None
+            self._thread_loop = None
+            self._pid = os.getpid()
+
+    def _main_loop(self) -> asyncio.AbstractEventLoop:
+        if self._loop is None or self._loop.is_closed():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            logger.info(f"Started worker event loop in process {self._pid}")
+        return self._loop
+
+    def _threaded_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._thread_loop is None or self._thread_loop.is_closed():
+                loop = asyncio.new_event_loop()
+
+                def run_forever():
+                    asyncio.set_event_loop(loop)
+                    try:
+                        loop.run_forever()
+                    finally:
+                        loop.close()
+
+                # Coroutines submitted before the thread gets going wait in the loop's queue
+                _start_native_thread(run_forever)
+                self._thread_loop = loop
+                logger.info(f"Started worker event loop thread in process {self._pid} ({green_pool() or 'threads'})")
+            return self._thread_loop
+
+    def run(self, coro: Awaitable[Any]) -> Any:
+        """Run a coroutine to completion on this process's loop and return its result"""
+        self._reset_after_fork()
+
+        if green_pool() is None and threading.current_thread() is threading.main_thread():
+            return self._main_loop().run_until_complete(coro)
+
+        future = asyncio.run_coroutine_threadsafe(coro, self._threaded_loop())
+        return _wait_green(future)
+
+    def close(self) -> None:
+        """Cancel outstanding work and close the loops (at worker process shutdown)"""
+        if self._pid != os.getpid():
+            return
+
+        if self._loop is not None and not self._loop.is_closed() and not self._loop.is_running():
+            _shutdown(self._loop)
+            self._loop.close()
+
+        if self._thread_loop is not None and not self._thread_loop.is_closed():
+            loop = self._thread_loop
+            try:
+                asyncio.run_coroutine_threadsafe(_shutdown_async(loop), loop).result(2 * SHUTDOWN_TIMEOUT_SECONDS)
+            except Exception as e:
+                logger.warning(f"Worker event loop did not shut down cleanly: {e}")
+            loop.call_soon_threadsafe(loop.stop)
+
+        self._loop = None
+        self._thread_loop = None
+
+
+async def _shutdown_async(loop: asyncio.AbstractEventLoop) -> None:
+    current = asyncio.current_task()
+    pending = [task for task in asyncio.all_tasks(loop) if task is not current]
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.wait(pending, timeout=SHUTDOWN_TIMEOUT_SECONDS)
+    await loop.shutdown_asyncgens()
+    await loop.shutdown_default_executor()
+
+
+def _shutdown(loop: asyncio.AbstractEventLoop) -> None:
+    try:
+        loop.run_until_complete(_shutdown_async(loop))
+    except Exception as e:
+        logger.warning(f"Worker event loop did not shut down cleanly: {e}")
+
+
+# Global instance
+worker_loop = WorkerEventLoop()
@@ -0,0 +1,7 @@
+"""
+Benchmarks for NMTC document type detection
+
+corpus.py generates synthetic NMTC-like documents and adversarial texts;
+detection_benchmark.py times detection against them and compares runs:
+    python -m benchmarks.detection_benchmark --output results.json [--baseline baseline.json]
+"""
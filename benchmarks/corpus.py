@@ -0,0 +1,196 @@
+"""
+Synthetic NMTC-like documents for benchmarking detection
+Documents are assembled from per-type title and body phrases, shared legal filler and
+key field lines (dates, amounts, rates, census tracts), seeded so a corpus is the same
+on every run. Adversarial texts target the shapes that make patterns backtrack.
+"""
+import random
+import re
+from typing import Dict, List
+
+from app.utils.nmtc_patterns import NMTCDocumentType
+
+TYPE_CONTENT = {
+    NMTCDocumentType.ALLOCATION_AGREEMENT: {
+        "titles": ["NEW MARKETS TAX CREDIT ALLOCATION AGREEMENT", "NMTC Allocation Agreement"],
+        "phrases": [
+            "Section {section}. Qualified Equity Investment. The Allocatee shall issue each QEI within the period required by the CDFI Fund.",
+            "The QEI amount designated under this Agreement shall not exceed the allocation amount of {amount}.",
+            "Schedule {letter} - Allocation Details for the CDE allocation described herein.",
+            "Exhibit {letter} - Form of notice of allocation and service area certification.",
+            "The 7 year compliance period begins on the Initial Investment Date of {date}.",
+            "A recapture event occurs if the CDE fails to invest substantially all of the proceeds in a qualified low-income community investment (QLICI).",
+        ],
+    },
+    NMTCDocumentType.QLICI_LOAN: {
+        "titles": ["QUALIFIED LOW-INCOME COMMUNITY INVESTMENT LOAN AGREEMENT", "QLICI Loan and Security Agreement"],
+        "phrases": [
+            "Borrower represents that it is a qualified active low-income community business (QALICB) and satisfies the substantially all test.",
+            "At least 70% of gross income is derived from the active conduct of business, satisfying the 70% gross income test.",
+            "At least 40% of tangible property is located in the low-income community, satisfying the 40% property test.",
+            "The loan amount of {amount} bears interest at a rate of {rate}% per annum.",
+            "Loan principal of {amount} principal amount is due on the maturity date of {date}.",
+            "Interest rate adjustments apply at {rate}% on each payment date.",
+        ],
+    },
+    NMTCDocumentType.QALICB_CERTIFICATION: {
+        "titles": ["QALICB CERTIFICATION", "Qualified Active Low-Income Community Business Certification"],
+        "phrases": [
+            "The undersigned hereby certifies that the Business is a qualified business under Section 45D.",
+            "The Business is located in census tract {tract}, which has a poverty rate of {rate}% and median family income below 80%.",
+            "This certification shall remain in effect for the certification period ending {date}.",
+            "Qualifying business activities are conducted within the low-income community.",
+            "The effective date of certification is {date}; the certification is valid for one year.",
+        ],
+    },
+    NMTCDocumentType.COMMUNITY_BENEFITS_AGREEMENT: {
+        "titles": ["COMMUNITY BENEFITS AGREEMENT", "Community Impact Agreement"],
+        "phrases": [
+            "The Developer agrees to provide community benefits including local hiring and job creation.",
+            "The Project commits to a minimum of {pct}% local procurement and a target of {pct}% minority business enterprise participation.",
+            "The Developer shall ensure workforce development programs are offered to residents.",
+            "The Project shall hire at least {count} residents of the service area.",
+            "Affordable housing and community impact commitments are described in Exhibit {letter}.",
+        ],
+    },
+    NMTCDocumentType.ANNUAL_COMPLIANCE_REPORT: {
+        "titles": ["ANNUAL COMPLIANCE REPORT", "NMTC Compliance Monitoring Report"],
+        "phrases": [
+            "For the year ended {long_date}, the CDE remained in compliance with the substantially all test.",
+            "Reporting period: {date} through {date}. Compliance status: in compliance.",
+            "Community impact metrics: {count} jobs created and {count} jobs retained as of {long_date}.",
+            "QALICB status was confirmed through annual certification; no recapture event or non-compliance occurred.",
+            "Qualified equity investments outstanding during the compliance period total {amount}.",
+        ],
+    },
+    NMTCDocumentType.FINANCIAL_STATEMENT: {
+        "titles": ["AUDITED FINANCIAL STATEMENTS", "Balance Sheet and Statement of Operations"],
+        "phrases": [
+            "Total assets {amount} Total liabilities {amount} Net income {amount}",
+            "Cash flows from operating activities, investing activities and financing activities for the years ended December 31, {year}.",
+            "Revenue {amount} Expenses {amount} Equity {amount}",
+            "Depreciation {amount} (2) Interest expense {amount} (3)",
+            "See accompanying notes to the financial statements as of December 31, {year}.",
+        ],
+    },
+    NMTCDocumentType.PROMISSORY_NOTE: {
+        "titles": ["PROMISSORY NOTE", "Secured Promissory Note"],
+        "phrases": [
+            "FOR VALUE RECEIVED, the undersigned maker hereby promises to pay to the order of the payee the principal sum of {amount}.",
+            "Payment terms: monthly installments with interest at {rate}% per annum until the maturity date of {date}.",
+            "Upon an event of default the holder may declare acceleration of all amounts due on demand or otherwise.",
+            "This Note is secured by collateral described in the security agreement.",
+        ],
+    },
+    NMTCDocumentType.INSURANCE_DOCUMENT: {
+        "titles": ["CERTIFICATE OF INSURANCE", "Evidence of Insurance"],
+        "phrases": [
+            "Insured: Community Facility LLC. Insurer: Mutual Assurance Co. Policy number {policy}.",
+            "Policy # {policy} coverage limits {amount} per occurrence, deductible {amount}.",
+            "Effective date {date}; expiration date {date}. Annual premium {amount}.",
+            "Limits of liability {amount} aggregate; policy expires {date}.",
+        ],
+    },
+}
+
+# Boilerplate shared by every document type
+FILLER = [
+    "IN WITNESS WHEREOF, the parties have executed this instrument as of the date first written above.",
+    "Capitalized terms used but not defined herein have the meanings given in the Operating Agreement.",
+    "Notices shall be delivered by certified mail, return receipt requested, to the addresses set forth below.",
+    "This instrument shall be governed by the laws of the State in which the Project is located.",
+    "Each party shall bear its own costs and expenses in connection with the transactions contemplated hereby.",
+    "No amendment or waiver of any provision hereof shall be effective unless in writing and signed by the parties.",
+    "The obligations hereunder are binding upon and inure to the benefit of successors and permitted assigns.",
+    "If any provision is held invalid, the remaining provisions shall continue in full force and effect.",
+]
+
+MONTHS = ["January", "February", "March", "April", "May", "June", "July",
+          "August", "September", "October", "November", "December"]
+
+_SIZE = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([KMG]?)B?\s*$', re.IGNORECASE)
+
+
+def parse_size(size: str) -> int:
+    """Bytes in a size such as 1K, 512KB, 20M or 1048576"""
+    match = _SIZE.match(size)
+    if not match:
+        raise ValueError(f"Invalid size: {size!r}")
+    number, unit = match.groups()
+    return int(float(number) * {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}[unit.upper()])
+
+
+def format_size(size: int) -> str:
+    for unit, factor in (("M", 1024 ** 2), ("K", 1024)):
+        if size >= factor and size % factor == 0:
+            return f"{size // factor}{unit}"
+    return str(size)
+
+
+def _fill(template: str, rng: random.Random) -> str:
+    values = {
+        "amount": lambda: f"${rng.randint(10_000, 50_000_000):,}.00",
+        "rate": lambda: f"{rng.randint(1, 9)}.{rng.randint(0, 99):02d}",
+        "pct": lambda: str(rng.randint(5, 60)),
+        "count": lambda: str(rng.randint(3, 400)),
+        "date": lambda: f"{rng.randint(1, 12):02d}/{rng.randint(1, 28):02d}/{rng.randint(2015, 2035)}",
+        "long_date": lambda: f"{rng.choice(MONTHS)} {rng.randint(1, 28)}, {rng.randint(2015, 2035)}",
+        "year": lambda: str(rng.randint(2015, 2035)),
+        "section": lambda: f"{rng.randint(1, 12)}.{rng.randint(1, 9)}",
+        "letter": lambda: rng.choice("ABCDEFGH"),
+        "tract": lambda: f"{rng.randint(1000, 9999)}.{rng.randint(0, 99):02d}",
+        "policy": lambda: f"CP-{rng.randint(100000, 999999)}",
+    }
+    return re.sub(r'\{(\w+)\}', lambda m: values[m.group(1)](), template)
+
+
+def generate_document(doc_type: NMTCDocumentType, size: int, seed: int = 0) -> str:
+    """
+    A synthetic document of the given type, size characters long (ASCII, so also bytes)
+    
+    About a third of the body is type-specific; the rest is shared boilerplate, as in
+    real closing documents.
+    """
+    rng = random.Random(f"{doc_type.value}:{size}:{seed}")
+    content = TYPE_CONTENT[doc_type]
+    lines = [rng.choice(content["titles"]), ""]
+    length = sum(len(line) + 1 for line in lines)
+    
+    while length < size:
+        paragraph = []
+        for _ in range(rng.randint(3, 8)):
+            source = content["phrases"] if rng.random() < 0.35 else FILLER
+            paragraph.append(_fill(rng.choice(source), rng))
+        line = " ".join(paragraph)
+        lines.extend([line, ""])
+        length += len(line) + 2
+    
+    return "\n".join(lines)[:size]
+
+
+def generate_corpus(sizes: List[int], seed: int = 0) -> Dict[int, Dict[NMTCDocumentType, str]]:
+    """One document of every type at every size"""
+    return {
+        size: {doc_type: generate_document(doc_type, size, seed) for doc_type in TYPE_CONTENT}
+        for size in sizes
+    }
+
+
+def _repeat_to(unit: str, size: int) -> str:
+    return (unit * (size // max(1, len(unit)) + 1))[:size]
+
+
+def adversarial_documents(size: int) -> Dict[str, str]:
+    """Texts aimed at the detection patterns' worst cases"""
+    return {
+        # Term prefixes of the .* bridged patterns with the closing term never arriving
+        "near_miss_line": _repeat_to("total assets interest rate 70% income limits effective policy ", size),
+        "digit_run": "$" + _repeat_to("1", size - 1),
+        "digit_comma_run": "principal $" + _repeat_to("1,", size - 11),
+        "whitespace_run": "allocation" + _repeat_to(" ", size - 10),
+        "single_line_document": _repeat_to(
+            generate_document(NMTCDocumentType.QLICI_LOAN, 16 * 1024).replace("\n", " "), size
+        ),
+        # Thousands of hits for the same short patterns
+        "boilerplate_hits": _repeat_to("premium policy # 123 insured deductible cba equity assets\n", size),
+    }
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Detection benchmark
+
+Times detect_document_type and _extract_metadata over a synthetic corpus (one document
+per NMTCDocumentType at each size) and adversarial texts, and every detection pattern
+on its own. Reports p50/p99 latency, MB/s, docs/s and peak memory, saves the results as
+JSON and, given a baseline from an earlier run, fails on regressions:
+    python -m benchmarks.detection_benchmark [--sizes 1K,64K,1M] [--repeats 5]
+        [--output results.json] [--baseline baseline.json] [--max-slowdown 0.25]
+"""
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Any, Callable, Dict, List
+
+from app.services.detection_service import detection_service
+from app.utils.nmtc_patterns import fold_case
+from benchmarks.corpus import adversarial_documents, format_size, generate_corpus, parse_size
+from check_regex_safety import collect_patterns
+
+MAX_SIZE = 20 * 1024 * 1024
+
+# Differences below these are noise, whatever the relative change
+NOISE_FLOOR_MS = 1.0
+NOISE_FLOOR_MB = 0.5
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered) + 0.5) - 1))]
+
+
+def peak_memory_mb(operation: Callable[[], Any]) -> float:
+    tracemalloc.start()
+    try:
+        operation()
+        return tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+    finally:
+        tracemalloc.stop()
+
+
+def time_operation(operation: Callable[[], Any], repeats: int) -> List[float]:
+    """Seconds per run, after one warm-up run"""
+    operation()
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        operation()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def summarize(latencies: List[float], total_bytes: int, documents: int, peak_mb: float) -> Dict[str, float]:
+    total_seconds = sum(latencies)
+    return {
+        "documents": documents,
+        "bytes": total_bytes,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000,
+        "docs_per_second": len(latencies) / total_seconds if total_seconds else 0.0,
+        "mb_per_second": total_bytes * len(latencies) / documents / (1024 * 1024) / total_seconds if total_seconds else 0.0,
+        "peak_memory_mb": peak_mb
+    }
+
+
+def bench_corpus(corpus, repeats: int) -> Dict[str, Dict[str, Dict[str, float]]]:
+    """detect_document_type and _extract_metadata over each size of the corpus"""
+    results = {"detection": {}, "metadata_extraction": {}}
+    
+    for size, documents in corpus.items():
+        label = format_size(size)
+        detect_latencies, metadata_latencies = [], []
+        detect_peak, metadata_peak = 0.0, 0.0
+        correct = 0
+        
+        for doc_type, text in documents.items():
+            detected = detection_service.detect_document_type(text).document_type
+            correct += detected == doc_type
+            folded = fold_case(text)
+            
+            def detect():
+                return detection_service.detect_document_type(text)
+            
+            def extract():
+                return detection_service._extract_metadata(text, doc_type, None, folded)
+            
+            detect_latencies += time_operation(detect, repeats)
+            metadata_latencies += time_operation(extract, repeats)
+            detect_peak = max(detect_peak, peak_memory_mb(detect))
+            metadata_peak = max(metadata_peak, peak_memory_mb(extract))
+        
+        total_bytes = sum(len(text) for text in documents.values())
+        results["detection"][label] = {
+            **summarize(detect_latencies, total_bytes, len(documents), detect_peak),
+            "accuracy": correct / len(documents)
+        }
+        results["metadata_extraction"][label] = summarize(metadata_latencies, total_bytes, len(documents), metadata_peak)
+        print(f"[*] {label:>6}: detect p50 {results['detection'][label]['p50_ms']:.1f}ms "
+              f"p99 {results['detection'][label]['p99_ms']:.1f}ms "
+              f"{results['detection'][label]['mb_per_second']:.2f} MB/s, "
+              f"metadata p50 {results['metadata_extraction'][label]['p50_ms']:.1f}ms, "
+              f"accuracy {correct}/{len(documents)}")
+    
+    return results
+
+
+def bench_adversarial(size: int, repeats: int) -> Dict[str, Dict[str, float]]:
+    results = {}
+    for family, text in adversarial_documents(size).items():
+        def detect():
+            return detection_service.detect_document_type(text)
+        results[family] = summarize(time_operation(detect, repeats), len(text), 1, peak_memory_mb(detect))
+        print(f"[*] adversarial {family}: p50 {results[family]['p50_ms']:.1f}ms")
+    return results
+
+
+def bench_patterns(text: str) -> Dict[str, Dict[str, Any]]:
+    """Seconds per pattern over one text, slowest first"""
+    results = {}
+    for source, pattern in collect_patterns():
+        started = time.perf_counter()
+        for _ in pattern.finditer(text):
+            pass
+        seconds = time.perf_counter() - started
+        entry = results.setdefault(pattern.pattern, {"sources": [], "seconds": seconds})
+        entry["sources"].append(source)
+        entry["seconds"] = min(entry["seconds"], seconds)
+    
+    for entry in results.values():
+        entry["ms"] = entry["seconds"] * 1000
+        entry["mb_per_second"] = len(text) / (1024 * 1024) / entry["seconds"] if entry["seconds"] else 0.0
+    return dict(sorted(results.items(), key=lambda item: -item[1]["seconds"]))
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], max_slowdown: float, max_memory_growth: float) -> List[str]:
+    """Regressions of results against baseline, as messages"""
+    failures = []
+    
+    def check(name: str, current: float, previous: float, allowed: float, floor: float, unit: str):
+        if current > previous * (1 + allowed) and current - previous > floor:
+            failures.append(f"{name}: {current:.2f}{unit} vs baseline {previous:.2f}{unit} "
+                            f"(+{(current / previous - 1) * 100 if previous else float('inf'):.0f}%, allowed {allowed * 100:.0f}%)")
+    
+    for section in ("detection", "metadata_extraction", "adversarial"):
+        for label, current in results.get(section, {}).items():
+            previous = baseline.get(section, {}).get(label)
+            if not previous:
+                continue
+            for metric in ("p50_ms", "p99_ms"):
+                check(f"{section}[{label}].{metric}", current[metric], previous[metric], max_slowdown, NOISE_FLOOR_MS, "ms")
+            check(f"{section}[{label}].peak_memory_mb", current["peak_memory_mb"], previous["peak_memory_mb"],
+                  max_memory_growth, NOISE_FLOOR_MB, "MB")
+            if current.get("accuracy", 1.0) < previous.get("accuracy", 0.0):
+                failures.append(f"{section}[{label}].accuracy: {current['accuracy']:.3f} vs baseline {previous['accuracy']:.3f}")
+    
+    for pattern, current in results.get("patterns", {}).items():
+        previous = baseline.get("patterns", {}).get(pattern)
+        if previous:
+            check(f"pattern {pattern!r}", current["ms"], previous["ms"], max_slowdown, 5 * NOISE_FLOOR_MS, "ms")
+    
+    return failures
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark NMTC document type detection")
+    parser.add_argument("--sizes", default="1K,64K,1M", help="Comma-separated document sizes (1K to 20M)")
+    parser.add_argument("--repeats", type=int, default=5, help="Timed runs per document")
+    parser.add_argument("--seed", type=int, default=0, help="Corpus seed")
+    parser.add_argument("--adversarial-size", default="256K", help="Size of each adversarial text")
+    parser.add_argument("--pattern-text-size", default="1M", help="Size of the text each pattern is timed on")
+    parser.add_argument("--skip-patterns", action="store_true", help="Don't time patterns individually")
+    parser.add_argument("--output", help="Write results to this JSON file")
+    parser.add_argument("--baseline", help="Compare against results saved by an earlier run")
+    parser.add_argument("--max-slowdown", type=float, default=0.25, help="Allowed latency growth over baseline")
+    parser.add_argument("--max-memory-growth", type=float, default=0.25, help="Allowed peak memory growth over baseline")
+    args = parser.parse_args()
+    
+    sizes = [parse_size(size) for size in args.sizes.split(",") if size.strip()]
+    if any(size < 1024 or size > MAX_SIZE for size in sizes):
+        parser.error("sizes must be between 1K and 20M")
+    
+    print("=" * 60)
+    print("DETECTION BENCHMARK")
+    print(f"Sizes {', '.join(format_size(size) for size in sizes)}, {args.repeats} runs each, seed {args.seed}")
+    print("=" * 60)
+    
+    corpus = generate_corpus(sizes, args.seed)
+    results = {
+        "meta": {
+            "created_at": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "sizes": [format_size(size) for size in sizes],
+            "repeats": args.repeats,
+            "seed": args.seed
+        },
+        **bench_corpus(corpus, args.repeats),
+        "adversarial": bench_adversarial(parse_size(args.adversarial_size), args.repeats)
+    }
+    
+    if not args.skip_patterns:
+        pattern_text_size = parse_size(args.pattern_text_size)
+        mixed = "\n".join(generate_corpus([max(1024, pattern_text_size // 8)], args.seed)[max(1024, pattern_text_size // 8)].values())
+        results["patterns"] = bench_patterns(mixed)
+        for pattern, entry in list(results["patterns"].items())[:5]:
+            print(f"[*] slowest pattern {pattern!r}: {entry['ms']:.1f}ms ({entry['mb_per_second']:.1f} MB/s)")
+    
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"[*] Results written to {args.output}")
+    
+    print("=" * 60)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        failures = compare(results, baseline, args.max_slowdown, args.max_memory_growth)
+        for failure in failures:
+            print(f"[-] {failure}")
+        if failures:
+            print(f"FAILED - {len(failures)} regressions against {args.baseline}")
+            return 1
+        print(f"PASSED - no regressions against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Regex safety check for the NMTC detection patterns
+
+Times every pattern detection compiles and runs against adversarial inputs (near-miss term
+chains on one long line, long digit and whitespace runs, newline-free documents) at two
+sizes and fails when any of them grows faster than linearly with the input, or runs past
+a per-run cap.
+
+Exits with status 1 on any regression so it can gate CI:
+    python check_regex_safety.py [--size 65536] [--factor 4] [--slack 2.5] [--json report.json]
+"""
+import argparse
+import json
+import re
+import signal
+import sys
+import time
+from contextlib import contextmanager
+
+from app.utils.nmtc_patterns import NMTCPatterns, CombinedPatternMatcher, pattern_bank
+
+# Timings below this are treated as noise when comparing sizes
+NOISE_FLOOR_SECONDS = 0.005
+
+# Cap on a single timed run; a pattern that runs past it fails the check
+RUN_CAP_SECONDS = 2.0
+
+
+class RunCapExceeded(Exception):
+    """A timed run went past RUN_CAP_SECONDS"""
+
+
+SAMPLE_DOCUMENT = (
+    "NEW MARKETS TAX CREDIT ALLOCATION AGREEMENT\n"
+    "This Qualified Low-Income Community Investment Loan Agreement is entered into as of "
+    "March 1, 2024 by the CDE and the QALICB. Loan Amount: $5,250,000.00 at an interest rate "
+    "of 4.25% per annum. Maturity Date: 03/01/2031. Census Tract: 1234.56.\n"
+    "Section 2.1. Qualified Equity Investment. The 7 year compliance period begins on the "
+    "Initial Investment Date. Total assets $12,500,000 Total liabilities $4,000,000.\n"
+)
+
+
+def collect_patterns():
+    """Every compiled pattern detection runs, labelled by where it is used"""
+    patterns = []
+
+    matcher = CombinedPatternMatcher(NMTCPatterns.DOCUMENT_PATTERNS)
+    for pattern in matcher.patterns:
+        patterns.append(("document_patterns", pattern))
+
+    for field_category, field_patterns in pattern_bank.key_fields.items():
+        for pattern, _ in field_patterns:
+            patterns.append((f"key_fields.{field_category}", pattern))
+
+    for indicator_name, (pattern, _) in pattern_bank.structure_indicators.items():
+        patterns.append((f"structure.{indicator_name}", pattern))
+
+    for _, (_, checks) in pattern_bank.type_checks.items():
+        for check_name, (pattern, _) in checks.items():
+            patterns.append((f"type_checks.{check_name}", pattern))
+
+    patterns.append(("compliance_terms", pattern_bank.compliance_terms.regex))
+
+    return patterns
+
+
+def repeat_to(unit: str, size: int) -> str:
+    return (unit * (size // max(1, len(unit)) + 1))[:size]
+
+
+def adversarial_inputs(pattern: re.Pattern, size: int):
+    """Inputs of the given size aimed at the pattern's backtracking"""
+    words = re.findall(r'(?<!\\)[a-z]{2,}', pattern.pattern.lower()) or ["qlici"]
+    near_miss = " ".join(words[:-1] or words) + " 12,345 $1,234. "
+
+    return {
+        "near_miss_line": repeat_to(near_miss, size),
+        "digit_run": "$" + repeat_to("1", size - 1),
+        "digit_comma_run": words[0] + " $" + repeat_to("1,", size - len(words[0]) - 2),
+        "whitespace_run": words[0] + repeat_to(" ", size - len(words[0])),
+        "single_line_document": repeat_to(SAMPLE_DOCUMENT.replace("\n", " "), size),
+        "document": repeat_to(SAMPLE_DOCUMENT, size)
+    }
+
+
+@contextmanager
+def run_cap(seconds: float):
+    """Raise RunCapExceeded if the block runs longer than seconds (main thread only)"""
+    def _on_timeout(signum, frame):
+        raise RunCapExceeded()
+
+    if not hasattr(signal, "setitimer"):
+        yield
+        return
+    previous = signal.signal(signal.SIGALRM, _on_timeout)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def best_time(regex: re.Pattern, text: str, runs: int = 3):
+    """Best of runs full scans in seconds, or None when a run goes past the cap"""
+    best = float("inf")
+    for _ in range(runs):
+        started = time.perf_counter()
+        try:
+            with run_cap(RUN_CAP_SECONDS):
+                for _ in regex.finditer(text):
+                    pass
+        except RunCapExceeded:
+            return None
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def check_pattern(label: str, pattern: re.Pattern, size: int, factor: int, slack: float):
+    small_inputs = adversarial_inputs(pattern, size)
+    large_inputs = adversarial_inputs(pattern, size * factor)
+    results = []
+
+    for family in small_inputs:
+        small = best_time(pattern, small_inputs[family])
+        large = best_time(pattern, large_inputs[family]) if small is not None else None
+        allowed = max(small, NOISE_FLOOR_SECONDS) * factor * slack if small is not None else None
+
+        results.append({
+            "source": label,
+            "pattern": pattern.pattern,
+            "input": family,
+            "small_seconds": small,
+            "large_seconds": large,
+            "allowed_seconds": allowed,
+            "growth": large / small if small and large is not None else None,
+            "passed": large is not None and large <= allowed
+        })
+
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Time detection patterns against adversarial inputs")
+    parser.add_argument("--size", type=int, default=64 * 1024, help="Smaller input size in characters")
+    parser.add_argument("--factor", type=int, default=4, help="Larger input is this many times the smaller")
+    parser.add_argument("--slack", type=float, default=2.5, help="Allowed excess over linear growth")
+    parser.add_argument("--json", help="Write all timings to this file")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("REGEX SAFETY CHECK - NMTC DETECTION PATTERNS")
+    print(f"Inputs of {args.size} and {args.size * args.factor} chars, slack {args.slack}x over linear")
+    print("=" * 60)
+
+    results = []
+    for label, pattern in collect_patterns():
+        results.extend(check_pattern(label, pattern, args.size, args.factor, args.slack))
+
+    failures = [r for r in results if not r["passed"]]
+
+    for result in failures:
+        if result["large_seconds"] is None:
+            print(f"[-] {result['source']}: {result['pattern']!r} on {result['input']}: "
+                  f"ran past {RUN_CAP_SECONDS}s")
+        else:
+            print(f"[-] {result['source']}: {result['pattern']!r} on {result['input']}: "
+                  f"{result['large_seconds']:.3f}s (allowed {result['allowed_seconds']:.3f}s)")
+
+    timed = [r for r in results if r["large_seconds"] is not None]
+    print(f"\n[*] {len(results)} timings over {len({r['pattern'] for r in results})} patterns")
+    if timed:
+        slowest = max(timed, key=lambda r: r["large_seconds"])
+        print(f"[*] Slowest: {slowest['pattern']!r} on {slowest['input']} "
+              f"({slowest['large_seconds']:.3f}s for {args.size * args.factor} chars)")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"size": args.size, "factor": args.factor, "slack": args.slack, "results": results}, f, indent=2)
+        print(f"[*] Timings written to {args.json}")
+
+    print("=" * 60)
+    if failures:
+        print(f"FAILED - {len(failures)} pattern/input pairs grew faster than linear")
+        return 1
+    print("PASSED - every pattern stays within the linear-time envelope")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -218,7 +218,7 @@ def demonstrate_integration_workflow():
       "ocr_results": {
         "full_text": "extracted text...",
         "page_count": 5,
-        "confidence_scores": [...],
+        "confidence_summary": {"count": 2140, "mean": 0.95, "percentiles": {...}, "histogram": [...]},
         "overall_confidence": 0.95
       },
       "detection_results": {
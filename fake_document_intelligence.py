@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for Azure Document Intelligence, for load testing the OCR pipeline offline.
+
+Speaks the analyze long-running-operation protocol used by begin_analyze_document:
+POST .../documentModels/{model_id}:analyze answers 202 with an Operation-Location, and
+GET on that location reports "running" until the simulated latency has elapsed, then
+"succeeded" with an analyzeResult built from the PDF's real text (content, pages, lines,
+words with confidences, paragraphs and, for prebuilt-layout, simple tables).
+
+Latency, throttling (429 with Retry-After) and failures can be injected. Point the
+backend at it with:
+
+    python fake_document_intelligence.py --port 8765 --latency-per-page 0.05 --throttle-tps 15
+    AZURE_DOC_INTELLIGENCE_ENDPOINT=http://localhost:8765 AZURE_DOC_INTELLIGENCE_KEY=any ...
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import io
+import json
+import random
+import re
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional, Tuple
+
+from aiohttp import web
+from PyPDF2 import PdfReader
+
+# Synthetic layout geometry (inches), used for word polygons and page sizes
+PAGE_MARGIN = 1.0
+LINE_HEIGHT = 0.2
+CHAR_WIDTH = 0.07
+POINTS_PER_INCH = 72.0
+
+# Lines whose cells are separated by runs of 2+ spaces or tabs are treated as table rows
+TABLE_CELL_SPLIT = re.compile(r"\s{2,}|\t")
+
+
+def isoformat(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def parse_pages_option(pages: Optional[str], page_count: int) -> List[int]:
+    """Zero-based page indexes selected by an Azure-style pages string such as "1-3,5" """
+    if not pages:
+        return list(range(page_count))
+
+    selected = []
+    for part in pages.split(","):
+        part = part.strip()
+        if "-" in part:
+            first, last = part.split("-", 1)
+            selected.extend(range(int(first) - 1, min(int(last), page_count)))
+        elif part:
+            selected.append(int(part) - 1)
+    return [idx for idx in selected if 0 <= idx < page_count]
+
+
+def extract_page_texts(document: bytes) -> List[Tuple[float, float, str]]:
+    """(width, height, text) in inches for each page; non-PDF input is a single blank page"""
+    try:
+        reader = PdfReader(io.BytesIO(document))
+    except Exception:
+        return [(8.5, 11.0, "")]
+
+    pages = []
+    for page in reader.pages:
+        try:
+            text = page.extract_text() or ""
+        except Exception:
+            text = ""
+        width = float(page.mediabox.width) / POINTS_PER_INCH
+        height = float(page.mediabox.height) / POINTS_PER_INCH
+        pages.append((round(width, 4), round(height, 4), text))
+    return pages or [(8.5, 11.0, "")]
+
+
+def polygon(x: float, y: float, width: float, height: float) -> List[float]:
+    return [x, y, x + width, y, x + width, y + height, x, y + height]
+
+
+def build_analyze_result(
+    document: bytes,
+    model_id: str,
+    api_version: str,
+    pages_option: Optional[str],
+    rng: random.Random
+) -> Dict[str, Any]:
+    """Build an analyzeResult payload from the document's real text"""
+    page_texts = extract_page_texts(document)
+    selected = parse_pages_option(pages_option, len(page_texts))
+
+    content_lines: List[str] = []
+    offset = 0
+    pages: List[Dict[str, Any]] = []
+    paragraphs: List[Dict[str, Any]] = []
+    tables: List[Dict[str, Any]] = []
+
+    for page_idx in selected:
+        width, height, text = page_texts[page_idx]
+        page_number = page_idx + 1
+        page_offset = offset
+        lines, words = [], []
+        paragraph_lines: List[Tuple[int, str]] = []
+        table_rows: List[Tuple[int, List[str]]] = []
+
+        def flush_paragraph():
+            if paragraph_lines:
+                start = paragraph_lines[0][0]
+                end = paragraph_lines[-1][0] + len(paragraph_lines[-1][1])
+                paragraphs.append({
+                    "content": " ".join(line for _, line in paragraph_lines),
+                    "boundingRegions": [{"pageNumber": page_number, "polygon": polygon(PAGE_MARGIN, PAGE_MARGIN, width - 2 * PAGE_MARGIN, LINE_HEIGHT)}],
+                    "spans": [{"offset": start, "length": end - start}]
+                })
+                paragraph_lines.clear()
+
+        def flush_table():
+            if len(table_rows) >= 2:
+                column_count = max(len(cells) for _, cells in table_rows)
+                table_offset = table_rows[0][0]
+                cells = [
+                    {"kind": "columnHeader" if row_idx == 0 else "content", "rowIndex": row_idx,
+                     "columnIndex": col_idx, "content": cell}
+                    for row_idx, (_, row_cells) in enumerate(table_rows)
+                    for col_idx, cell in enumerate(row_cells)
+                ]
+                tables.append({
+                    "rowCount": len(table_rows),
+                    "columnCount": column_count,
+                    "cells": cells,
+                    "boundingRegions": [{"pageNumber": page_number, "polygon": polygon(PAGE_MARGIN, PAGE_MARGIN, width - 2 * PAGE_MARGIN, LINE_HEIGHT * len(table_rows))}],
+                    "spans": [{"offset": table_offset, "length": offset - table_offset}]
+                })
+            table_rows.clear()
+
+        for line_idx, raw_line in enumerate(text.splitlines()):
+            line = raw_line.strip()
+            if not line:
+                flush_paragraph()
+                flush_table()
+                continue
+
+            y = PAGE_MARGIN + line_idx * LINE_HEIGHT
+            lines.append({
+                "content": line,
+                "polygon": polygon(PAGE_MARGIN, y, len(line) * CHAR_WIDTH, LINE_HEIGHT),
+                "spans": [{"offset": offset, "length": len(line)}]
+            })
+
+            for match in re.finditer(r"\S+", line):
+                words.append({
+                    "content": match.group(),
+                    "polygon": polygon(PAGE_MARGIN + match.start() * CHAR_WIDTH, y, len(match.group()) * CHAR_WIDTH, LINE_HEIGHT),
+                    "confidence": round(min(0.999, rng.betavariate(30, 1.2)), 3),
+                    "span": {"offset": offset + match.start(), "length": len(match.group())}
+                })
+
+            cells = [cell for cell in TABLE_CELL_SPLIT.split(line) if cell]
+            if len(cells) >= 2:
+                flush_paragraph()
+                table_rows.append((offset, cells))
+            else:
+                flush_table()
+                paragraph_lines.append((offset, line))
+
+            content_lines.append(line)
+            offset += len(line) + 1  # newline between lines, including across pages
+
+        flush_paragraph()
+        flush_table()
+
+        pages.append({
+            "pageNumber": page_number,
+            "angle": 0,
+            "width": width,
+            "height": height,
+            "unit": "inch",
+            "words": words,
+            "lines": lines,
+            "spans": [{"offset": page_offset, "length": max(0, offset - page_offset - 1)}]
+        })
+
+    result: Dict[str, Any] = {
+        "apiVersion": api_version,
+        "modelId": model_id,
+        "stringIndexType": "textElements",
+        "content": "\n".join(content_lines),
+        "pages": pages,
+        "paragraphs": paragraphs
+    }
+    if model_id != "prebuilt-read":
+        result["tables"] = tables
+    return result
+
+
+class FakeDocumentIntelligence:
+    """In-memory analyze operations with configurable latency, throttling and failures"""
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.operations: Dict[str, Dict[str, Any]] = {}
+        self.submissions: deque = deque()
+        self.stats = {"submitted": 0, "throttled": 0, "errors": 0, "failed": 0, "succeeded": 0, "polls": 0}
+
+    def _error(self, status: int, code: str, message: str, headers: Optional[Dict[str, str]] = None) -> web.Response:
+        return web.json_response({"error": {"code": code, "message": message}}, status=status, headers=headers)
+
+    def _check_key(self, request: web.Request) -> Optional[web.Response]:
+        if not request.headers.get("Ocp-Apim-Subscription-Key") and not request.headers.get("Authorization"):
+            return self._error(401, "401", "Access denied due to missing subscription key.")
+        return None
+
+    def _throttled(self) -> bool:
+        """Random throttling plus a sliding one-second transactions-per-second cap"""
+        if self.rng.random() < self.args.throttle_rate:
+            return True
+
+        if self.args.throttle_tps > 0:
+            now = time.monotonic()
+            while self.submissions and now - self.submissions[0] > 1.0:
+                self.submissions.popleft()
+            if len(self.submissions) >= self.args.throttle_tps:
+                return True
+            self.submissions.append(now)
+        return False
+
+    async def analyze(self, request: web.Request) -> web.Response:
+        denied = self._check_key(request)
+        if denied:
+            return denied
+
+        model_id = request.match_info["model_id"]
+        api_version = request.query.get("api-version", "2023-10-31-preview")
+        body = await request.read()
+
+        if self._throttled():
+            self.stats["throttled"] += 1
+            return self._error(429, "429", "Requests to the analyze operation have exceeded the rate limit.",
+                               headers={"Retry-After": str(self.args.retry_after)})
+        if self.rng.random() < self.args.error_rate:
+            self.stats["errors"] += 1
+            return self._error(500, "InternalServerError", "An unexpected error occurred.")
+
+        # Raw bytes, or the JSON AnalyzeDocumentRequest form with base64Source
+        if request.content_type == "application/json":
+            try:
+                payload = json.loads(body or b"{}")
+            except ValueError:
+                return self._error(400, "InvalidRequest", "Invalid JSON request body.")
+            if "base64Source" not in payload:
+                return self._error(400, "InvalidRequest", "Only base64Source is supported by the local stand-in.")
+            body = base64.b64decode(payload["base64Source"])
+        if not body:
+            return self._error(400, "InvalidRequest", "The document is empty.")
+
+        document_rng = random.Random(hashlib.sha256(body).digest())
+        analyze_result = await asyncio.to_thread(
+            build_analyze_result, body, model_id, api_version, request.query.get("pages"), document_rng
+        )
+
+        page_count = max(1, len(analyze_result["pages"]))
+        latency = self.args.latency_base + self.args.latency_per_page * page_count
+        latency *= 1 + self.rng.uniform(-self.args.latency_jitter, self.args.latency_jitter)
+
+        result_id = str(uuid.uuid4())
+        now = time.time()
+        self.operations[result_id] = {
+            "created": now,
+            "ready_at": now + max(0.0, latency),
+            "fails": self.rng.random() < self.args.failure_rate,
+            "reported": False,
+            "result": analyze_result
+        }
+        self.stats["submitted"] += 1
+
+        location = f"{request.scheme}://{request.host}/documentintelligence/documentModels/{model_id}/analyzeResults/{result_id}?api-version={api_version}"
+        headers = {"Operation-Location": location, "apim-request-id": result_id}
+        if self.args.poll_retry_after:
+            headers["Retry-After"] = str(self.args.poll_retry_after)
+        return web.Response(status=202, headers=headers)
+
+    async def analyze_result(self, request: web.Request) -> web.Response:
+        denied = self._check_key(request)
+        if denied:
+            return denied
+
+        self.stats["polls"] += 1
+        operation = self.operations.get(request.match_info["result_id"])
+        now = time.time()
+        if not operation or now - operation["created"] > self.args.result_ttl:
+            return self._error(404, "NotFound", "Resource not found.")
+        if self.rng.random() < self.args.error_rate:
+            self.stats["errors"] += 1
+            return self._error(500, "InternalServerError", "An unexpected error occurred.")
+
+        body: Dict[str, Any] = {"createdDateTime": isoformat(operation["created"])}
+        headers = {}
+        if now < operation["ready_at"]:
+            body.update(status="running", lastUpdatedDateTime=isoformat(now))
+            if self.args.poll_retry_after:
+                headers["Retry-After"] = str(self.args.poll_retry_after)
+        elif operation["fails"]:
+            body.update(status="failed", lastUpdatedDateTime=isoformat(operation["ready_at"]),
+                        error={"code": "InternalServerError", "message": "Injected analysis failure."})
+        else:
+            body.update(status="succeeded", lastUpdatedDateTime=isoformat(operation["ready_at"]),
+                        analyzeResult=operation["result"])
+
+        if body["status"] != "running" and not operation["reported"]:
+            operation["reported"] = True
+            self.stats[body["status"]] += 1
+        return web.json_response(body, headers=headers)
+
+    async def expire_operations(self) -> None:
+        """Drop results older than result_ttl, as the service does after 24 hours"""
+        while True:
+            await asyncio.sleep(60)
+            cutoff = time.time() - self.args.result_ttl
+            for result_id in [key for key, op in self.operations.items() if op["created"] < cutoff]:
+                self.operations.pop(result_id, None)
+
+    async def stats_handler(self, request: web.Request) -> web.Response:
+        return web.json_response({**self.stats, "in_memory_operations": len(self.operations)})
+
+    def create_app(self) -> web.Application:
+        app = web.Application(client_max_size=self.args.max_body_mb * 1024 * 1024)
+        for prefix in ("/documentintelligence", "/formrecognizer"):
+            app.router.add_post(prefix + "/documentModels/{model_id}:analyze", self.analyze)
+            app.router.add_get(prefix + "/documentModels/{model_id}/analyzeResults/{result_id}", self.analyze_result)
+        app.router.add_get("/stats", self.stats_handler)
+
+        async def start_expiry(app: web.Application):
+            app["expiry"] = asyncio.create_task(self.expire_operations())
+
+        async def stop_expiry(app: web.Application):
+            app["expiry"].cancel()
+
+        app.on_startup.append(start_expiry)
+        app.on_cleanup.append(stop_expiry)
+        return app
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Local Azure Document Intelligence stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-base", type=float, default=0.5, help="Seconds before any operation completes")
+    parser.add_argument("--latency-per-page", type=float, default=0.1, help="Extra seconds per analysed page")
+    parser.add_argument("--latency-jitter", type=float, default=0.2, help="Relative +/- jitter on latency")
+    parser.add_argument("--poll-retry-after", type=int, default=0, help="Retry-After seconds sent while running (0 = none)")
+    parser.add_argument("--throttle-tps", type=int, default=0, help="Answer 429 above this many submissions per second (0 = off)")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Probability of a random 429 on submission")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds on 429 responses")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Probability of an HTTP 500 on any request")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Probability an operation ends with status failed")
+    parser.add_argument("--result-ttl", type=float, default=24 * 3600, help="Seconds a result stays retrievable")
+    parser.add_argument("--max-body-mb", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=None, help="Seed for reproducible injection")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    fake = FakeDocumentIntelligence(args)
+    print(f"[*] Fake Document Intelligence listening on http://{args.host}:{args.port}")
+    print(f"[*] Set AZURE_DOC_INTELLIGENCE_ENDPOINT=http://{args.host}:{args.port}; stats at /stats")
+    web.run_app(fake.create_app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
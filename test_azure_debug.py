@@ -43,14 +43,15 @@ async def debug_azure_response():
         analyze_request = AnalyzeDocumentRequest(base64_source=base64_content)
         
         print("[*] Starting Azure processing...")
-        poller = azure_service.client.begin_analyze_document(
+        client = await azure_service.get_client()
+        poller = await client.begin_analyze_document(
             model_id="prebuilt-read",
             analyze_request=analyze_request,
             output_content_format=ContentFormat.TEXT
         )
         
         print("[*] Waiting for Azure response...")
-        result = poller.result()
+        result = await poller.result()
         
         print(f"[+] Azure processing completed!")
         print(f"[+] Result type: {type(result)}")
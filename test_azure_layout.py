@@ -27,6 +27,8 @@ async def test_different_models():
         from app.services.azure_service import azure_service
         from azure.ai.documentintelligence.models import AnalyzeDocumentRequest
         
+        client = await azure_service.get_client()
+        
         # Test different models
         models_to_test = [
             "prebuilt-read",      # Current model - fast text extraction
@@ -45,12 +47,12 @@ async def test_different_models():
                 analyze_request = AnalyzeDocumentRequest(base64_source=base64_content)
                 
                 print(f"[*] Starting {model_id} processing...")
-                poller = azure_service.client.begin_analyze_document(
+                poller = await client.begin_analyze_document(
                     model_id=model_id,
                     analyze_request=analyze_request
                 )
                 
-                result = poller.result()
+                result = await poller.result()
                 
                 # Analyze results
                 pages_count = len(result.pages) if hasattr(result, 'pages') and result.pages else 0
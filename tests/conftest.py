@@ -0,0 +1,35 @@
+"""
+Test configuration
+
+Settings are read when app.config is imported; give the required ones placeholder
+values so modules can be imported without a .env (nothing here connects to them;
+the Supabase keys only need a JWT's shape).
+Tests that need Redis get an in-memory one from the redis_client fixture.
+"""
+import os
+
+import fakeredis
+import pytest
+
+for name, value in {
+    "SUPABASE_URL": "https://test.supabase.co",
+    "SUPABASE_ANON_KEY": "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoiYW5vbiJ9.test",
+    "SUPABASE_SERVICE_KEY": "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoic2VydmljZV9yb2xlIn0.test",
+    "AZURE_DOC_INTELLIGENCE_ENDPOINT": "https://test.cognitiveservices.azure.com",
+    "AZURE_DOC_INTELLIGENCE_KEY": "test",
+    "REDIS_URL": "redis://localhost:6379/0",
+    "REDIS_PASSWORD": "",
+    "CELERY_BROKER_URL": "redis://localhost:6379/0",
+    "CELERY_RESULT_BACKEND": "redis://localhost:6379/0",
+}.items():
+    os.environ.setdefault(name, value)
+
+
+@pytest.fixture
+def redis_client(monkeypatch):
+    """An empty in-memory Redis, also returned by get_redis_client"""
+    from app.services import redis_service
+
+    client = fakeredis.FakeRedis()
+    monkeypatch.setattr(redis_service, "_redis_client", client)
+    return client
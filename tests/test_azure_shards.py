@@ -0,0 +1,126 @@
+"""
+Tests for reading large PDFs as page-range shards
+
+The Azure read model is replaced by fake_read, which "reads" each page of a PDF as text
+naming its page (pages are told apart by width) and joins pages with a newline, as the
+read model does. Reading in shards and merging must give what one call gives.
+"""
+import asyncio
+import io
+import uuid
+from types import SimpleNamespace
+
+import pytest
+from PyPDF2 import PdfReader, PdfWriter
+
+from app.config import settings
+from app.services import azure_service as azure_module
+from app.services.azure_service import azure_service
+
+PAGE_COUNT = 11
+
+
+def make_pdf(page_count: int) -> bytes:
+    writer = PdfWriter()
+    for page_idx in range(page_count):
+        writer.add_blank_page(width=100 + page_idx, height=200)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+def fake_read(document_content: bytes) -> SimpleNamespace:
+    """An AnalyzeResult-like read of a PDF made by make_pdf"""
+    content = ""
+    pages = []
+    for page in PdfReader(io.BytesIO(document_content)).pages:
+        page_number = int(page.mediabox.width) - 100 + 1
+        text = f"Page {page_number} heading\nPage {page_number} body text"
+        if content:
+            content += "\n"
+        pages.append(SimpleNamespace(
+            width=float(page.mediabox.width), height=200.0, unit="pixel", lines=[], words=[],
+            spans=[SimpleNamespace(offset=len(content), length=len(text))]
+        ))
+        content += text
+    return SimpleNamespace(api_version="test", model_id="prebuilt-read", content=content, pages=pages)
+
+
+@pytest.fixture
+def fake_azure(monkeypatch):
+    """Route analyses through fake_read, with no cache or Redis behind them"""
+    async def run_analysis(model_id, document_content, *args, **kwargs):
+        return fake_read(document_content)
+
+    async def no_cached_result(*args, **kwargs):
+        return None
+
+    monkeypatch.setattr(azure_service, "_run_analysis", run_analysis)
+    monkeypatch.setattr(azure_service, "_get_cached_result", no_cached_result)
+    monkeypatch.setattr(azure_module.ocr_cache, "set", lambda *args, **kwargs: None)
+
+
+def analyze(document_content: bytes, shard_pages: int, monkeypatch, on_text=None):
+    monkeypatch.setattr(settings, "AZURE_SHARD_PAGES", shard_pages)
+    return asyncio.run(azure_service.analyze_document_quick(document_content, uuid.uuid4(), on_text=on_text))
+
+
+@pytest.mark.parametrize("shard_pages, shard_sizes", [
+    (4, [4, 4, 3]),
+    (5, [5, 5, 1]),
+    (1, [1] * PAGE_COUNT),
+    (PAGE_COUNT, None),
+    (0, None),
+])
+def test_prepare_pdf_splits_into_page_ranges(shard_pages, shard_sizes):
+    page_count, shards = azure_service._prepare_pdf(make_pdf(PAGE_COUNT), shard_pages)
+    assert page_count == PAGE_COUNT
+    assert (shards and [size for size, _ in shards]) == shard_sizes
+
+
+def test_prepare_pdf_unreadable_is_single_request():
+    assert azure_service._prepare_pdf(b"not a pdf", 4) == (None, None)
+
+
+@pytest.mark.parametrize("shard_pages", [1, 3, 4, 10])
+def test_merged_shards_equal_single_call(shard_pages):
+    document_content = make_pdf(PAGE_COUNT)
+    single = fake_read(document_content)
+
+    _, shards = azure_service._prepare_pdf(document_content, shard_pages)
+    merged = azure_service._merge_shard_results([fake_read(shard) for _, shard in shards])
+
+    assert merged.content == single.content
+    assert [page.width for page in merged.pages] == [page.width for page in single.pages]
+
+
+@pytest.mark.parametrize("shard_pages", [2, 4])
+def test_sharded_analysis_equals_single_call(fake_azure, monkeypatch, shard_pages):
+    document_content = make_pdf(PAGE_COUNT)
+    single = analyze(document_content, 0, monkeypatch)
+
+    texts = []
+
+    async def on_text(text):
+        texts.append(text)
+
+    sharded = analyze(document_content, shard_pages, monkeypatch, on_text=on_text)
+
+    assert sharded["full_text"] == single["full_text"]
+    assert sharded["page_count"] == single["page_count"] == PAGE_COUNT
+    assert [page["width"] for page in sharded["pages"]] == [page["width"] for page in single["pages"]]
+    # Shard text is handed over in page order, one shard at a time
+    assert len(texts) == -(-PAGE_COUNT // shard_pages)
+    assert "\n".join(texts) == single["full_text"]
+
+
+def test_single_call_hands_over_text_by_page(fake_azure, monkeypatch):
+    texts = []
+
+    async def on_text(text):
+        texts.append(text)
+
+    result = analyze(make_pdf(3), 0, monkeypatch, on_text=on_text)
+
+    assert texts == [f"Page {n} heading\nPage {n} body text" for n in (1, 2, 3)]
+    assert "\n".join(texts) == result["full_text"]
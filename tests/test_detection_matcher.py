@@ -0,0 +1,204 @@
+"""
+Regression tests for the combined, anchor-filtered pattern matcher
+
+Detection through CombinedPatternMatcher must give the same type, confidence and
+indicators as running every pattern of every document type on its own, which is what
+reference_scores does. The corpus is fixed (benchmarks.corpus with set seeds).
+"""
+import heapq
+import re
+from typing import Dict, List, Tuple
+
+import pytest
+
+from app.services.detection_service import NMTCDetectionService
+from app.utils.nmtc_patterns import NMTCDocumentType, fold_case, literal_anchor
+from benchmarks.corpus import adversarial_documents, generate_corpus, generate_document
+
+Indicator = Tuple[str, float, int, int]
+
+
+@pytest.fixture(scope="module")
+def service() -> NMTCDetectionService:
+    return NMTCDetectionService()
+
+
+def _corpus() -> Dict[str, str]:
+    documents = {}
+    for size, by_type in generate_corpus([2 * 1024, 32 * 1024], seed=7).items():
+        for doc_type, text in by_type.items():
+            documents[f"{doc_type.value}-{size}"] = text
+            if size == 2 * 1024:
+                documents[f"{doc_type.value}-{size}-upper"] = text.upper()
+    for name, text in adversarial_documents(8 * 1024).items():
+        documents[f"adversarial-{name}"] = text
+
+    # Documents mixing the content of two types, so scores are close
+    doc_types = list(NMTCDocumentType)[:-1]
+    for first, second in zip(doc_types, doc_types[1:] + doc_types[:1]):
+        documents[f"mixed-{first.value}-{second.value}"] = (
+            generate_document(first, 4 * 1024, seed=1) + "\n" + generate_document(second, 4 * 1024, seed=2)
+        )
+    return documents
+
+
+CORPUS = _corpus()
+
+
+def reference_scores(service: NMTCDetectionService, text: str) -> Dict[NMTCDocumentType, Tuple[float, List[Indicator]]]:
+    """Score and indicators of every document type, one pattern at a time"""
+    patterns = service.patterns
+    results = {}
+    for doc_type in patterns.get_all_document_types():
+        total_score = 0.0
+        indicators = []
+        for category, pattern_list in patterns.DOCUMENT_PATTERNS.get(doc_type, {}).items():
+            hits = [
+                (service._calculate_match_confidence(match.start(), match.end(), len(text), category), match.start(), match.end())
+                for pattern in pattern_list
+                for match in re.finditer(pattern, text, re.IGNORECASE | re.MULTILINE)
+            ]
+            if not hits:
+                continue
+            total_score += max(hit[0] for hit in hits) * patterns.SCORING_WEIGHTS.get(category, 0.1)
+            kept = heapq.nlargest(patterns.MAX_INDICATORS_PER_CATEGORY, range(len(hits)), key=lambda i: hits[i][0])
+            indicators.extend((category, *hits[i]) for i in sorted(kept))
+        results[doc_type] = (min(total_score, 1.0), indicators)
+    return results
+
+
+def reference_ranking(service: NMTCDetectionService, text: str) -> List[Tuple[NMTCDocumentType, float]]:
+    """Every document type by score, highest first; ties go to the type listed first"""
+    scores = reference_scores(service, text)
+    return sorted(((doc_type, score) for doc_type, (score, _) in scores.items()), key=lambda ranked: -ranked[1])
+
+
+def _indicators(result) -> List[Indicator]:
+    return [
+        (match.pattern_type, match.confidence, match.start, match.end)
+        for match in result.primary_indicators + result.secondary_indicators
+    ]
+
+
+@pytest.mark.parametrize("name", sorted(CORPUS))
+def test_type_scores_match_reference(service, name):
+    text = CORPUS[name]
+    matcher = service.patterns.matcher
+    pattern_hits = matcher.scan(text, fold_case(text))
+
+    for doc_type, (score, indicators) in reference_scores(service, text).items():
+        matched_score, matches = service._score_document_type(text, doc_type, pattern_hits, matcher)
+        assert matched_score == score, doc_type
+        assert [(m.pattern_type, m.confidence, m.start, m.end) for m in matches] == indicators, doc_type
+
+
+@pytest.mark.parametrize("tiered", [False, True], ids=["full", "tiered"])
+@pytest.mark.parametrize("name", sorted(CORPUS))
+def test_detection_matches_reference(service, name, tiered):
+    text = CORPUS[name]
+    scores = reference_scores(service, text)
+    best_type, best_score = reference_ranking(service, text)[0]
+
+    result = service.detect_document_type(text, tiered=tiered)
+
+    if best_score < service.patterns.MIN_CONFIDENCE_THRESHOLDS['low_confidence']:
+        assert result.document_type == NMTCDocumentType.UNKNOWN
+        return
+    assert result.document_type == best_type
+    assert result.confidence == best_score
+    # Indicators come out primary first, each part in scan order
+    expected = scores[best_type][1]
+    assert _indicators(result) == [i for i in expected if i[1] > 0.5] + [i for i in expected if i[1] <= 0.5]
+
+
+def test_candidate_ids_keep_every_pattern_that_matches(service):
+    matcher = service.patterns.matcher
+    for text in CORPUS.values():
+        candidates = set(matcher.candidate_ids(text))
+        for pattern_id, pattern in enumerate(matcher.patterns):
+            if pattern_id not in candidates:
+                assert pattern.search(text) is None
+
+
+@pytest.mark.parametrize("pattern, anchor", [
+    (r'allocation\s+agreement', 'allocation'),
+    (r'new\s+markets\s+tax\s+credit', 'markets'),
+    (r'community\s+development\s+entity', 'development'),
+    (r'cde\s*#?\s*\d+', 'cde'),
+    (r'insurance\s+certificate', 'certificate'),
+    # An optional or repeated-from-zero character ends a run
+    (r'colou?r\s+chart', 'chart'),
+    (r'abcd*ef', 'abc'),
+    (r'abc{0,3}defg', 'defg'),
+    # A character repeated at least once occurs, but ends the run
+    (r'ab+cde', 'cde'),
+    (r'ab+c', 'ab'),
+    # Escaped punctuation is literal, escape classes are not
+    (r'q\.l\.i\.c\.i', 'q.l.i.c.i'),
+    (r'\$\d+ principal', ' principal'),
+    # Groups and classes end a run and contribute nothing
+    (r'(?:qualified|eligible)\s+business', 'business'),
+    (r'[Ff]orm\s+8874', '8874'),
+    (r'loan[s\]]? agreement', ' agreement'),
+    (r'.*?closing\s+date', 'closing'),
+    (r'LLC', 'llc'),
+])
+def test_literal_anchor(pattern, anchor):
+    assert literal_anchor(pattern) == anchor
+    assert anchor in fold_case(re.search(pattern, f"x {pattern_example(pattern)} x", re.IGNORECASE).group())
+
+
+def pattern_example(pattern: str) -> str:
+    """A text each test_literal_anchor pattern matches"""
+    return {
+        r'allocation\s+agreement': 'Allocation Agreement',
+        r'new\s+markets\s+tax\s+credit': 'New Markets Tax Credit',
+        r'community\s+development\s+entity': 'community development entity',
+        r'cde\s*#?\s*\d+': 'CDE #12',
+        r'insurance\s+certificate': 'Insurance Certificate',
+        r'colou?r\s+chart': 'color chart',
+        r'abcd*ef': 'abcef',
+        r'abc{0,3}defg': 'abdefg',
+        r'ab+cde': 'abbbcde',
+        r'ab+c': 'abbbc',
+        r'q\.l\.i\.c\.i': 'Q.L.I.C.I',
+        r'\$\d+ principal': '$100 principal',
+        r'(?:qualified|eligible)\s+business': 'eligible business',
+        r'[Ff]orm\s+8874': 'form 8874',
+        r'loan[s\]]? agreement': 'loan] agreement',
+        r'.*?closing\s+date': 'the closing date',
+        r'LLC': 'Fund LLC',
+    }[pattern]
+
+
+@pytest.mark.parametrize("pattern", [
+    r'allocation|agreement',
+    r'\d+',
+    r'(?:allocation\s+agreement)',
+    r'[a-z]+',
+    r'a?',
+])
+def test_literal_anchor_none_without_required_literal(pattern):
+    assert literal_anchor(pattern) is None
+
+
+@pytest.mark.parametrize("top_k", [1, 3, 5])
+@pytest.mark.parametrize("name", sorted(CORPUS))
+def test_tiered_top_k_matches_full_ranking(service, name, top_k):
+    text = CORPUS[name]
+    expected = [(doc_type.value, score) for doc_type, score in reference_ranking(service, text)[:top_k]]
+    if expected[0][1] < service.patterns.MIN_CONFIDENCE_THRESHOLDS['low_confidence']:
+        pytest.skip("No type reaches the low confidence threshold")
+
+    for tiered in (False, True):
+        result = service.detect_document_type(text, tiered=tiered, top_k=top_k)
+        ranked = [(entry["document_type"], entry["confidence"]) for entry in result.metadata.get("ranked_types", [])]
+        assert (ranked or [(result.document_type.value, result.confidence)]) == expected, tiered
+
+
+def test_tiered_skips_types_that_cannot_place(service):
+    text = generate_document(NMTCDocumentType.QLICI_LOAN, 32 * 1024, seed=7)
+    scoring = service.detect_document_type(text, tiered=True).metadata["scoring"]
+    assert scoring["mode"] == "tiered"
+    assert scoring["types_skipped"]
+    assert scoring["types_scored"] + len(scoring["types_skipped"]) == len(service.patterns.get_all_document_types())
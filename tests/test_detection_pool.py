@@ -0,0 +1,90 @@
+"""
+Tests for batch detection across a process pool
+"""
+import multiprocessing
+import os
+import time
+
+import pytest
+
+from app.services.detection_service import detection_pool, detection_service
+from app.tasks.queues import TASK_ROUTES, worker_profile
+from benchmarks.corpus import generate_corpus
+
+BATCH_TASK = "app.tasks.document_tasks.process_batch_type_detection"
+
+fork_only = pytest.mark.skipif(
+    multiprocessing.get_start_method() != "fork",
+    reason="pool workers only inherit the patched service when forked"
+)
+
+
+def _documents():
+    corpus = generate_corpus([2 * 1024], seed=11)[2 * 1024]
+    return [(doc_type.value, text, None) for doc_type, text in corpus.items()]
+
+
+def _pool_started_in_daemon(results):
+    with detection_pool(2) as executor:
+        results.put(executor is None)
+
+
+@fork_only
+def test_detect_many_spreads_over_processes(monkeypatch):
+    def detect_document_type(text_content, filename=None, matcher=None):
+        time.sleep(0.02)
+        return os.getpid()
+
+    monkeypatch.setattr(detection_service, "detect_document_type", detect_document_type)
+    documents = [(index, "text", None) for index in range(64)]
+
+    with detection_pool(4) as executor:
+        assert executor is not None
+        results = list(detection_service.detect_many(documents, executor))
+
+    pids = {pid for _, pid, _ in results}
+    assert [key for key, _, _ in results] == list(range(64))
+    assert len(pids) > 1
+    assert os.getpid() not in pids
+
+
+def test_pooled_detection_matches_inline():
+    documents = _documents()
+    inline = list(detection_service.detect_many(documents))
+
+    with detection_pool(2) as executor:
+        pooled = list(detection_service.detect_many(documents, executor))
+
+    assert [(key, result.document_type, result.confidence, error) for key, result, error in pooled] == [
+        (key, result.document_type, result.confidence, error) for key, result, error in inline
+    ]
+
+
+def test_detect_many_reports_failures_in_order(monkeypatch):
+    def detect_document_type(text_content, filename=None, matcher=None):
+        if text_content == "bad":
+            raise ValueError("no text")
+        return text_content
+
+    monkeypatch.setattr(detection_service, "detect_document_type", detect_document_type)
+    results = list(detection_service.detect_many([(1, "good", None), (2, "bad", None), (3, "fine", None)]))
+    assert results == [(1, "good", None), (2, None, "no text"), (3, "fine", None)]
+
+
+def test_daemonic_process_detects_inline():
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_pool_started_in_daemon, args=(results,), daemon=True)
+    process.start()
+    process.join(30)
+    assert results.get(timeout=5) is True
+
+
+def test_single_worker_detects_inline():
+    with detection_pool(1) as executor:
+        assert executor is None
+
+
+def test_batch_task_runs_where_a_pool_can_start():
+    # Prefork children are daemonic; the batch task must run in a worker's main process
+    queue = TASK_ROUTES[BATCH_TASK]["queue"]
+    assert worker_profile(queue)["pool"] in ("solo", "threads")
@@ -0,0 +1,247 @@
+"""
+Tests for the fair document scheduler on an in-memory Redis
+
+Documents are named "<org>-<n>", n counting each organization's submissions from 0.
+"""
+import json
+import time
+
+import pytest
+
+from app.config import settings
+from app.services.document_scheduler import BULK_LANE, INTERACTIVE_LANE, DocumentScheduler
+
+
+def make_scheduler(redis_client, max_in_flight=100, org_max_in_flight=100, interactive_org_max_queued=100):
+    scheduler = DocumentScheduler(
+        max_in_flight=max_in_flight,
+        org_max_in_flight=org_max_in_flight,
+        interactive_org_max_queued=interactive_org_max_queued,
+        default_duration_seconds=60.0
+    )
+    scheduler._redis = redis_client
+    return scheduler
+
+
+def enqueue(scheduler, org_id, count, lane=BULK_LANE):
+    queued = scheduler.redis.llen(scheduler._key("queue", lane, org_id))
+    return [scheduler.enqueue(f"{org_id}-{n}", org_id, lane, {"filename": f"{org_id}-{n}.pdf"})
+            for n in range(queued, queued + count)]
+
+
+def dispatch_all(scheduler):
+    """Document ids in the order next_entry hands them out, until it hands out none"""
+    order = []
+    while (entry := scheduler.next_entry()) is not None:
+        order.append(entry["document_id"])
+    return order
+
+
+def in_flight(scheduler):
+    return sorted(scheduler._text(document_id) for document_id in scheduler.redis.hkeys(scheduler._key("in-flight")))
+
+
+def test_dispatch_shares_capacity_by_weight(redis_client):
+    scheduler = make_scheduler(redis_client)
+    scheduler.set_weight("a", 2.0)
+    scheduler.set_weight("b", 1.0)
+    enqueue(scheduler, "a", 6)
+    enqueue(scheduler, "b", 3)
+
+    # a's virtual time moves half as fast as b's; equal times go in org id order
+    assert dispatch_all(scheduler) == ["a-0", "b-0", "a-1", "a-2", "b-1", "a-3", "a-4", "b-2", "a-5"]
+
+
+def test_dispatch_keeps_each_organization_in_submission_order(redis_client):
+    scheduler = make_scheduler(redis_client)
+    enqueue(scheduler, "a", 3)
+    enqueue(scheduler, "b", 3)
+
+    order = dispatch_all(scheduler)
+    assert order == ["a-0", "b-0", "a-1", "b-1", "a-2", "b-2"]
+    assert scheduler.queued_orgs() == []
+
+
+def test_dispatch_entry_carries_submission(redis_client):
+    scheduler = make_scheduler(redis_client)
+    enqueue(scheduler, "a", 1, lane=INTERACTIVE_LANE)
+
+    entry = scheduler.next_entry()
+    assert {key: entry[key] for key in ("document_id", "org_id", "lane", "filename")} == {
+        "document_id": "a-0", "org_id": "a", "lane": INTERACTIVE_LANE, "filename": "a-0.pdf"
+    }
+
+
+def test_interactive_lane_goes_first(redis_client):
+    scheduler = make_scheduler(redis_client)
+    enqueue(scheduler, "a", 2, lane=BULK_LANE)
+    enqueue(scheduler, "b", 2, lane=INTERACTIVE_LANE)
+
+    assert dispatch_all(scheduler) == ["b-0", "b-1", "a-0", "a-1"]
+
+
+def test_interactive_submissions_over_limit_go_to_bulk(redis_client):
+    scheduler = make_scheduler(redis_client, interactive_org_max_queued=2)
+
+    assert enqueue(scheduler, "a", 4, lane=INTERACTIVE_LANE) == [INTERACTIVE_LANE, INTERACTIVE_LANE, BULK_LANE, BULK_LANE]
+    # Another organization still has its own interactive allowance
+    assert enqueue(scheduler, "b", 1, lane=INTERACTIVE_LANE) == [INTERACTIVE_LANE]
+    assert dispatch_all(scheduler) == ["a-0", "b-0", "a-1", "a-2", "a-3"]
+
+
+def test_global_in_flight_cap(redis_client):
+    scheduler = make_scheduler(redis_client, max_in_flight=3)
+    for org_id in ("a", "b", "c"):
+        enqueue(scheduler, org_id, 2)
+
+    assert dispatch_all(scheduler) == ["a-0", "b-0", "c-0"]
+
+    assert scheduler.finish("b-0")
+    assert dispatch_all(scheduler) == ["a-1"]
+    assert in_flight(scheduler) == ["a-0", "a-1", "c-0"]
+
+
+def test_org_in_flight_cap(redis_client):
+    scheduler = make_scheduler(redis_client, max_in_flight=10, org_max_in_flight=2)
+    enqueue(scheduler, "a", 5, lane=INTERACTIVE_LANE)
+    enqueue(scheduler, "b", 3)
+
+    # a is skipped at its cap, and b's bulk documents take the free slots
+    assert dispatch_all(scheduler) == ["a-0", "a-1", "b-0", "b-1"]
+
+    assert scheduler.finish("a-0")
+    assert dispatch_all(scheduler) == ["a-2"]
+    assert scheduler.finish("b-1")
+    assert dispatch_all(scheduler) == ["b-2"]
+
+
+@pytest.mark.parametrize("max_in_flight, org_max_in_flight", [(1, 1), (3, 2), (4, 1), (5, 3)])
+def test_in_flight_caps_hold_while_draining(redis_client, max_in_flight, org_max_in_flight):
+    scheduler = make_scheduler(redis_client, max_in_flight=max_in_flight, org_max_in_flight=org_max_in_flight)
+    scheduler.set_weight("a", 4.0)
+    enqueue(scheduler, "a", 8)
+    enqueue(scheduler, "b", 5)
+    enqueue(scheduler, "c", 3, lane=INTERACTIVE_LANE)
+
+    dispatched = []
+    while True:
+        dispatched += dispatch_all(scheduler)
+        running = in_flight(scheduler)
+        assert len(running) <= max_in_flight
+        for org_id in ("a", "b", "c"):
+            assert sum(document_id.startswith(org_id) for document_id in running) <= org_max_in_flight
+        if not running:
+            break
+        scheduler.finish(running[0])
+
+    assert len(dispatched) == 16
+    assert set(dispatched) == {f"a-{n}" for n in range(8)} | {f"b-{n}" for n in range(5)} | {f"c-{n}" for n in range(3)}
+
+
+def test_requeue_puts_entry_back_at_head(redis_client):
+    scheduler = make_scheduler(redis_client)
+    enqueue(scheduler, "a", 3)
+    enqueue(scheduler, "b", 1)
+
+    entry = scheduler.next_entry()
+    assert entry["document_id"] == "a-0"
+    scheduler.requeue(entry)
+
+    # The slot is freed, and a-0 is next for a again, ahead of a-1
+    assert in_flight(scheduler) == []
+    assert scheduler.queue_position("a-0")["org_queued_ahead"] == 0
+    assert dispatch_all(scheduler) == ["b-0", "a-0", "a-1", "a-2"]
+
+
+def test_requeue_restores_emptied_queue(redis_client):
+    scheduler = make_scheduler(redis_client)
+    enqueue(scheduler, "a", 1)
+
+    entry = scheduler.next_entry()
+    assert scheduler.queued_orgs() == []
+    scheduler.requeue(entry)
+
+    assert scheduler.queued_orgs() == ["a"]
+    assert dispatch_all(scheduler) == ["a-0"]
+
+
+def test_finish_frees_slot_once(redis_client):
+    scheduler = make_scheduler(redis_client, max_in_flight=1)
+    enqueue(scheduler, "a", 2)
+
+    assert dispatch_all(scheduler) == ["a-0"]
+    assert scheduler.finish("a-0")
+    assert not scheduler.finish("a-0")
+    assert not scheduler.finish("never-queued")
+    assert dispatch_all(scheduler) == ["a-1"]
+    assert redis_client.hget(scheduler._key("in-flight-orgs"), "a") == b"1"
+
+
+def test_reap_stale_frees_lost_slots(redis_client):
+    scheduler = make_scheduler(redis_client, org_max_in_flight=2)
+    enqueue(scheduler, "a", 3)
+    assert dispatch_all(scheduler) == ["a-0", "a-1"]
+
+    # a-0 was dispatched before the in-flight timeout; a-1 is still running
+    record = json.loads(redis_client.hget(scheduler._key("in-flight"), "a-0"))
+    record["dispatched_at"] = time.time() - settings.SCHEDULER_IN_FLIGHT_TIMEOUT_SECONDS - 1
+    redis_client.hset(scheduler._key("in-flight"), "a-0", json.dumps(record))
+
+    assert scheduler.reap_stale() == ["a-0"]
+    assert in_flight(scheduler) == ["a-1"]
+    assert scheduler.reap_stale() == []
+    # Reclaiming records no duration
+    assert redis_client.get(scheduler._key("duration")) is None
+    assert dispatch_all(scheduler) == ["a-2"]
+
+
+def test_queue_position_of_dispatched_and_unknown(redis_client):
+    scheduler = make_scheduler(redis_client)
+    enqueue(scheduler, "a", 1)
+    scheduler.next_entry()
+
+    position = scheduler.queue_position("a-0")
+    assert (position["state"], position["position"], position["lane"]) == ("dispatched", 0, BULK_LANE)
+
+    scheduler.finish("a-0")
+    assert scheduler.queue_position("a-0") is None
+    assert scheduler.queue_position("never-queued") is None
+
+
+@pytest.mark.parametrize("weights, queued, dispatched_first", [
+    ({"a": 2.0, "b": 1.0}, {"a": 6, "b": 3}, 0),
+    ({}, {"a": 3, "b": 3, "c": 3}, 0),
+    ({"a": 4.0, "c": 2.0}, {"a": 5, "b": 3, "c": (4, INTERACTIVE_LANE)}, 0),
+    ({"a": 3.0, "b": 1.5, "c": 0.25}, {"a": 9, "b": 6, "c": 4}, 0),
+    # Positions after some documents have started, so organizations' virtual times differ
+    ({"a": 3.0, "b": 1.5, "c": 0.25}, {"a": 9, "b": 6, "c": 4}, 5),
+    ({"a": 2.0, "b": 1.0}, {"a": 4, "b": (3, INTERACTIVE_LANE), "c": 4}, 3),
+])
+def test_queue_position_matches_dispatch_order(redis_client, weights, queued, dispatched_first):
+    scheduler = make_scheduler(redis_client)
+    for org_id, weight in weights.items():
+        scheduler.set_weight(org_id, weight)
+    waiting = []
+    for org_id, count in queued.items():
+        count, lane = count if isinstance(count, tuple) else (count, BULK_LANE)
+        enqueue(scheduler, org_id, count, lane=lane)
+        waiting += [f"{org_id}-{n}" for n in range(count)]
+    for _ in range(dispatched_first):
+        waiting.remove(scheduler.next_entry()["document_id"])
+    # An organization that joins now starts at the lane's virtual time
+    enqueue(scheduler, "d", 2)
+    waiting += ["d-0", "d-1"]
+
+    positions = {document_id: scheduler.queue_position(document_id)["position"] for document_id in waiting}
+
+    order = dispatch_all(scheduler)
+    assert {document_id: order.index(document_id) + 1 for document_id in waiting} == positions
+
+
+def test_queue_position_estimates_wait_from_slots(redis_client):
+    scheduler = make_scheduler(redis_client, max_in_flight=2, org_max_in_flight=2)
+    enqueue(scheduler, "a", 5)
+
+    waits = [scheduler.queue_position(f"a-{n}")["estimated_wait_seconds"] for n in range(5)]
+    # Two start at once, then two more after each measured (here, default) duration
+    assert waits == [0.0, 0.0, 60.0, 60.0, 120.0]
@@ -0,0 +1,201 @@
+"""
+Tests for the OCR result cache and its disk and Redis backends
+
+Time in the cache module is a FakeClock, so expiry and recency are set by the test.
+The Redis backend runs on an in-memory Redis, which expires keys on the real clock.
+"""
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import ocr_cache_service
+from app.services.ocr_cache_service import (
+    LocalDiskCacheBackend, OCRCacheBackend, OCRResultCache, RedisCacheBackend, compute_content_hash
+)
+
+TTL_SECONDS = 3600
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = time.time()
+
+    def time(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(ocr_cache_service, "time", SimpleNamespace(time=clock.time))
+    return clock
+
+
+@pytest.fixture
+def disk_backend(tmp_path, clock):
+    return LocalDiskCacheBackend(str(tmp_path / "ocr-cache"), max_bytes=250)
+
+
+@pytest.fixture
+def redis_backend(redis_client, clock):
+    return RedisCacheBackend(max_bytes=250)
+
+
+@pytest.fixture(params=["disk", "redis"])
+def backend(request):
+    return request.getfixturevalue(f"{request.param}_backend")
+
+
+def test_backend_interface_is_abstract():
+    with pytest.raises(TypeError):
+        OCRCacheBackend()
+
+    class GetOnly(OCRCacheBackend):
+        def get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        GetOnly()
+
+
+def test_backend_round_trip(backend):
+    assert backend.get("a") is None
+
+    backend.set("a", b"first", TTL_SECONDS)
+    backend.set("a", b"second", TTL_SECONDS)
+    assert backend.get("a") == b"second"
+
+    backend.delete("a")
+    backend.delete("never-set")
+    assert backend.get("a") is None
+
+
+def test_backend_evicts_least_recently_used(backend, clock):
+    backend.set("a", b"a" * 100, TTL_SECONDS)
+    clock.advance(1)
+    backend.set("b", b"b" * 100, TTL_SECONDS)
+    clock.advance(1)
+    # Reading a makes b the least recently used
+    assert backend.get("a") == b"a" * 100
+    clock.advance(1)
+
+    backend.set("c", b"c" * 100, TTL_SECONDS)
+
+    assert backend.get("b") is None
+    assert backend.get("a") == b"a" * 100
+    assert backend.get("c") == b"c" * 100
+
+
+def test_backend_evicts_until_under_limit(backend, clock):
+    for key in "abc":
+        backend.set(key, key.encode() * 80, TTL_SECONDS)
+        clock.advance(1)
+
+    # 240 + 200 bytes: the three older entries have to go for the new one to fit
+    backend.set("d", b"d" * 200, TTL_SECONDS)
+
+    assert [key for key in "abcd" if backend.get(key) is not None] == ["d"]
+
+
+def test_disk_entry_expires(disk_backend, clock):
+    disk_backend.set("a", b"value", TTL_SECONDS)
+    clock.advance(TTL_SECONDS - 1)
+    assert disk_backend.get("a") == b"value"
+
+    # Reading does not extend the expiry
+    clock.advance(2)
+    assert disk_backend.get("a") is None
+    assert not list(disk_backend.cache_dir.glob("*.bin"))
+
+
+def test_disk_eviction_drops_expired_entries_first(disk_backend, clock):
+    disk_backend.set("a", b"a" * 100, 10)
+    disk_backend.set("b", b"b" * 100, TTL_SECONDS)
+    clock.advance(20)
+
+    # a has expired; dropping it makes room without evicting b
+    disk_backend.set("c", b"c" * 100, TTL_SECONDS)
+
+    assert sorted(path.stem for path in disk_backend.cache_dir.glob("*.bin")) == ["b", "c"]
+
+
+def test_redis_entry_expires(redis_backend, redis_client):
+    redis_backend.set("a", b"value", TTL_SECONDS)
+    key = RedisCacheBackend.KEY_PREFIX + "a"
+    assert TTL_SECONDS - 5 < redis_client.ttl(key) <= TTL_SECONDS
+
+    redis_client.pexpire(key, 1)
+    time.sleep(0.01)
+
+    assert redis_backend.get("a") is None
+    # Its recency and size are forgotten with it
+    assert redis_client.zscore(RedisCacheBackend.LRU_KEY, "a") is None
+    assert redis_client.hget(RedisCacheBackend.SIZES_KEY, "a") is None
+
+
+def test_redis_tracks_sizes_of_live_entries(redis_backend, redis_client):
+    redis_backend.set("a", b"a" * 100, TTL_SECONDS)
+    redis_backend.set("b", b"b" * 100, TTL_SECONDS)
+    redis_backend.set("c", b"c" * 100, TTL_SECONDS)
+
+    assert redis_client.hgetall(RedisCacheBackend.SIZES_KEY) == {b"b": b"100", b"c": b"100"}
+    assert redis_client.zrange(RedisCacheBackend.LRU_KEY, 0, -1) == [b"b", b"c"]
+    assert redis_client.exists(RedisCacheBackend.KEY_PREFIX + "a") == 0
+
+
+CONTENT_HASH = compute_content_hash(b"%PDF-1.7 document")
+RESULT = {"full_text": "Allocation Agreement", "page_count": 2, "pages": [{"page_number": 1}, {"page_number": 2}]}
+
+
+def test_result_cache_round_trip(backend):
+    cache = OCRResultCache(backend, TTL_SECONDS)
+
+    assert cache.get(CONTENT_HASH, "prebuilt-read", "2024-11-30") is None
+    cache.set(CONTENT_HASH, "prebuilt-read", "2024-11-30", RESULT)
+
+    assert cache.get(CONTENT_HASH, "prebuilt-read", "2024-11-30") == RESULT
+    # Another model or API version is another entry
+    assert cache.get(CONTENT_HASH, "prebuilt-layout", "2024-11-30") is None
+    assert cache.get(CONTENT_HASH, "prebuilt-read", "2023-07-31") is None
+
+
+def test_result_cache_skips_failed_results(backend):
+    cache = OCRResultCache(backend, TTL_SECONDS)
+    cache.set(CONTENT_HASH, "prebuilt-read", "2024-11-30", {"error": "analysis failed"})
+
+    assert cache.get(CONTENT_HASH, "prebuilt-read", "2024-11-30") is None
+
+
+def test_result_cache_treats_unreadable_entry_as_miss(backend):
+    cache = OCRResultCache(backend, TTL_SECONDS)
+    backend.set(cache.make_key(CONTENT_HASH, "prebuilt-read", "2024-11-30"), b"not compressed", TTL_SECONDS)
+
+    assert cache.get(CONTENT_HASH, "prebuilt-read", "2024-11-30") is None
+
+
+def test_result_cache_survives_backend_failure():
+    class BrokenBackend(OCRCacheBackend):
+        def get(self, key):
+            raise ConnectionError("backend down")
+
+        def set(self, key, value, ttl_seconds):
+            raise ConnectionError("backend down")
+
+        def delete(self, key):
+            raise ConnectionError("backend down")
+
+    cache = OCRResultCache(BrokenBackend(), TTL_SECONDS)
+    cache.set(CONTENT_HASH, "prebuilt-read", "2024-11-30", RESULT)
+    assert cache.get(CONTENT_HASH, "prebuilt-read", "2024-11-30") is None
+
+
+def test_disabled_result_cache():
+    cache = OCRResultCache(None, TTL_SECONDS)
+    cache.set(CONTENT_HASH, "prebuilt-read", "2024-11-30", RESULT)
+
+    assert not cache.enabled
+    assert cache.get(CONTENT_HASH, "prebuilt-read", "2024-11-30") is None
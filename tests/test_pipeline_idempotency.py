@@ -0,0 +1,282 @@
+"""
+Tests for idempotent pipeline submission on an in-memory Redis
+
+Celery is not involved: starting a pipeline is recorded by fake_celery, which also
+answers AsyncResult(task_id).state from its states dict (PENDING for unknown ids, as
+Celery does). Failing stages run as eager tasks (Task.apply).
+"""
+import uuid
+from types import SimpleNamespace
+
+import pytest
+from celery import states
+
+from app.services.document_scheduler import ENTRY_TTL_SECONDS, document_scheduler
+from app.services.pipeline_idempotency import PipelineIdempotency, content_hash_hex, pipeline_idempotency
+from app.tasks import document_tasks
+from app.tasks.retry_policies import STAGE_POLICIES
+from app.utils.exceptions import DocumentProcessingError
+
+CONTENT_HASH = bytes(range(32))
+
+
+@pytest.fixture
+def fake_celery(redis_client, monkeypatch):
+    """Started pipelines (document id, submission) and the states AsyncResult reports"""
+    fake = SimpleNamespace(started=[], states={})
+
+    def start_quick_detection(document_id, submission):
+        fake.started.append((document_id, submission))
+
+    monkeypatch.setattr(pipeline_idempotency, "_redis", redis_client)
+    monkeypatch.setattr(document_scheduler, "_redis", redis_client)
+    monkeypatch.setattr(document_tasks, "start_quick_detection", start_quick_detection)
+    monkeypatch.setattr(document_tasks, "request_dispatch", lambda: None)
+    monkeypatch.setattr(document_tasks.celery_app, "AsyncResult",
+                        lambda task_id, **kwargs: SimpleNamespace(state=fake.states.get(task_id, states.PENDING)))
+    return fake
+
+
+def submit(document_id, **kwargs):
+    return document_tasks.submit_quick_detection(document_id, content_hash=CONTENT_HASH, **kwargs)
+
+
+def claim_holder(redis_client, document_id, content_hash=CONTENT_HASH):
+    holder = redis_client.get(pipeline_idempotency.submission_key(document_id, content_hash_hex(content_hash)))
+    return holder.decode() if holder else None
+
+
+@pytest.mark.parametrize("content_hash, hex_hash", [
+    (None, None),
+    (b"\x01\xab", "01ab"),
+    ("01ab", "01ab"),
+    ("\\x01ab", "01ab"),
+])
+def test_content_hash_hex(content_hash, hex_hash):
+    assert content_hash_hex(content_hash) == hex_hash
+
+
+def test_claim_is_held_by_one_task(redis_client):
+    idempotency = PipelineIdempotency(claim_ttl_seconds=60, completed_ttl_seconds=60)
+    idempotency._redis = redis_client
+
+    assert idempotency.claim("key", "first") is None
+    assert idempotency.claim("key", "second") == "first"
+    # Only the holder moves, extends or drops the claim
+    assert not idempotency.take_over("key", "second", "third")
+    idempotency.extend("key", "second", 3600)
+    idempotency.release("key", "second")
+    assert redis_client.get("key") == b"first"
+    assert redis_client.ttl("key") <= 60
+
+    idempotency.extend("key", "first", 3600)
+    assert redis_client.ttl("key") > 60
+    assert idempotency.take_over("key", "first", "third")
+    assert idempotency.claim("key", "fourth") == "third"
+    idempotency.release("key", "third")
+    assert idempotency.claim("key", "fourth") is None
+
+
+def test_redis_failure_does_not_block_submission():
+    idempotency = PipelineIdempotency(claim_ttl_seconds=60, completed_ttl_seconds=60)
+    idempotency._redis = SimpleNamespace()  # Every command fails
+
+    assert idempotency.claim("key", "task") is None
+    assert idempotency.take_over("key", "stale", "task")
+    assert idempotency.completed_stage("document", None, "persist") is None
+
+
+def test_duplicate_submission_attaches_to_task_in_flight(fake_celery):
+    document_id = str(uuid.uuid4())
+    first = submit(document_id)
+    assert (first["status"], first["deduplicated"]) == ("queued", False)
+
+    for state in (states.PENDING, states.STARTED, states.RETRY):
+        fake_celery.states[first["task_id"]] = state
+        assert submit(document_id) == {"task_id": first["task_id"], "status": "in_progress", "deduplicated": True}
+
+    assert [submission["task_id"] for _, submission in fake_celery.started] == [first["task_id"]]
+
+
+def test_new_content_is_a_new_submission(fake_celery):
+    document_id = str(uuid.uuid4())
+    first = submit(document_id)
+    second = document_tasks.submit_quick_detection(document_id, content_hash=bytes(32))
+
+    assert second["task_id"] != first["task_id"]
+    assert len(fake_celery.started) == 2
+
+
+@pytest.mark.parametrize("state", sorted(states.READY_STATES))
+def test_stale_claim_is_taken_over(fake_celery, redis_client, state):
+    document_id = str(uuid.uuid4())
+    first = submit(document_id)
+    # The pipeline ended without releasing its claim (a lost worker)
+    fake_celery.states[first["task_id"]] = state
+
+    second = submit(document_id)
+    assert (second["status"], second["deduplicated"]) == ("queued", False)
+    assert second["task_id"] != first["task_id"]
+    assert claim_holder(redis_client, document_id) == second["task_id"]
+    assert [submission["task_id"] for _, submission in fake_celery.started] == [first["task_id"], second["task_id"]]
+
+
+def test_stale_claim_taken_over_by_another_submission(fake_celery, redis_client, monkeypatch):
+    document_id = str(uuid.uuid4())
+    first = submit(document_id)
+    fake_celery.states[first["task_id"]] = states.SUCCESS
+    key = pipeline_idempotency.submission_key(document_id, content_hash_hex(CONTENT_HASH))
+
+    # A concurrent submission takes the stale claim over first
+    take_over = pipeline_idempotency.take_over
+
+    def take_over_after_another(key, stale_task_id, task_id):
+        assert take_over(key, stale_task_id, "concurrent")
+        return take_over(key, stale_task_id, task_id)
+
+    monkeypatch.setattr(pipeline_idempotency, "take_over", take_over_after_another)
+
+    assert submit(document_id) == {"task_id": "concurrent", "status": "in_progress", "deduplicated": True}
+    assert redis_client.get(key) == b"concurrent"
+    assert len(fake_celery.started) == 1
+
+
+def test_completed_content_is_not_resubmitted(fake_celery):
+    document_id = str(uuid.uuid4())
+    pipeline_idempotency.complete_stage(document_id, content_hash_hex(CONTENT_HASH), "persist", {"task_id": "done"})
+
+    assert submit(document_id) == {"task_id": "done", "status": "completed", "deduplicated": True}
+    assert fake_celery.started == []
+
+
+def test_forced_resubmission_reruns_completed_content(fake_celery, redis_client):
+    document_id = str(uuid.uuid4())
+    pipeline_idempotency.complete_stage(document_id, content_hash_hex(CONTENT_HASH), "persist", {"task_id": "done"})
+
+    forced = submit(document_id, force=True)
+    assert (forced["status"], forced["deduplicated"]) == ("queued", False)
+    assert forced["task_id"] != "done"
+    assert claim_holder(redis_client, document_id) == forced["task_id"]
+    [(started_id, submission)] = fake_celery.started
+    assert started_id == document_id
+    assert (submission["task_id"], submission["force"]) == (forced["task_id"], True)
+
+
+def test_forced_resubmission_does_not_duplicate_task_in_flight(fake_celery):
+    document_id = str(uuid.uuid4())
+    first = submit(document_id)
+
+    assert submit(document_id, force=True) == {"task_id": first["task_id"], "status": "in_progress", "deduplicated": True}
+    assert len(fake_celery.started) == 1
+
+
+def test_claim_released_when_pipeline_fails_to_start(fake_celery, redis_client, monkeypatch):
+    def start_quick_detection(document_id, submission):
+        raise ConnectionError("broker down")
+
+    monkeypatch.setattr(document_tasks, "start_quick_detection", start_quick_detection)
+    document_id = str(uuid.uuid4())
+
+    with pytest.raises(ConnectionError):
+        submit(document_id)
+    assert claim_holder(redis_client, document_id) is None
+
+
+def test_scheduled_submission_holds_claim_while_queued(fake_celery, redis_client):
+    document_id = str(uuid.uuid4())
+    first = submit(document_id, org_id=str(uuid.uuid4()))
+
+    assert (first["status"], first["deduplicated"]) == ("queued", False)
+    assert fake_celery.started == []
+    key = pipeline_idempotency.submission_key(document_id, content_hash_hex(CONTENT_HASH))
+    assert pipeline_idempotency.claim_ttl_seconds < redis_client.ttl(key) <= ENTRY_TTL_SECONDS
+    assert submit(document_id)["task_id"] == first["task_id"]
+
+
+def stage_context(document_id, task_id):
+    return {
+        "document_id": document_id,
+        "user_id": None,
+        "org_id": str(uuid.uuid4()),
+        "content_hash": content_hash_hex(CONTENT_HASH),
+        "force": True,
+        "submission_key": pipeline_idempotency.submission_key(document_id, content_hash_hex(CONTENT_HASH)),
+        "submission_task_id": task_id
+    }
+
+
+@pytest.fixture
+def failing_detection(fake_celery, monkeypatch):
+    """Detection that always fails; the failures recorded on the document are collected"""
+    failures = []
+
+    async def detection_stage(context):
+        raise RuntimeError("detection crashed")
+
+    async def record_task_failure(document_uuid, user_uuid, action, details):
+        failures.append((str(document_uuid), action, details["stage"]))
+
+    monkeypatch.setattr(document_tasks, "detection_stage", detection_stage)
+    monkeypatch.setattr(document_tasks, "record_task_failure", record_task_failure)
+    return failures
+
+
+def test_claim_released_when_stage_fails(failing_detection, redis_client):
+    document_id = str(uuid.uuid4())
+    first = submit(document_id)
+
+    result = document_tasks.quick_detection_detect.apply(
+        args=[stage_context(document_id, first["task_id"])],
+        retries=STAGE_POLICIES["detect"].max_retries
+    )
+
+    assert result.state == states.FAILURE
+    assert failing_detection == [(document_id, "quick_detection_failed", "detect")]
+    assert claim_holder(redis_client, document_id) is None
+    assert submit(document_id)["task_id"] != first["task_id"]
+
+
+def test_claim_kept_while_stage_retries(failing_detection, redis_client):
+    document_id = str(uuid.uuid4())
+    first = submit(document_id)
+    retried = []
+
+    def retry(**kwargs):
+        retried.append(kwargs["countdown"])
+        return RuntimeError("retrying")
+
+    task = SimpleNamespace(max_retries=STAGE_POLICIES["detect"].max_retries, retry=retry,
+                           request=SimpleNamespace(id=first["task_id"], retries=0))
+    with pytest.raises(RuntimeError, match="retrying"):
+        document_tasks.fail_pipeline_stage(task, "detect", RuntimeError("detection crashed"),
+                                           stage_context(document_id, first["task_id"]))
+
+    assert retried == [STAGE_POLICIES["detect"].delay(0)]
+    assert failing_detection == []
+    assert claim_holder(redis_client, document_id) == first["task_id"]
+
+
+def test_claim_released_when_download_fails_permanently(fake_celery, redis_client, monkeypatch):
+    document_id = str(uuid.uuid4())
+    first = submit(document_id)
+    failures = []
+
+    async def download_stage(document_uuid, user_uuid, force=False):
+        raise DocumentProcessingError("gone", document_uuid, "document_lookup")
+
+    async def record_task_failure(document_uuid, user_uuid, action, details):
+        failures.append(details["stage"])
+
+    monkeypatch.setattr(document_tasks, "download_stage", download_stage)
+    monkeypatch.setattr(document_tasks, "record_task_failure", record_task_failure)
+
+    # No retries left to spend: the document is gone
+    result = document_tasks.process_document_quick_detection.apply(
+        args=[document_id],
+        kwargs={"submission_key": stage_context(document_id, first["task_id"])["submission_key"]},
+        task_id=first["task_id"]
+    )
+
+    assert result.state == states.FAILURE
+    assert failures == ["download"]
+    assert claim_holder(redis_client, document_id) is None
@@ -0,0 +1,206 @@
+"""
+Tests for the Azure rate limiter on an in-memory Redis
+
+The bucket and semaphore scripts read the Redis server's clock, which for fakeredis is
+the wall clock, so timings are real and kept to fractions of a second.
+"""
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import rate_limiter
+from app.services.rate_limiter import AzureRateLimiter, ModelLimits
+from app.utils.exceptions import RateLimitExceededError
+
+MODEL_ID = "prebuilt-read"
+
+
+def make_limiter(redis_client, rate_per_second=100.0, burst=100, max_in_flight=100, max_wait_seconds=5.0, overrides=None):
+    limiter = AzureRateLimiter(
+        ModelLimits(rate_per_second=rate_per_second, burst=burst, max_in_flight=max_in_flight),
+        overrides=overrides,
+        max_wait_seconds=max_wait_seconds
+    )
+    limiter._redis = redis_client
+    return limiter
+
+
+async def acquire_times(limiter, count, needs_token=True):
+    """Seconds from the start at which each of count sequential slots was acquired"""
+    started = time.monotonic()
+    times = []
+    for _ in range(count):
+        async with limiter.slot(MODEL_ID, needs_token=needs_token):
+            times.append(time.monotonic() - started)
+    return times
+
+
+def in_flight(limiter):
+    return limiter.redis.zcard(limiter._key(MODEL_ID, "in-flight"))
+
+
+def test_burst_goes_through_at_once(redis_client):
+    limiter = make_limiter(redis_client, rate_per_second=5.0, burst=4)
+
+    times = asyncio.run(acquire_times(limiter, 5))
+
+    assert max(times[:4]) < 0.1
+    # The fifth waits for a token at 5 per second
+    assert 0.15 <= times[4] < 0.6
+
+
+def test_bucket_refills_at_rate(redis_client):
+    limiter = make_limiter(redis_client, rate_per_second=20.0, burst=1)
+
+    times = asyncio.run(acquire_times(limiter, 7))
+
+    # One token at once, then one every 50ms
+    assert 0.25 <= times[-1] < 0.8
+    assert limiter.get_metrics()["models"][MODEL_ID]["tokens"] < 1
+
+
+def test_bucket_refills_to_burst_only(redis_client):
+    limiter = make_limiter(redis_client, rate_per_second=10.0, burst=2)
+
+    asyncio.run(acquire_times(limiter, 2))
+    time.sleep(0.5)  # Time for 5 tokens, of which only 2 fit
+
+    times = asyncio.run(acquire_times(limiter, 3))
+    assert max(times[:2]) < 0.05
+    assert times[2] >= 0.08
+
+
+def test_resumed_operations_take_no_token(redis_client):
+    limiter = make_limiter(redis_client, rate_per_second=1.0, burst=1)
+
+    times = asyncio.run(acquire_times(limiter, 5, needs_token=False))
+
+    assert times[-1] < 0.1
+    assert limiter.get_metrics()["models"][MODEL_ID]["tokens"] == pytest.approx(1.0)
+
+
+def test_in_flight_cap(redis_client, monkeypatch):
+    # Waiters for a slot poll; poll often so slots are taken as soon as they free up
+    monkeypatch.setattr(rate_limiter, "MAX_RETRY_SECONDS", 0.05)
+    limiter = make_limiter(redis_client, max_in_flight=2)
+    running = []
+    most_running = 0
+
+    async def operation():
+        nonlocal most_running
+        async with limiter.slot(MODEL_ID):
+            running.append(1)
+            most_running = max(most_running, len(running), in_flight(limiter))
+            await asyncio.sleep(0.1)
+            running.pop()
+
+    async def run_all():
+        started = time.monotonic()
+        await asyncio.gather(*(operation() for _ in range(6)))
+        return time.monotonic() - started
+
+    elapsed = asyncio.run(run_all())
+
+    assert most_running == 2
+    # Three rounds of two
+    assert 0.3 <= elapsed < 0.6
+    assert in_flight(limiter) == 0
+
+
+def test_in_flight_cap_per_model(redis_client):
+    limiter = make_limiter(redis_client, max_in_flight=1, max_wait_seconds=0.2,
+                           overrides={"prebuilt-layout": {"max_in_flight": 2}})
+
+    async def hold_slots():
+        async with limiter.slot(MODEL_ID), limiter.slot("prebuilt-layout"), limiter.slot("prebuilt-layout"):
+            metrics = limiter.get_metrics()["models"]
+            return metrics[MODEL_ID]["in_flight"], metrics["prebuilt-layout"]["in_flight"]
+
+    assert asyncio.run(hold_slots()) == (1, 2)
+    assert limiter.limits_for("prebuilt-layout") == ModelLimits(rate_per_second=100.0, burst=100, max_in_flight=2)
+
+
+def test_times_out_with_rate_limit_error(redis_client):
+    limiter = make_limiter(redis_client, max_in_flight=1, max_wait_seconds=0.3)
+
+    async def wait_behind_held_slot():
+        async with limiter.slot(MODEL_ID):
+            started = time.monotonic()
+            with pytest.raises(RateLimitExceededError) as raised:
+                async with limiter.slot(MODEL_ID):
+                    pytest.fail("acquired a slot over the cap")
+            return time.monotonic() - started, raised.value
+
+    waited, error = asyncio.run(wait_behind_held_slot())
+
+    assert 0.3 <= waited < 1.0
+    assert error.status_code == 429
+    assert error.context["retry_after"] == 0  # int(max_wait_seconds)
+    metrics = limiter.get_metrics()["models"][MODEL_ID]
+    assert (metrics["acquired"], metrics["rejected"], metrics["queue_depth"], metrics["in_flight"]) == (1, 1, 0, 0)
+
+
+def test_timed_out_waiter_gives_back_its_slot(redis_client):
+    # A slot is free but no token comes in time: the slot must not stay taken
+    limiter = make_limiter(redis_client, rate_per_second=0.5, burst=1, max_in_flight=1, max_wait_seconds=0.2)
+
+    async def drain_and_wait():
+        async with limiter.slot(MODEL_ID):
+            pass
+        with pytest.raises(RateLimitExceededError):
+            async with limiter.slot(MODEL_ID):
+                pass
+
+    asyncio.run(drain_and_wait())
+    assert in_flight(limiter) == 0
+
+
+def test_slot_released_when_body_raises(redis_client):
+    limiter = make_limiter(redis_client, max_in_flight=1, max_wait_seconds=0.2)
+
+    async def failing_operation():
+        async with limiter.slot(MODEL_ID):
+            assert in_flight(limiter) == 1
+            raise ValueError("analysis failed")
+
+    with pytest.raises(ValueError, match="analysis failed"):
+        asyncio.run(failing_operation())
+
+    assert in_flight(limiter) == 0
+    assert asyncio.run(acquire_times(limiter, 1))[0] < 0.1
+
+
+def test_slot_released_when_waiter_is_cancelled(redis_client):
+    limiter = make_limiter(redis_client, rate_per_second=0.5, burst=1, max_in_flight=1, max_wait_seconds=5.0)
+
+    async def cancel_waiter():
+        async with limiter.slot(MODEL_ID):
+            pass
+        # Holds the slot while it waits for a token
+        waiter = asyncio.create_task(acquire_times(limiter, 1))
+        await asyncio.sleep(0.1)
+        assert in_flight(limiter) == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+    asyncio.run(cancel_waiter())
+    assert in_flight(limiter) == 0
+    assert limiter.get_metrics()["models"][MODEL_ID]["queue_depth"] == 0
+
+
+def test_redis_failure_lets_calls_through():
+    limiter = make_limiter(SimpleNamespace(register_script=lambda source: None))
+
+    assert asyncio.run(acquire_times(limiter, 3)) == [pytest.approx(0, abs=0.1)] * 3
+
+
+def test_disabled_limiter_never_waits(redis_client):
+    limiter = make_limiter(redis_client, rate_per_second=0.1, burst=1, max_in_flight=1)
+    limiter.enabled = False
+
+    assert max(asyncio.run(acquire_times(limiter, 5))) < 0.1
+    assert limiter.get_metrics() == {"enabled": False}
+    assert redis_client.keys() == []
@@ -0,0 +1,109 @@
+"""
+Tests for bounded-window patterns (regex_safety) and the detection patterns written in that form
+"""
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.services.detection_service import detection_service
+from app.utils.nmtc_patterns import (
+    DOCUMENT_STRUCTURE_INDICATORS, DOCUMENT_TYPE_CHECKS, NMTC_KEY_FIELDS, NMTCPatterns
+)
+from app.utils.regex_safety import BOUNDED_WINDOW, bounded_pattern
+from benchmarks.corpus import adversarial_documents
+
+
+@pytest.mark.parametrize("pattern, bounded", [
+    (r'a.*b', r'a.{0,200}b'),
+    (r'a\s+b', r'a\s{1,200}b'),
+    (r'\d{2,}', r'\d{2,200}'),
+    (r'x{,}', r'x{0,200}'),
+    (r'x{300,}', r'x{300,300}'),
+    # Bounded repetitions are kept
+    (r'\d{2,5}', r'\d{2,5}'),
+    (r'\d{3}', r'\d{3}'),
+    (r'\d{,4}', r'\d{,4}'),
+    # Lazy and possessive suffixes stay on the capped repetition
+    (r'a.*?b', r'a.{0,200}?b'),
+    (r'a\s+?b', r'a\s{1,200}?b'),
+    (r'\d{2,}?', r'\d{2,200}?'),
+    (r'a.*+b', r'a.{0,200}+b'),
+    # Escaped quantifier characters are literals
+    (r'\*\+\{2,\}', r'\*\+\{2,\}'),
+    (r'\.+', r'\.{1,200}'),
+    (r'\\+', r'\\{1,200}'),
+    # Quantifier characters inside a class are literals; the class itself can repeat
+    (r'[*+]', r'[*+]'),
+    (r'[^]*]+', r'[^]*]{1,200}'),
+    (r'[\]*]*', r'[\]*]{0,200}'),
+    (r'[]a]+', r'[]a]{1,200}'),
+    # Groups repeat as a whole; (?: and alternations are not repeated
+    (r'(ab)*c', r'(ab){0,200}c'),
+    (r'(?:a|b)+', r'(?:a|b){1,200}'),
+    (r'(?i)ab+', r'(?i)ab{1,200}'),
+    # A brace that isn't a repetition is left alone
+    (r'a{b}', r'a{b}'),
+    (r'a{2,x}', r'a{2,x}'),
+])
+def test_bounded_pattern(pattern, bounded):
+    assert bounded_pattern(pattern, BOUNDED_WINDOW) == bounded
+    re.compile(bounded)
+
+
+@pytest.mark.parametrize("pattern, text", [
+    (r'total\s+assets.*interest', 'Total  assets of the fund bear interest'),
+    (r'\$[\d,]+\.?\d*', 'a loan of $1,250,000.00 at closing'),
+    (r'allocation.*?agreement', 'allocation agreement, allocation and agreement'),
+    (r'\d{2,}', '7 12 123 1234'),
+    (r'(?:ab)+c', 'ababababc abc c'),
+    (r'[^\n]*deductible', 'the policy deductible\nno deductible'),
+])
+def test_bounded_pattern_keeps_matches_of_runs_within_window(pattern, text):
+    def spans(regex):
+        return [match.span() for match in re.finditer(regex, text)]
+
+    assert spans(bounded_pattern(pattern)) == spans(pattern)
+    # Still equal with the window at the longest run in the text
+    assert spans(bounded_pattern(pattern, window=len(text))) == spans(pattern)
+
+
+def test_bounded_pattern_only_cuts_runs_longer_than_window():
+    text = "a" + "x" * 10 + "b"
+    assert re.search(bounded_pattern(r'a.*b', window=10), text).span() == (0, 12)
+    assert re.search(bounded_pattern(r'a.*b', window=9), text) is None
+
+
+def _source_patterns():
+    patterns = {
+        pattern
+        for categories in NMTCPatterns.DOCUMENT_PATTERNS.values()
+        for pattern_list in categories.values()
+        for pattern in pattern_list
+    }
+    patterns.update(pattern for field in NMTC_KEY_FIELDS.values() for pattern in field['patterns'])
+    patterns.update(DOCUMENT_STRUCTURE_INDICATORS.values())
+    patterns.update(pattern for _, checks in DOCUMENT_TYPE_CHECKS.values() for pattern in checks.values())
+    return sorted(patterns)
+
+
+@pytest.mark.parametrize("pattern", _source_patterns())
+def test_source_patterns_have_no_unbounded_bridge(pattern):
+    assert not re.search(r'(?<!\\)\.[*+]', pattern)
+
+
+@pytest.mark.parametrize("name", sorted(adversarial_documents(16 * 1024)))
+def test_detection_is_the_same_on_any_thread(name):
+    text = adversarial_documents(16 * 1024)[name]
+
+    def detect():
+        result = detection_service.detect_document_type(text)
+        return (
+            result.document_type,
+            result.confidence,
+            [(m.pattern_type, m.start, m.end) for m in result.primary_indicators + result.secondary_indicators],
+            result.metadata.get("extracted_fields")
+        )
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        assert executor.submit(detect).result() == detect()
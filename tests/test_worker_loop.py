@@ -0,0 +1,188 @@
+"""
+Tests for the per-process worker event loop, driven from the main thread (prefork and
+solo pools) and from other threads (threads pool; gevent in a monkey-patched subprocess)
+"""
+import asyncio
+import subprocess
+import sys
+import textwrap
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+from app.utils.worker_loop import WorkerEventLoop
+
+
+class StageError(Exception):
+    pass
+
+
+async def where(delay: float = 0.0):
+    """The loop and the thread running this coroutine"""
+    await asyncio.sleep(delay)
+    return asyncio.get_running_loop(), threading.current_thread()
+
+
+async def fail(delay: float = 0.0):
+    await asyncio.sleep(delay)
+    raise StageError("stage failed")
+
+
+@pytest.fixture
+def worker_loop():
+    loop = WorkerEventLoop()
+    yield loop
+    loop.close()
+
+
+def test_main_thread_runs_on_one_loop_until_complete(worker_loop):
+    first_loop, first_thread = worker_loop.run(where())
+    second_loop, second_thread = worker_loop.run(where(0.01))
+
+    assert first_loop is second_loop
+    assert first_thread is second_thread is threading.main_thread()
+    assert not first_loop.is_running()
+    # No loop thread is started for the main thread
+    assert worker_loop._thread_loop is None
+
+
+def test_main_thread_raises_coroutine_error(worker_loop):
+    with pytest.raises(StageError, match="stage failed"):
+        worker_loop.run(fail())
+
+    # The loop is still usable by the next task
+    loop, _ = worker_loop.run(where())
+    assert loop is worker_loop._loop and not loop.is_closed()
+
+
+def test_threads_share_one_loop_thread(worker_loop):
+    def run_task(_):
+        return (*worker_loop.run(where(0.1)), threading.current_thread())
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(run_task, range(8)))
+    elapsed = time.perf_counter() - started
+
+    loops = {loop for loop, _, _ in results}
+    threads = {thread for _, thread, _ in results}
+    assert len(loops) == len(threads) == 1
+    assert threads.pop() not in {threading.main_thread(), *(caller for _, _, caller in results)}
+    # The coroutines waited together on the loop, not one after another
+    assert elapsed < 0.5
+    assert worker_loop._loop is None
+
+
+def test_thread_raises_coroutine_error(worker_loop):
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        failed = executor.submit(worker_loop.run, fail(0.01))
+        succeeded = executor.submit(worker_loop.run, where(0.02))
+
+        with pytest.raises(StageError, match="stage failed"):
+            failed.result()
+        loop, _ = succeeded.result()
+
+    assert loop is worker_loop._thread_loop and loop.is_running()
+
+
+def test_main_thread_and_threads_use_separate_loops(worker_loop):
+    main_loop, _ = worker_loop.run(where())
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        thread_loop, _ = executor.submit(worker_loop.run, where()).result()
+
+    assert main_loop is not thread_loop
+
+
+def test_new_loops_after_fork(worker_loop):
+    main_loop, _ = worker_loop.run(where())
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        thread_loop, _ = executor.submit(worker_loop.run, where()).result()
+
+    # As seen from a forked child: the parent's loops are not this process's
+    worker_loop._pid = -1
+    assert worker_loop.run(where())[0] is not main_loop
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        assert executor.submit(worker_loop.run, where()).result()[0] is not thread_loop
+
+    thread_loop.call_soon_threadsafe(thread_loop.stop)
+    main_loop.close()
+
+
+def test_close_cancels_outstanding_work(worker_loop):
+    cancelled = threading.Event()
+
+    async def outstanding():
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    worker_loop.run(where())
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        thread_loop, _ = executor.submit(worker_loop.run, where()).result()
+    asyncio.run_coroutine_threadsafe(outstanding(), thread_loop)
+    main_loop = worker_loop._loop
+
+    worker_loop.close()
+
+    assert cancelled.wait(5)
+    assert main_loop.is_closed()
+    for _ in range(50):
+        if thread_loop.is_closed():
+            break
+        time.sleep(0.1)
+    assert thread_loop.is_closed()
+
+
+GEVENT_SCRIPT = textwrap.dedent("""
+    from gevent import monkey
+    monkey.patch_all()
+
+    import asyncio
+    import time
+
+    import gevent
+
+    from app.utils.worker_loop import WorkerEventLoop, green_pool
+
+    assert green_pool() == "gevent"
+    worker_loop = WorkerEventLoop()
+
+    async def task(n):
+        await asyncio.sleep(0.2)
+        if n == 3:
+            raise ValueError("stage failed")
+        return n
+
+    ticks = []
+
+    def heartbeat():
+        while len(ticks) < 10:
+            ticks.append(time.perf_counter())
+            gevent.sleep(0.01)
+
+    started = time.perf_counter()
+    beat = gevent.spawn(heartbeat)
+    greenlets = [gevent.spawn(worker_loop.run, task(n)) for n in range(8)]
+    gevent.joinall(greenlets + [beat])
+    elapsed = time.perf_counter() - started
+
+    assert [g.value for n, g in enumerate(greenlets) if n != 3] == [0, 1, 2, 4, 5, 6, 7]
+    assert isinstance(greenlets[3].exception, ValueError)
+    # Greenlets waited together, and the hub kept running while they did
+    assert elapsed < 1.0, elapsed
+    assert len(ticks) == 10 and ticks[-1] - ticks[0] < 0.5
+    worker_loop.close()
+    print("ok")
+""")
+
+
+def test_gevent_greenlets_wait_without_blocking_hub():
+    pytest.importorskip("gevent")
+    completed = subprocess.run([sys.executable, "-c", GEVENT_SCRIPT], cwd=Path(__file__).parents[1],
+                               capture_output=True, text=True, timeout=60)
+    assert completed.stdout.strip() == "ok", completed.stderr